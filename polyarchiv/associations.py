@@ -0,0 +1,105 @@
+# -*- coding=utf-8 -*-
+"""Associations between collect points and backup points, based on their tags.
+
+A backup point is associated to a collect point if no tag is excluded (on both sides)
+and if a tag is included (on any side). Tags are matched against shell-style patterns:
+literal patterns are stored in a set and the other ones are compiled into a single
+regexp. All pairs are checked once, when the configuration is loaded, and
+:class:`AssociationIndex` answers by set lookups.
+
+"""
+from __future__ import unicode_literals
+
+import fnmatch
+import re
+
+# noinspection PyProtectedMember
+from polyarchiv._vendor.lru_cache import lru_cache
+
+__author__ = "Matthieu Gallet"
+
+WILDCARDS = "*?["
+
+
+class TagPatterns(object):
+    """Compiled list of shell-style patterns
+
+    >>> patterns = TagPatterns(["backup", "db-*"])
+    >>> patterns.match_any(["collect", "db-mysql"])
+    True
+    >>> patterns.match_any(["collect", "backups"])
+    False
+    """
+
+    def __init__(self, patterns):
+        self.literals = {x for x in patterns if not any(c in x for c in WILDCARDS)}
+        wildcards = [x for x in patterns if x not in self.literals]
+        self.regexp = None
+        if wildcards:
+            self.regexp = re.compile(
+                "|".join("(?:%s)" % fnmatch.translate(x) for x in wildcards)
+            )
+
+    def match_any(self, tags):
+        """return True if at least one tag matches at least one pattern"""
+        for tag in tags:
+            if tag in self.literals:
+                return True
+            elif self.regexp is not None and self.regexp.match(tag):
+                return True
+        return False
+
+
+@lru_cache(maxsize=1024)
+def get_tag_patterns(patterns):
+    """:param patterns: tuple of patterns (points usually share the same ones)"""
+    return TagPatterns(patterns)
+
+
+@lru_cache(maxsize=4096)
+def match_tags(patterns, tags):
+    """:param patterns: tuple of patterns
+    :param tags: tuple of tags"""
+    return get_tag_patterns(patterns).match_any(tags)
+
+
+def can_associate(collect_point, backup_point):
+    """Return True if the backup point can be associated to the collect point"""
+    collect_point_tags = tuple(collect_point.collect_point_tags)
+    backup_point_tags = tuple(backup_point.backup_point_tags)
+    excluded = match_tags(
+        tuple(backup_point.excluded_collect_point_tags), collect_point_tags
+    ) or match_tags(tuple(collect_point.excluded_backup_point_tags), backup_point_tags)
+    if excluded:
+        return False
+    return match_tags(
+        tuple(backup_point.included_collect_point_tags), collect_point_tags
+    ) or match_tags(tuple(collect_point.included_backup_point_tags), backup_point_tags)
+
+
+class AssociationIndex(object):
+    """All associated pairs of collect points and backup points, computed once.
+
+    :param collect_points: list of :class:`polyarchiv.collect_points.CollectPoint`
+    :param backup_points: list of :class:`polyarchiv.backup_points.BackupPoint`
+    """
+
+    def __init__(self, collect_points, backup_points):
+        self.pairs = {
+            (collect_point.name, backup_point.name)
+            for collect_point in collect_points
+            for backup_point in backup_points
+            if can_associate(collect_point, backup_point)
+        }
+
+    def can_associate(self, collect_point, backup_point):
+        """Return True if the backup point can be associated to the collect point"""
+        return (collect_point.name, backup_point.name) in self.pairs
+
+    def filter_collect_points(self, collect_points, backup_point):
+        """return the collect points that can be associated to the backup point"""
+        return [x for x in collect_points if self.can_associate(x, backup_point)]
+
+    def filter_backup_points(self, backup_points, collect_point):
+        """return the backup points that can be associated to the collect point"""
+        return [x for x in backup_points if self.can_associate(collect_point, x)]
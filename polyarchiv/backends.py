@@ -13,13 +13,12 @@ Authentication methods:
 """
 from __future__ import unicode_literals
 
+import json
 import os
 import shlex
 import shutil
 from xml.dom.minidom import parseString
 
-# noinspection PyProtectedMember
-from polyarchiv._vendor import requests
 from polyarchiv.points import Config
 
 try:
@@ -33,6 +32,7 @@ except ImportError:
     from urllib import urlencode, quote_plus
 
 DOWNLOAD_CHUNK_SIZE_BYTES = 1 * 1024 * 1024
+VALIDATORS_SUFFIX = ".validators"  # ETag and Last-Modified of a downloaded file
 
 
 def get_backend(
@@ -161,6 +161,10 @@ class StorageBackend(object):
     def sync_file_to_local(self, local_filename, filename=""):
         raise NotImplementedError
 
+    def sync_file_to_local_if_modified(self, local_filename, filename=""):
+        """like `sync_file_to_local`, but may skip the transfer of an unmodified file"""
+        self.sync_file_to_local(local_filename, filename=filename)
+
     def sync_file_from_local(self, local_filename, filename=""):
         raise NotImplementedError
 
@@ -241,6 +245,9 @@ class HTTPRequestsStorageBackend(StorageBackend):
         curl_command="curl",
         keytab=None,
     ):
+        # noinspection PyProtectedMember
+        from polyarchiv._vendor import requests  # slow to import: only when required
+
         super(HTTPRequestsStorageBackend, self).__init__(repository)
         self.query = query
         if root_url.endswith("/"):
@@ -312,6 +319,11 @@ class HTTPRequestsStorageBackend(StorageBackend):
             filename = "/" + filename
         self.download_file(filename, local_filename)
 
+    def sync_file_to_local_if_modified(self, local_filename, filename=""):
+        if filename:
+            filename = "/" + filename
+        self.download_file(filename, local_filename, conditional=True)
+
     def sync_file_from_local(self, local_filename, filename=""):
         if filename:
             filename = "/" + filename
@@ -390,7 +402,7 @@ class HTTPRequestsStorageBackend(StorageBackend):
             with open(local_path, "rb") as fd:
                 self.send("PUT", (200, 201, 204), url=url, data=fd)
 
-    def download_file(self, suffix, local_path):
+    def download_file(self, suffix, local_path, conditional=False):
         if os.path.isdir(local_path) and self.can_execute_command(
             ["rm", "-rf"] + local_path
         ):
@@ -398,10 +410,49 @@ class HTTPRequestsStorageBackend(StorageBackend):
         self.ensure_dir(local_path, parent=True)
         url = self.get_url(suffix)
         if self.can_execute_command(self.get_curl_command(url, "-O", local_path)):
-            response = self.send("GET", 200, url=url, stream=True)
-            with open(local_path, "wb") as fd:
-                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
-                    fd.write(chunk)
+            self.write_response(local_path, conditional, url=url)
+
+    def write_response(self, local_path, conditional=False, **kwargs):
+        """Download a file to `local_path`.
+
+        :param conditional: the ETag and Last-Modified headers of the response are
+            stored next to `local_path`, and sent with the next requests to avoid the
+            download of an unmodified file
+        :param kwargs: `url` or `suffix` of the file
+        :return: False if the file has not been modified
+        """
+        validators_path = local_path + VALIDATORS_SUFFIX
+        headers = {}
+        if (
+            conditional
+            and os.path.isfile(local_path)
+            and os.path.isfile(validators_path)
+        ):
+            with open(validators_path, "r") as fd:
+                validators = json.load(fd)
+            if validators.get("etag"):
+                headers["If-None-Match"] = validators["etag"]
+            if validators.get("last_modified"):
+                headers["If-Modified-Since"] = validators["last_modified"]
+        expected_codes = (200, 304) if headers else 200
+        response = self.send(
+            "GET", expected_codes, stream=True, headers=headers, **kwargs
+        )
+        if response.status_code == 304:
+            return False
+        with open(local_path, "wb") as fd:
+            for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
+                fd.write(chunk)
+        if conditional:
+            validators = {
+                "etag": response.headers.get("ETag"),
+                "last_modified": response.headers.get("Last-Modified"),
+            }
+            with open(validators_path, "w") as fd:
+                json.dump(validators, fd)
+        elif os.path.isfile(validators_path):
+            os.remove(validators_path)
+        return True
 
     def walk(self, suffix="/"):
         dirnames, filenames = self.ls(suffix=suffix)
@@ -519,6 +570,9 @@ class HTTPCurlStorageBackend(HTTPRequestsStorageBackend):
     def sync_file_to_local(self, local_filename, filename="/filename"):
         self.download_file("/" + filename, local_filename)
 
+    def sync_file_to_local_if_modified(self, local_filename, filename="/filename"):
+        self.download_file("/" + filename, local_filename, conditional=True)
+
     def sync_file_from_local(self, local_filename, filename="filename"):
         self.upload_file("/" + filename, local_filename)
 
@@ -539,16 +593,13 @@ class HTTPCurlStorageBackend(HTTPRequestsStorageBackend):
             with open(local_path, "rb") as fd:
                 self.send("PUT", (200, 201, 204), suffix=suffix, data=fd)
 
-    def download_file(self, suffix, local_path):
+    def download_file(self, suffix, local_path, conditional=False):
         if os.path.isdir(local_path) and self.can_execute_command(
             ["rm", "-rf"] + local_path
         ):
             shutil.rmtree(local_path)
         if self.can_execute_command(self.get_curl_command(suffix, "-O", local_path)):
-            response = self.send("GET", 200, suffix=suffix, stream=True)
-            with open(local_path, "wb") as fd:
-                for chunk in response.iter_content(DOWNLOAD_CHUNK_SIZE_BYTES):
-                    fd.write(chunk)
+            self.write_response(local_path, conditional, suffix=suffix)
 
     def walk(self, suffix="/"):
         dirnames, filenames = self.ls(suffix=suffix)
@@ -3,10 +3,16 @@ from __future__ import unicode_literals
 
 import codecs
 import datetime
+import fcntl
+import hashlib
+import json
+import re
+import shutil
+import stat
+import subprocess
+import time
 from collections import OrderedDict
-
-# noinspection PyProtectedMember
-from polyarchiv._vendor import requests
+from multiprocessing.pool import ThreadPool
 
 # noinspection PyProtectedMember
 from polyarchiv._vendor.lru_cache import lru_cache
@@ -22,6 +28,7 @@ from polyarchiv.config_checks import (
 )
 from polyarchiv.filters import FileFilter
 from polyarchiv.hooks import Hook
+from polyarchiv.metadata import BACKUP_POINT
 
 try:
     # noinspection PyCompatibility
@@ -34,13 +41,27 @@ except ImportError:
     from urllib import urlencode, quote_plus
 import os
 
-from polyarchiv.conf import Parameter, strip_split
+from polyarchiv.conf import Parameter, strip_split, bool_setting, CheckOption
 from polyarchiv.collect_points import CollectPoint
 from polyarchiv.points import Point, PointInfo
-from polyarchiv.utils import text_type, DEFAULT_EMAIL, DEFAULT_USERNAME, base_variables
+from polyarchiv.retention import ArchiveHistory, DAY, HOUR, timestamp_to_datetime
+from polyarchiv.utils import (
+    text_type,
+    DEFAULT_EMAIL,
+    DEFAULT_USERNAME,
+    base_variables,
+    get_sha256,
+    write_file_atomic,
+)
 
 __author__ = "Matthieu Gallet"
 constant_time = datetime.datetime(2016, 1, 1, 0, 0, 0)
+PRUNE_THREADS = 4
+BACKEND_CACHE_SIZE = 128
+METADATA_THREADS = 8
+LARGE_FILES_MANIFEST = ".polyarchiv-large-files.json"
+# returned by `do_backup` and `backup` when the backup is delayed until `flush_backups`
+PENDING_BACKUP = "pending"
 
 
 class BackupPoint(Point):
@@ -92,25 +113,63 @@ class BackupPoint(Point):
         # used to override remote parameters
 
     # noinspection PyMethodOverriding
-    def format_value(self, value, collect_point, use_constant_values=False):
-        if value is None:
-            return None
+    def format_value(
+        self, value, collect_point, use_constant_values=False, extra_variables=None
+    ):
+        """Format `value` with the variables of the backup point and of the collect
+        point, updated by `extra_variables` (without modifying the collect point)"""
+        return self.format_values(
+            [value], collect_point, use_constant_values, extra_variables
+        )[0]
+
+    def format_values(
+        self, values, collect_point, use_constant_values=False, extra_variables=None
+    ):
+        """Format a list of values like :meth:`format_value`, merging the variables
+        only once"""
         assert isinstance(collect_point, CollectPoint)
-        variables = {}
-        variables.update(self.variables)
-        variables.update(collect_point.variables)
-        if collect_point.name in self.collect_point_variables:
-            variables.update(self.collect_point_variables[collect_point.name])
-        if use_constant_values:
-            variables.update(self.constant_format_values)
-        try:
-            formatted_value = value.format(**variables)
-        except KeyError as e:
-            txt = text_type(e)[len("KeyError:") :]
-            raise ValueError(
-                "Unable to format '%s': variable %s is missing" % (value, txt)
-            )
-        return formatted_value
+        variables = None
+        formatted_values = []
+        for value in values:
+            if value is None:
+                formatted_values.append(None)
+                continue
+            if variables is None:
+                variables = {}
+                variables.update(self.variables)
+                variables.update(collect_point.variables)
+                if collect_point.name in self.collect_point_variables:
+                    variables.update(self.collect_point_variables[collect_point.name])
+                if extra_variables:
+                    variables.update(extra_variables)
+                if use_constant_values:
+                    variables.update(self.constant_format_values)
+            try:
+                formatted_values.append(value.format(**variables))
+            except KeyError as e:
+                txt = text_type(e)[len("KeyError:") :]
+                raise ValueError(
+                    "Unable to format '%s': variable %s is missing" % (value, txt)
+                )
+        return formatted_values
+
+    @lru_cache(maxsize=BACKEND_CACHE_SIZE)
+    def get_cached_backend(
+        self, repository, root_url, keytab, private_key, ca_cert, ssh_options
+    ):
+        """Return a backend (and its HTTP session), shared by all calls with the same
+        formatted values during the run.
+        Values formatted with other variables (like the ones of a previous archive)
+        give another backend."""
+        return get_backend(
+            repository,
+            root_url,
+            keytab=keytab,
+            private_key=private_key,
+            ca_cert=ca_cert,
+            ssh_options=ssh_options,
+            config=self.config,
+        )
 
     def backup(self, collect_point, force=False):
         """ perform the backup and log all errors
@@ -149,21 +208,18 @@ class BackupPoint(Point):
         }
         # these variables are required for a valid restore
         cwd = os.getcwd()
+        pending = False
         try:
             if self.can_execute_command("# get lock"):
                 lock_ = collect_point.get_lock()
             export_data_path = self.apply_backup_filters(collect_point)
-            self.do_backup(collect_point, export_data_path, info)
-            info.success_count += 1
-            info.last_state_valid = True
-            info.last_success = datetime.datetime.now()
-            info.last_message = "ok"
+            result = self.do_backup(collect_point, export_data_path, info)
+            pending = result == PENDING_BACKUP
+            if not pending:
+                self.set_backup_success(info)
         except Exception as e:
             self.print_error("unable to perform backup: %s" % text_type(e))
-            info.fail_count += 1
-            info.last_fail = datetime.datetime.now()
-            info.last_state_valid = False
-            info.last_message = text_type(e)
+            self.set_backup_failure(info, text_type(e))
         finally:
             os.chdir(cwd)
         if lock_ is not None:
@@ -172,18 +228,57 @@ class BackupPoint(Point):
                     collect_point.release_lock(lock_)
             except Exception as e:
                 self.print_error("unable to release lock. %s" % text_type(e))
+        if pending:
+            # the state is only registered by `flush_backups`
+            return PENDING_BACKUP
         if self.can_execute_command("# register this backup point state"):
             self.set_info(collect_point, info)
         return info.last_state_valid
 
+    @staticmethod
+    def set_backup_success(info):
+        info.success_count += 1
+        info.last_state_valid = True
+        info.last_success = datetime.datetime.now()
+        info.last_message = "ok"
+
+    @staticmethod
+    def set_backup_failure(info, message):
+        info.fail_count += 1
+        info.last_fail = datetime.datetime.now()
+        info.last_state_valid = False
+        info.last_message = message
+
     def do_backup(self, collect_point, export_data_path, info):
         """send backup data from the collect point
         :param collect_point: the collect point
         :param export_data_path: where all data are stored (path)
         :param info: PointInfo object. its attribute `data` can be freely updated
+        :return: :data:`PENDING_BACKUP` if the backup is delayed until `flush_backups`
         """
         raise NotImplementedError
 
+    # noinspection PyMethodMayBeStatic
+    def flush_backups(self):
+        """Called once all collect points have been processed, for backup points that
+        delay some work in `do_backup` (that returned :data:`PENDING_BACKUP`).
+        The state of these backups must be registered here.
+        :return: dict {collect_point.name: bool} of the delayed backups
+        """
+        return {}
+
+    def prefetch_metadata(self, collect_points):
+        """Called before processing several collect points, to fetch their info at once"""
+        pass
+
+    def begin_metadata_batch(self):
+        """Delay the upload of the info of the collect points until `flush_metadata`"""
+        pass
+
+    def flush_metadata(self):
+        """Upload the info delayed since `begin_metadata_batch`"""
+        pass
+
     def apply_backup_filters(self, collect_point):
         assert isinstance(collect_point, CollectPoint)
         next_path = collect_point.export_data_path
@@ -216,26 +311,23 @@ class BackupPoint(Point):
                 allow_in_place=False,
             )
 
-    # noinspection PyMethodMayBeStatic
     def get_info(self, collect_point, force_backup=False):
         assert isinstance(collect_point, CollectPoint)
+        # JSON file of previous versions
         path = os.path.join(self.private_path(collect_point), "%s.json" % self.name)
-        if os.path.isfile(path):
-            with codecs.open(path, "r", encoding="utf-8") as fd:
-                content = fd.read()
-            return PointInfo.from_str(content)
-        else:
-            return PointInfo()
+        info = collect_point.metadata_store.get_info(
+            BACKUP_POINT,
+            self.name,
+            legacy_path=path,
+            import_legacy=self.command_execute,
+        )
+        return PointInfo() if info is None else info
 
-    # noinspection PyMethodMayBeStatic
     def set_info(self, collect_point, info):
         assert isinstance(collect_point, CollectPoint)
         assert isinstance(info, PointInfo)
-        path = os.path.join(self.private_path(collect_point), "%s.json" % self.name)
-        self.ensure_dir(path, parent=True)
-        content = info.to_str()
-        with codecs.open(path, "w", encoding="utf-8") as fd:
-            fd.write(content)
+        self.ensure_dir(collect_point.metadata_store.path, parent=True)
+        collect_point.metadata_store.add_run(BACKUP_POINT, self.name, info)
 
     def restore(self, collect_point):
         info = self.get_info(collect_point, force_backup=True)
@@ -330,6 +422,8 @@ class CommonBackupPoint(BackupPoint):
         self.metadata_ssh_options = metadata_ssh_options
         self.metadata_url_requirements = []
         # list of values using non-constant values
+        self.pending_metadata = None
+        # info to upload at once: self.pending_metadata[name] = collect_point
 
     def format_value(
         self,
@@ -337,22 +431,45 @@ class CommonBackupPoint(BackupPoint):
         collect_point,
         use_constant_values=False,
         check_metadata_requirement=True,
+        extra_variables=None,
     ):
         """Check if the metadata_url is required: at least one formatted value uses non-constant values"""
+        return self.format_values(
+            [value],
+            collect_point,
+            use_constant_values,
+            check_metadata_requirement,
+            extra_variables,
+        )[0]
+
+    def format_values(
+        self,
+        values,
+        collect_point,
+        use_constant_values=False,
+        check_metadata_requirement=True,
+        extra_variables=None,
+    ):
         if use_constant_values:
-            return super(CommonBackupPoint, self).format_value(
-                value, collect_point, use_constant_values
+            return super(CommonBackupPoint, self).format_values(
+                values, collect_point, use_constant_values
             )
-        result = super(CommonBackupPoint, self).format_value(
-            value, collect_point, False
+        results = super(CommonBackupPoint, self).format_values(
+            values, collect_point, False, extra_variables=extra_variables
         )
-        if check_metadata_requirement:
-            constant_result = super(CommonBackupPoint, self).format_value(
-                value, collect_point, True
+        if check_metadata_requirement and extra_variables is None:
+            constant_results = super(CommonBackupPoint, self).format_values(
+                values, collect_point, True
             )
-            if constant_result != result:
-                self.metadata_url_requirements.append(value)
-        return result
+            for value, result, constant_result in zip(
+                values, results, constant_results
+            ):
+                if (
+                    constant_result != result
+                    and value not in self.metadata_url_requirements
+                ):
+                    self.metadata_url_requirements.append(value)
+        return results
 
     def do_restore(self, collect_point, export_data_path):
         raise NotImplementedError
@@ -372,31 +489,22 @@ class CommonBackupPoint(BackupPoint):
                     % (p1, ", ".join(self.metadata_url_requirements), p2)
                 )
             return None
-        metadata_url = self.format_value(
-            self.metadata_url, collect_point, use_constant_values=True
+        values = self.format_values(
+            [
+                self.metadata_url,
+                self.metadata_keytab,
+                self.metadata_private_key,
+                self.metadata_ca_cert,
+                self.metadata_ssh_options,
+            ],
+            collect_point,
+            use_constant_values=True,
         )
+        metadata_url, keytab, private_key, ca_cert, ssh_options = values
         if metadata_url.endswith("/"):
             metadata_url += "%s.json" % collect_point.name
-        metadata_private_key = self.format_value(
-            self.metadata_private_key, collect_point, use_constant_values=True
-        )
-        metadata_ca_cert = self.format_value(
-            self.metadata_ca_cert, collect_point, use_constant_values=True
-        )
-        metadata_keytab = self.format_value(
-            self.metadata_keytab, collect_point, use_constant_values=True
-        )
-        metadata_ssh_options = self.format_value(
-            self.metadata_ssh_options, collect_point, use_constant_values=True
-        )
-        backend = get_backend(
-            self,
-            metadata_url,
-            keytab=metadata_keytab,
-            private_key=metadata_private_key,
-            ca_cert=metadata_ca_cert,
-            ssh_options=metadata_ssh_options,
-            config=self.config,
+        backend = self.get_cached_backend(
+            self, metadata_url, keytab, private_key, ca_cert, ssh_options
         )
         assert isinstance(backend, StorageBackend)
         return backend
@@ -404,33 +512,97 @@ class CommonBackupPoint(BackupPoint):
     @lru_cache()
     def get_info(self, collect_point, force_backup=False):
         assert isinstance(collect_point, CollectPoint)
-        path = os.path.join(self.private_path(collect_point), "%s.json" % self.name)
+        path = self.metadata_file_path(collect_point)
+        store = collect_point.metadata_store
+        if not force_backup:
+            info = store.get_info(BACKUP_POINT, self.name)
+            if info is not None:
+                return info
         if not os.path.isfile(path) or force_backup:
-            self.ensure_dir(path, parent=True)
-            backend = self._get_metadata_backend(collect_point)
-            if backend is not None:
-                # noinspection PyBroadException
-                try:
-                    backend.sync_file_to_local(path)
-                except:  # happens on the first sync (no remote data available)
-                    pass
-        if os.path.isfile(path) and not force_backup:
-            with codecs.open(path, "r", encoding="utf-8") as fd:
-                content = fd.read()
-            return PointInfo.from_str(content)
+            self.download_metadata(collect_point)
+        if not force_backup:
+            info = store.get_info(
+                BACKUP_POINT,
+                self.name,
+                legacy_path=path,
+                import_legacy=self.command_execute,
+            )
+            if info is not None:
+                return info
         return PointInfo()
 
     def set_info(self, collect_point, info):
         assert isinstance(collect_point, CollectPoint)
         assert isinstance(info, PointInfo)
-        path = os.path.join(self.private_path(collect_point), "%s.json" % self.name)
-        self.ensure_dir(path, parent=True)
-        content = info.to_str()
-        with codecs.open(path, "w", encoding="utf-8") as fd:
-            fd.write(content)
+        self.ensure_dir(collect_point.metadata_store.path, parent=True)
+        collect_point.metadata_store.add_run(BACKUP_POINT, self.name, info)
         backend = self._get_metadata_backend(collect_point)
         if backend is not None:
-            backend.sync_file_from_local(path)
+            path = self.metadata_file_path(collect_point)
+            self.ensure_dir(path, parent=True)
+            write_file_atomic(path, info.to_str())
+            if self.pending_metadata is not None:
+                self.pending_metadata[collect_point.name] = collect_point
+            else:
+                backend.sync_file_from_local(path)
+
+    def metadata_file_path(self, collect_point):
+        """JSON file sent to metadata_url (or written by previous versions)"""
+        return os.path.join(self.private_path(collect_point), "%s.json" % self.name)
+
+    def download_metadata(self, collect_point):
+        backend = self._get_metadata_backend(collect_point)
+        if backend is None:
+            return
+        path = self.metadata_file_path(collect_point)
+        self.ensure_dir(path, parent=True)
+        # noinspection PyBroadException
+        try:
+            backend.sync_file_to_local_if_modified(path)
+        except:  # happens on the first sync (no remote data available)
+            pass
+
+    def prefetch_metadata(self, collect_points):
+        """Download in parallel the info of the collect points without local state"""
+        if self.metadata_url is None:
+            return
+        collect_points = [
+            x
+            for x in collect_points
+            if x.metadata_store.get_info(BACKUP_POINT, self.name) is None
+        ]
+        if not collect_points:
+            return
+        pool = ThreadPool(min(METADATA_THREADS, len(collect_points)))
+        try:
+            pool.map(self.download_metadata, collect_points)
+        finally:
+            pool.close()
+            pool.join()
+
+    def begin_metadata_batch(self):
+        if self.pending_metadata is None:
+            self.pending_metadata = OrderedDict()
+
+    def flush_metadata(self):
+        pending_metadata, self.pending_metadata = self.pending_metadata, None
+        if not pending_metadata:
+            return
+        pool = ThreadPool(min(METADATA_THREADS, len(pending_metadata)))
+        try:
+            pool.map(self.upload_metadata, pending_metadata.values())
+        finally:
+            pool.close()
+            pool.join()
+
+    def upload_metadata(self, collect_point):
+        try:
+            backend = self._get_metadata_backend(collect_point)
+            backend.sync_file_from_local(self.metadata_file_path(collect_point))
+        except Exception as e:
+            self.print_error(
+                "unable to send metadata of %s: %s" % (collect_point.name, text_type(e))
+            )
 
 
 class GitRepository(CommonBackupPoint):
@@ -462,6 +634,33 @@ class GitRepository(CommonBackupPoint):
             "commit_message",
             help_str='commit message (default: "Backup {Y}/{m}/{d} {H}:{M}") [*]',
         ),
+        Parameter(
+            "pack_threads",
+            converter=int,
+            help_str="number of threads used by git to compress objects (pack.threads)",
+        ),
+        Parameter(
+            "pack_window",
+            converter=int,
+            help_str="size of the window used by git to find deltas (pack.window, "
+            "lower values make pushes faster but packs larger)",
+        ),
+        Parameter(
+            "big_file_threshold",
+            help_str="files larger than this size (like \"50m\") are stored by git "
+            "without delta compression (core.bigFileThreshold)",
+        ),
+        Parameter(
+            "large_file_threshold",
+            converter=int,
+            help_str="files larger than this size (in bytes) are not added to the git "
+            "repository but sent to 'large_files_url'",
+        ),
+        Parameter(
+            "large_files_url",
+            help_str="URL of a folder storing the large files (named by their SHA-256 "
+            "hash), like 'file:///var/backups/large-files/' [*]",
+        ),
         Parameter(
             "remote_url",
             help_str="URL of the remote server, including username and password (e.g.: "
@@ -491,9 +690,19 @@ class GitRepository(CommonBackupPoint):
         commit_name=DEFAULT_USERNAME,
         commit_email=DEFAULT_EMAIL,
         commit_message="Backup {Y}/{m}/{d} {H}:{M}",
+        pack_threads=None,
+        pack_window=None,
+        big_file_threshold=None,
+        large_file_threshold=None,
+        large_files_url=None,
         **kwargs
     ):
         super(GitRepository, self).__init__(name, **kwargs)
+        self.pack_threads = pack_threads
+        self.pack_window = pack_window
+        self.big_file_threshold = big_file_threshold
+        self.large_file_threshold = large_file_threshold
+        self.large_files_url = large_files_url
         self.keytab = keytab
         self.private_key = private_key
         self.remote_url = remote_url
@@ -502,50 +711,83 @@ class GitRepository(CommonBackupPoint):
         self.commit_email = commit_email
         self.commit_message = commit_message
 
-    def do_backup(self, collect_point, export_data_path, info):
-        assert isinstance(collect_point, CollectPoint)  # just to help PyCharm
-        worktree = export_data_path
-        git_dir = os.path.join(self.private_path(collect_point), "git")
-        os.chdir(worktree)
-        git_command = [
+    def get_git_command(self, git_dir, worktree):
+        cmd = [
             self.config.git_executable,
             "--git-dir",
             git_dir,
             "--work-tree",
             worktree,
         ]
-        self.execute_command(git_command + ["init"], cwd=worktree)
-        self.execute_command(
-            [
-                self.config.git_executable,
-                "config",
-                "--global",
-                "user.email",
-                self.commit_email,
-            ],
-            env={"HOME": git_dir},
-        )
-        self.execute_command(
-            [
-                self.config.git_executable,
-                "config",
-                "--global",
-                "user.name",
-                self.commit_name,
-            ],
-            env={"HOME": git_dir},
-        )
+        for key, value in (
+            ("pack.threads", self.pack_threads),
+            ("pack.window", self.pack_window),
+            ("core.bigFileThreshold", self.big_file_threshold),
+        ):
+            if value is not None:
+                cmd += ["-c", "%s=%s" % (key, value)]
+        return cmd
+
+    def do_backup(self, collect_point, export_data_path, info):
+        assert isinstance(collect_point, CollectPoint)  # just to help PyCharm
+        worktree = export_data_path
+        git_dir = os.path.join(self.private_path(collect_point), "git")
+        os.chdir(worktree)
+        git_command = self.get_git_command(git_dir, worktree)
+        timings = OrderedDict()
+        start = time.time()
+        if not os.path.isfile(os.path.join(git_dir, "HEAD")):
+            self.execute_command(git_command + ["init"], cwd=worktree)
+        large_files = None
+        use_large_files = self.large_files_url and self.large_file_threshold
+        if use_large_files and os.path.isdir(git_dir):
+            large_files = self.store_large_files(collect_point, git_dir, worktree)
+            timings["large files"] = time.time() - start
+        start = time.time()
         self.execute_command(git_command + ["add", "."])
+        if large_files:
+            self.execute_command(
+                git_command
+                + ["rm", "--cached", "-q", "--ignore-unmatch", "--"]
+                + [":(literal)%s" % x for x in sorted(large_files)]
+            )
+        if large_files is not None:
+            # the manifest is only added to the index, the worktree is not modified
+            __, stdout, __ = self.execute_command(
+                git_command
+                + ["hash-object", "-w", os.path.join(git_dir, LARGE_FILES_MANIFEST)],
+                stdout=subprocess.PIPE,
+            )
+            if stdout:
+                cache_info = "100644,%s,%s" % (
+                    stdout.decode("utf-8").strip(),
+                    LARGE_FILES_MANIFEST,
+                )
+                self.execute_command(
+                    git_command + ["update-index", "--add", "--cacheinfo", cache_info]
+                )
+        timings["add"] = time.time() - start
+        start = time.time()
         commit_message = self.format_value(
             self.commit_message, collect_point, check_metadata_requirement=False
         )
+        # the identity is given on the command line instead of being written in a
+        # global config file at each backup
+        commit_cmd = git_command + [
+            "-c",
+            "user.email=%s" % self.commit_email,
+            "-c",
+            "user.name=%s" % self.commit_name,
+            "commit",
+            "--no-verify",
+            "-m" if large_files is not None else "-am",
+            commit_message,
+        ]
         # noinspection PyTypeChecker
-        self.execute_command(
-            git_command + ["commit", "-am", commit_message],
-            ignore_errors=True,
-            env={"HOME": git_dir},
-        )
+        self.execute_command(commit_cmd, ignore_errors=True, env={"HOME": git_dir})
+        timings["commit"] = time.time() - start
 
+        start = time.time()
         remote_url = self.format_value(self.remote_url, collect_point)
         if not self.check_remote_url(collect_point):
             raise ValueError("Invalid backup point: %s" % remote_url)
@@ -568,6 +810,76 @@ class GitRepository(CommonBackupPoint):
                 "ssh-add %s ; %s" % (private_key, " ".join(cmd)),
             ]
         self.execute_command(cmd, cwd=worktree, env={"HOME": git_dir})
+        timings["push"] = time.time() - start
+        self.print_info(
+            "git backup: %s"
+            % ", ".join("%s in %.1fs" % (k, v) for (k, v) in timings.items())
+        )
+        info.data = {"timings": timings}
+
+    def _get_large_files_backend(self, collect_point):
+        values = self.format_values(
+            [self.large_files_url, self.keytab, self.private_key],
+            collect_point,
+            check_metadata_requirement=False,
+        )
+        large_files_url, keytab, private_key = values
+        return self.get_cached_backend(
+            collect_point, large_files_url, keytab, private_key, None, None
+        )
+
+    def store_large_files(self, collect_point, git_dir, worktree):
+        """Send the files larger than `large_file_threshold` to `large_files_url`
+        (named by their SHA-256) and exclude them from the git repository.
+
+        Return the manifest {relative path: [size, modification time, SHA-256]}, also
+        written to `git_dir` and added to each commit."""
+        manifest_path = os.path.join(git_dir, LARGE_FILES_MANIFEST)
+        previous = {}
+        if os.path.isfile(manifest_path):
+            with codecs.open(manifest_path, "r", encoding="utf-8") as fd:
+                previous = json.load(fd)
+        stored_hashes = {x[2] for x in previous.values()}
+        backend = self._get_large_files_backend(collect_point)
+        manifest = {}
+        for dirpath, dirnames, filenames in os.walk(worktree):
+            for filename in filenames:
+                path = os.path.join(dirpath, filename)
+                st = os.lstat(path)
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+                elif st.st_size < self.large_file_threshold:
+                    continue
+                relpath = os.path.relpath(path, worktree)
+                size, mtime = st.st_size, int(st.st_mtime)
+                values = previous.get(relpath)
+                if values is None or values[:2] != [size, mtime]:
+                    values = [size, mtime, get_sha256(path)]
+                if values[2] not in stored_hashes:
+                    backend.sync_file_from_local(path, values[2])
+                    stored_hashes.add(values[2])
+                manifest[relpath] = values
+        with codecs.open(os.path.join(git_dir, "info", "exclude"), "w", "utf-8") as fd:
+            for relpath in sorted(manifest):
+                fd.write("/%s\n" % re.sub(r"([*?\[\\])", r"\\\1", relpath))
+        with codecs.open(manifest_path, "w", encoding="utf-8") as fd:
+            json.dump(manifest, fd, sort_keys=True, indent=0)
+        return manifest
+
+    def restore_large_files(self, collect_point, git_dir, worktree):
+        manifest_path = os.path.join(worktree, LARGE_FILES_MANIFEST)
+        if not os.path.isfile(manifest_path):
+            return
+        with codecs.open(manifest_path, "r", encoding="utf-8") as fd:
+            manifest = json.load(fd)
+        backend = self._get_large_files_backend(collect_point)
+        for relpath, (size, mtime, sha256) in sorted(manifest.items()):
+            path = os.path.join(worktree, relpath)
+            self.ensure_dir(path, parent=True)
+            backend.sync_file_to_local(path, sha256)
+        # the manifest is not a part of the collect point
+        self.ensure_dir(git_dir)
+        shutil.move(manifest_path, os.path.join(git_dir, LARGE_FILES_MANIFEST))
 
     def check_remote_url(self, collect_point):
         return True
@@ -605,6 +917,8 @@ class GitRepository(CommonBackupPoint):
                 "ssh-add %s ; %s" % (private_key, " ".join(cmd)),
             ]
         self.execute_command(cmd, cwd=os.path.dirname(worktree))
+        if self.large_files_url:
+            self.restore_large_files(collect_point, git_dir, worktree)
 
 
 class GitlabRepository(GitRepository):
@@ -677,6 +991,9 @@ class GitlabRepository(GitRepository):
         self.api_url = "%s://%s/api/v3" % (parsed.scheme, parsed.hostname)
 
     def check_remote_url(self, collect_point):
+        # noinspection PyProtectedMember
+        from polyarchiv._vendor import requests  # slow to import: only when required
+
         project_name = self.format_value(self.project_name, collect_point)
         api_url = self.format_value(self.api_url, collect_point)
         api_key = self.format_value(self.api_key, collect_point)
@@ -757,22 +1074,20 @@ class Synchronize(CommonBackupPoint):
         backend = self._get_backend(collect_point)
         backend.sync_dir_from_local(export_data_path)
 
-    def _get_backend(self, collect_point):
-        remote_url = self.format_value(self.remote_url, collect_point)
-        keytab = self.format_value(self.keytab, collect_point)
-        private_key = self.format_value(self.private_key, collect_point)
-        ca_cert = self.format_value(self.ca_cert, collect_point)
-        ssh_options = self.format_value(self.ssh_options, collect_point)
-        backend = get_backend(
+    def _get_backend(self, collect_point, variables=None):
+        """:param variables: extra variables, like the ones of a previous archive"""
+        values = self.format_values(
+            [
+                self.remote_url,
+                self.keytab,
+                self.private_key,
+                self.ca_cert,
+                self.ssh_options,
+            ],
             collect_point,
-            remote_url,
-            keytab=keytab,
-            private_key=private_key,
-            ca_cert=ca_cert,
-            ssh_options=ssh_options,
-            config=self.config,
+            extra_variables=variables,
         )
-        return backend
+        return self.get_cached_backend(collect_point, *values)
 
     def do_restore(self, collect_point, export_data_path):
         backend = self._get_backend(collect_point)
@@ -831,22 +1146,20 @@ class TarArchive(CommonBackupPoint):
         self.ca_cert = ca_cert
         self.ssh_options = ssh_options
 
-    def _get_backend(self, collect_point):
-        remote_url = self.format_value(self.remote_url, collect_point)
-        keytab = self.format_value(self.keytab, collect_point)
-        private_key = self.format_value(self.private_key, collect_point)
-        ca_cert = self.format_value(self.ca_cert, collect_point)
-        ssh_options = self.format_value(self.ssh_options, collect_point)
-        backend = get_backend(
+    def _get_backend(self, collect_point, variables=None):
+        """:param variables: extra variables, like the ones of a previous archive"""
+        values = self.format_values(
+            [
+                self.remote_url,
+                self.keytab,
+                self.private_key,
+                self.ca_cert,
+                self.ssh_options,
+            ],
             collect_point,
-            remote_url,
-            keytab=keytab,
-            private_key=private_key,
-            ca_cert=ca_cert,
-            ssh_options=ssh_options,
-            config=self.config,
+            extra_variables=variables,
         )
-        return backend
+        return self.get_cached_backend(collect_point, *values)
 
     def do_backup(self, collect_point, export_data_path, info):
         assert isinstance(collect_point, CollectPoint)
@@ -945,6 +1258,13 @@ class RollingTarArchive(TarArchive):
             default_str_value="200",
             help_str="Number of yearly backups to keep (fefault to 20)",
         ),
+        Parameter(
+            "prune_threads",
+            converter=int,
+            default_str_value=str(PRUNE_THREADS),
+            help_str="Number of expired archives that are simultaneously removed "
+            "(default to %d)" % PRUNE_THREADS,
+        ),
     ]
     for index, parameter in enumerate(parameters):
         if parameter.arg_name == "remote_url":
@@ -964,6 +1284,7 @@ class RollingTarArchive(TarArchive):
         daily_count=30,
         weekly_count=10,
         yearly_count=20,
+        prune_threads=PRUNE_THREADS,
         **kwargs
     ):
         super(RollingTarArchive, self).__init__(name, **kwargs)
@@ -971,68 +1292,65 @@ class RollingTarArchive(TarArchive):
         self.daily_count = daily_count
         self.weekly_count = weekly_count
         self.yearly_count = yearly_count
+        self.prune_threads = prune_threads
 
     def do_backup(self, collect_point, export_data_path, info):
         super(RollingTarArchive, self).do_backup(collect_point, export_data_path, info)
-        if info.data is None:
-            info.data = []
-            # info.data must be a list of dict (old values)
-        info.data.append(info.variables)
+        # info.data was a list of dict (old values) before the version 2
+        history = ArchiveHistory.from_data(info.data)
+        history.add(info.variables)
+        info.data = history.to_data()
         if self.can_execute_command("# register this backup point state"):
             info.last_state_valid = True
             info.last_success = datetime.datetime.now()
             self.set_info(collect_point, info)
         # ok, there we have to check which old backup must be removed
-        values = []
-        time_to_values = {}
-        # noinspection PyTypeChecker
-        for value_dict in info.data:
-            d = datetime.datetime(
-                year=int(value_dict["Y"]),
-                month=int(value_dict["m"]),
-                day=int(value_dict["d"]),
-                hour=int(value_dict["H"]),
-                minute=int(value_dict["M"]),
-                second=int(value_dict["S"]),
-            )
-            values.append(d)
-            time_to_values[d] = value_dict
-        values.sort(reverse=True)
-        times = OrderedDict()
-        for d in values:
-            times[d] = False
-        now = datetime.datetime.now()
-        if self.hourly_count:
-            times = self.set_accepted_times(
-                datetime.timedelta(hours=1),
-                times,
-                not_before_time=now - datetime.timedelta(hours=self.hourly_count),
-            )
-        if self.daily_count:
-            times = self.set_accepted_times(
-                datetime.timedelta(days=1),
-                times,
-                not_before_time=now - datetime.timedelta(days=self.daily_count),
-            )
-        if self.weekly_count:
-            times = self.set_accepted_times(
-                datetime.timedelta(days=7),
-                times,
-                not_before_time=now - datetime.timedelta(days=self.weekly_count * 7),
-            )
-        if self.yearly_count:
-            times = self.set_accepted_times(
-                datetime.timedelta(days=365),
-                times,
-                not_before_time=now - datetime.timedelta(days=self.yearly_count * 365),
-            )
-        to_remove_values = [d for (d, v) in times.items() if not v]
-        to_keep_values = [d for (d, v) in times.items() if v]
-        info.data = [time_to_values[d] for d in reversed(to_keep_values)]
-        for data in to_remove_values:
-            collect_point.variables = time_to_values[data]
-            backend = self._get_backend(collect_point)
+        __, to_remove_values = self.plan_retention(history)
+        if not self.can_execute_command("# remove expired archives"):
+            for timestamp in to_remove_values:
+                self.print_info(
+                    "archive of %s would be removed" % timestamp_to_datetime(timestamp)
+                )
+            return
+        self.prune(collect_point, history, to_remove_values)
+        info.data = history.to_data()
+
+    def prune(self, collect_point, history, timestamps):
+        """Remove expired archives with a pool of threads.
+        Failed deletions are kept in the history and retried by the next backup."""
+        items = [(x, history.get_variables(x)) for x in timestamps]
+        pool = ThreadPool(max(1, min(self.prune_threads, len(items))))
+        try:
+            results = pool.map(lambda x: self._prune_archive(collect_point, x), items)
+        finally:
+            pool.close()
+            pool.join()
+        history.remove([x for (x, error) in results if error is None])
+        history.errors = {x: error for (x, error) in results if error is not None}
+
+    def _prune_archive(self, collect_point, item):
+        """Return `(timestamp, error message or None)`"""
+        timestamp, variables = item
+        try:
+            backend = self._get_backend(collect_point, variables=variables)
             backend.delete_on_distant()
+        except Exception as e:
+            self.print_error(
+                "unable to remove archive of %s: %s"
+                % (timestamp_to_datetime(timestamp), text_type(e))
+            )
+            return timestamp, text_type(e) or e.__class__.__name__
+        return timestamp, None
+
+    def plan_retention(self, history, now=None):
+        """Return the list of timestamps of the archives to keep and to remove"""
+        rules = [
+            (HOUR, self.hourly_count),
+            (DAY, self.daily_count),
+            (7 * DAY, self.weekly_count),
+            (365 * DAY, self.yearly_count),
+        ]
+        return history.plan(rules, now or datetime.datetime.now())
 
     @staticmethod
     def set_accepted_times(
@@ -1142,6 +1460,48 @@ class Restic(CommonBackupPoint):
             "project domain name for OpenStack Swift (keystone v3)",
             required=True,
         ),
+        Parameter(
+            "pack_size",
+            converter=int,
+            help_str="target size of the pack files, in MiB (--pack-size)",
+        ),
+        Parameter(
+            "read_concurrency",
+            converter=int,
+            help_str="number of files read simultaneously (--read-concurrency)",
+        ),
+        Parameter(
+            "compression",
+            converter=CheckOption(["auto", "off", "max"]),
+            help_str="auto|off|max: compression mode (--compression)",
+        ),
+        Parameter(
+            "exclude_caches",
+            converter=bool_setting,
+            help_str="exclude folders containing a CACHEDIR.TAG file "
+            "(--exclude-caches)",
+        ),
+        Parameter(
+            "cache_dir",
+            help_str="cache directory of the repository, shared by all collect points "
+            "and also used to lock the repository "
+            "(default to ~/.cache/polyarchiv/restic/<hash of the remote URL>) [*]",
+        ),
+        Parameter(
+            "single_snapshot",
+            converter=bool_setting,
+            help_str="back up all collect points sharing the same remote URL in a "
+            "single snapshot, tagged with the names of the collect points, once all "
+            "collect points have been processed",
+        ),
+    ] + [
+        Parameter(
+            "%s_count" % period,
+            converter=int,
+            help_str="Number of %s snapshots to keep, removing other ones with "
+            "'restic forget --prune' (default to 0, no limit)" % period,
+        )
+        for period in ("hourly", "daily", "weekly", "yearly")
     ]
     checks = CommonBackupPoint.checks + [
         AttributeUniquess("remote_url"),
@@ -1200,6 +1560,16 @@ class Restic(CommonBackupPoint):
         remote_user_domain_name=None,
         remote_project_name=None,
         remote_project_domain_name=None,
+        pack_size=None,
+        read_concurrency=None,
+        compression=None,
+        exclude_caches=False,
+        cache_dir=None,
+        single_snapshot=False,
+        hourly_count=0,
+        daily_count=0,
+        weekly_count=0,
+        yearly_count=0,
         **kwargs
     ):
         super(Restic, self).__init__(name, **kwargs)
@@ -1212,6 +1582,38 @@ class Restic(CommonBackupPoint):
         self.remote_project_domain_name = remote_project_domain_name
         self.remote_username = remote_username
         self.remote_secret = remote_secret
+        self.pack_size = pack_size
+        self.read_concurrency = read_concurrency
+        self.compression = compression
+        self.exclude_caches = exclude_caches
+        self.cache_dir = cache_dir
+        self.single_snapshot = single_snapshot
+        self.pending_backups = []  # list of (collect_point, export_data_path, info)
+        self.hourly_count = hourly_count
+        self.daily_count = daily_count
+        self.weekly_count = weekly_count
+        self.yearly_count = yearly_count
+
+    def get_backup_options(self):
+        options = []
+        if self.pack_size:
+            options += ["--pack-size", str(self.pack_size)]
+        if self.read_concurrency:
+            options += ["--read-concurrency", str(self.read_concurrency)]
+        if self.compression:
+            options += ["--compression", self.compression]
+        if self.exclude_caches:
+            options += ["--exclude-caches"]
+        return options
+
+    def get_forget_options(self):
+        """Return the options of 'restic forget' (an empty list if no count is set)"""
+        options = []
+        for period in ("hourly", "daily", "weekly", "yearly"):
+            count = getattr(self, "%s_count" % period)
+            if count:
+                options += ["--keep-%s" % period, str(count)]
+        return options
 
     def do_backup(self, collect_point, export_data_path, info):
         assert isinstance(collect_point, CollectPoint)  # just to help PyCharm
@@ -1219,15 +1621,157 @@ class Restic(CommonBackupPoint):
         remote_url = self.format_value(self.remote_url, collect_point)
         if not self.check_remote_url(collect_point):
             raise ValueError("Invalid backup point: %s" % remote_url)
+        if self.single_snapshot:
+            # performed by flush_backups, with the other collect points
+            self.print_info("backup of %s delayed" % export_data_path)
+            self.pending_backups.append((collect_point, export_data_path, info))
+            return PENDING_BACKUP
+        env = self.get_env(remote_url, collect_point)
+        lock_fd = self.lock_repository(env)
+        try:
+            data = self.run_backup(
+                remote_url, env, [export_data_path], info.data or {}
+            )
+            if data:
+                info.data = data
+            self.run_forget(remote_url, env, export_data_path)
+        finally:
+            self.unlock_repository(lock_fd)
+
+    def flush_backups(self):
+        """Back up the delayed collect points, with one snapshot per remote URL"""
+        pending_backups, self.pending_backups = self.pending_backups, []
+        groups = OrderedDict()  # groups[remote_url] = [(collect_point, path, info)]
+        for collect_point, export_data_path, info in pending_backups:
+            remote_url = self.format_value(self.remote_url, collect_point)
+            groups.setdefault(remote_url, []).append(
+                (collect_point, export_data_path, info)
+            )
+        results = {}
+        for remote_url, backups in groups.items():
+            collect_point = backups[0][0]
+            paths = [x[1] for x in backups]
+            tags = [x[0].name for x in backups]
+            parents = {(x[2].data or {}).get("snapshot_id") for x in backups}
+            previous_data = (backups[0][2].data or {}) if len(parents) == 1 else {}
+            env = self.get_env(remote_url, collect_point)
+            cwd = os.getcwd()
+            lock_fd = None
+            try:
+                lock_fd = self.lock_repository(env)
+                data = self.run_backup(remote_url, env, paths, previous_data, tags)
+                self.run_forget(remote_url, env, paths[0])
+                error = None
+            except Exception as e:
+                self.print_error("unable to perform backup: %s" % text_type(e))
+                data, error = None, e
+            finally:
+                os.chdir(cwd)
+                self.unlock_repository(lock_fd)
+            for collect_point, __, info in backups:
+                if error is None:
+                    if data:
+                        info.data = data
+                    self.set_backup_success(info)
+                else:
+                    self.set_backup_failure(info, text_type(error))
+                results[collect_point.name] = error is None
+                if self.can_execute_command("# register this backup point state"):
+                    self.set_info(collect_point, info)
+        return results
+
+    def run_backup(self, remote_url, env, paths, previous_data, tags=None):
+        """Run 'restic backup' on the given paths.
+
+        :return: the data to store in the backup point info (None if unknown)
+        """
         cmd = [
             self.config.restic_executable,
             "-r",
             remote_url,
             "backup",
-            export_data_path,
+            "--json",
+            "--quiet",
         ]
-        env = self.get_env(remote_url, collect_point)
-        self.execute_command(cmd, cwd=export_data_path, env=env)
+        cmd += self.get_backup_options()
+        for tag in tags or []:
+            cmd += ["--tag", tag]
+        parent = previous_data.get("snapshot_id")
+        returncode, stdout = None, None
+        if parent:
+            # avoid a search of the parent snapshot, and a full rescan if not found
+            returncode, stdout, __ = self.execute_command(
+                cmd + ["--parent", parent] + paths,
+                cwd=paths[0],
+                env=env,
+                stdout=subprocess.PIPE,
+                ignore_errors=True,
+            )
+            if returncode != 0:
+                self.print_error("unable to use %s as parent snapshot" % parent)
+        if not parent or returncode != 0:
+            __, stdout, __ = self.execute_command(
+                cmd + paths, cwd=paths[0], env=env, stdout=subprocess.PIPE
+            )
+        summary = self.parse_backup_summary(stdout)
+        if not summary:
+            return None
+        return {
+            "snapshot_id": summary.get("snapshot_id"),
+            "summary": {
+                k: summary.get(k)
+                for k in (
+                    "files_new",
+                    "files_changed",
+                    "files_unmodified",
+                    "data_added",
+                    "total_duration",
+                )
+            },
+        }
+
+    def run_forget(self, remote_url, env, cwd):
+        forget_options = self.get_forget_options()
+        if forget_options:
+            cmd = [self.config.restic_executable, "-r", remote_url, "forget"]
+            cmd += forget_options + ["--prune"]
+            self.execute_command(cmd, cwd=cwd, env=env)
+
+    def lock_repository(self, env):
+        """Wait for the other polyarchiv processes using the same cache directory.
+        Return the file descriptor that must be given to `unlock_repository`."""
+        if not self.can_execute_command("# lock %s" % env["RESTIC_CACHE_DIR"]):
+            return None
+        self.ensure_dir(env["RESTIC_CACHE_DIR"])
+        fd = open(os.path.join(env["RESTIC_CACHE_DIR"], "polyarchiv.lock"), "w")
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        return fd
+
+    # noinspection PyMethodMayBeStatic
+    def unlock_repository(self, fd):
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            fd.close()
+
+    @staticmethod
+    def parse_backup_summary(stdout):
+        """Return the summary message of 'restic backup --json' (or None)
+
+        >>> stdout = b'{"message_type":"status"}\\n'
+        >>> stdout += b'{"message_type":"summary","files_new":2}'
+        >>> Restic.parse_backup_summary(stdout)["files_new"]
+        2
+        """
+        if not stdout:
+            return None
+        for line in reversed(stdout.decode("utf-8").splitlines()):
+            try:
+                message = json.loads(line)
+            except ValueError:
+                continue
+            if isinstance(message, dict) and message.get("message_type") == "summary":
+                return message
+        return None
 
     def get_env(self, remote_url, collect_point):
         """return the environment values required for the given Restic backend"""
@@ -1237,8 +1781,16 @@ class Restic(CommonBackupPoint):
             key: self.format_value(getattr(self, attr_name), collect_point)
             for (key, attr_name) in mapping.items()
         }
+        env["RESTIC_CACHE_DIR"] = self.get_cache_dir(remote_url, collect_point)
         return env
 
+    def get_cache_dir(self, remote_url, collect_point):
+        """return the cache directory of the repository"""
+        if self.cache_dir:
+            return self.format_value(self.cache_dir, collect_point)
+        key = hashlib.sha256(remote_url.encode("utf-8")).hexdigest()[:16]
+        return os.path.expanduser(os.path.join("~/.cache/polyarchiv/restic", key))
+
     def check_remote_url(self, collect_point):
         return True
 
@@ -1252,8 +1804,15 @@ class Restic(CommonBackupPoint):
             "-r",
             remote_url,
             "restore",
+            # only the content of the backed-up folder (the snapshot may contain
+            # other collect points when single_snapshot is set)
+            "latest:%s" % export_data_path,
+            "--path",
+            export_data_path,
             "--target",
             export_data_path,
         ]
+        if self.single_snapshot:
+            cmd += ["--tag", collect_point.name]
         env = self.get_env(remote_url, collect_point)
         self.execute_command(cmd, cwd=os.path.dirname(export_data_path), env=env)
@@ -12,12 +12,30 @@ import subprocess
 import sys
 
 from polyarchiv.conf import Parameter
+from polyarchiv.status import StatusIndex
 from polyarchiv.termcolor import cprint, YELLOW, CYAN, BOLD, GREEN, GREY, RED
-from polyarchiv.visitors import ConfigVisitor, CheckVisitor
 
 __author__ = "Matthieu Gallet"
 
 
+def print_check_result(return_code, errors, warnings, nrpe=False):
+    msg = ", ".join(errors)
+    if return_code == 0:
+        msg = "everything is valid"
+    if nrpe:
+        if return_code == 2:
+            msg = "CRITICAL - %s" % msg
+        elif return_code == 1:
+            msg = "WARNING - %s" % msg
+        elif return_code == 0:
+            msg = "OK - %s" % msg
+        else:
+            msg = "UNKNOWN - %s" % msg
+    elif warnings:
+        msg += "\n" + "\n".join(warnings)
+    cprint(msg)
+
+
 def main(engines_file=None):
     """Main function, intended for use as command line executable.
 
@@ -28,16 +46,22 @@ def main(engines_file=None):
     path_components = sys.executable.split(os.path.sep)
     if sys.executable.startswith("/usr/"):
         path_components = ["", "etc", "polyarchiv"]
+        status_components = ["", "var", "lib", "polyarchiv"]
+        cache_components = ["", "var", "cache", "polyarchiv"]
     elif "bin" in path_components:
         # noinspection PyTypeChecker
-        path_components = path_components[: path_components.index("bin")] + [
-            "etc",
-            "polyarchiv",
-        ]
+        prefix_components = path_components[: path_components.index("bin")]
+        path_components = prefix_components + ["etc", "polyarchiv"]
+        status_components = prefix_components + ["var", "lib", "polyarchiv"]
+        cache_components = prefix_components + ["var", "cache", "polyarchiv"]
     else:
         path_components = ["config"]
+        status_components = ["config"]
+        cache_components = ["config"]
 
     config_dir = os.path.sep.join(path_components)
+    status_file = os.path.sep.join(status_components + ["status.json"])
+    config_cache_file = os.path.sep.join(cache_components + ["config.json"])
     parser = argparse.ArgumentParser(description="backup data from multiple sources")
     parser.add_argument(
         "-v",
@@ -123,7 +147,30 @@ def main(engines_file=None):
     )
     parser.add_argument("--config", "-C", default=config_dir, help="config dir")
     parser.add_argument(
-        "command", choices=("backup", "restore", "config", "plugins", "check")
+        "--status-file",
+        default=status_file,
+        help="status index, updated by each backup and read by 'check --fast'",
+    )
+    parser.add_argument(
+        "--config-cache",
+        default=config_cache_file,
+        help="cache of the parsed configuration files",
+    )
+    parser.add_argument(
+        "--no-config-cache",
+        action="store_true",
+        help="always parse all configuration files",
+        default=False,
+    )
+    parser.add_argument(
+        "--fast",
+        action="store_true",
+        help="check: only read the status index, without loading the configuration",
+        default=False,
+    )
+    parser.add_argument(
+        "command",
+        choices=("backup", "restore", "config", "plugins", "check", "watch"),
     )
     args = parser.parse_args()
     command = args.command
@@ -141,7 +188,13 @@ def main(engines_file=None):
     if args.dry:
         cprint("dry mode is selected: no write operation will be performed", YELLOW)
 
-    from polyarchiv.runner import Runner  # import it after the log configuration
+    if command == "check" and args.fast:
+        return_code, errors = StatusIndex(args.status_file).check()
+        print_check_result(return_code, errors, [], args.nrpe)
+        return return_code
+
+    # import them after the log configuration, and only when required
+    from polyarchiv.runner import Runner
 
     runner = Runner(
         [args.config],
@@ -150,6 +203,8 @@ def main(engines_file=None):
         command_confirm=args.confirm_commands,
         command_execute=not args.dry,
         log_file=args.log_file,
+        status_file=args.status_file,
+        config_cache_file=None if args.no_config_cache else args.config_cache,
     )
     if command == "backup":
         if runner.load():
@@ -187,6 +242,9 @@ def main(engines_file=None):
     elif command == "restore":
         if runner.load():
             runner.restore(args.only_collect_points, args.only_backup_points)
+    elif command == "watch":
+        if not runner.load() or not runner.watch(args.only_collect_points):
+            return_code = 1
     elif command == "config":
         cprint(
             "configuration directory: %s (you can change it with -C /other/directory)"
@@ -194,6 +252,8 @@ def main(engines_file=None):
             YELLOW,
         )
         if runner.load():
+            from polyarchiv.visitors import ConfigVisitor
+
             if verbosity == 1:
                 cprint("you can display more info with --verbose", CYAN)
             visitor = ConfigVisitor(engines_file=engines_file)
@@ -203,6 +263,8 @@ def main(engines_file=None):
                 only_backup_points=args.only_backup_points,
             )
     elif command == "check":
+        from polyarchiv.visitors import CheckVisitor
+
         visitor = CheckVisitor()
         if runner.load():
             runner.visit(
@@ -211,24 +273,11 @@ def main(engines_file=None):
                 only_backup_points=args.only_backup_points,
             )
             return_code = visitor.return_code
-            msg = ", ".join(visitor.errors)
-            if return_code == 0:
-                msg = "everything is valid"
+            errors = visitor.errors
         else:
-            msg = "Unable to load configuration"
+            errors = ["Unable to load configuration"]
             return_code = 2
-        if args.nrpe:
-            if return_code == 2:
-                msg = "CRITICAL - %s" % msg
-            elif return_code == 1:
-                msg = "WARNING - %s" % msg
-            elif return_code == 0:
-                msg = "OK - %s" % msg
-            else:
-                msg = "UNKNOWN - %s" % msg
-        elif visitor.warnings:
-            msg += "\n" + "\n".join(visitor.warnings)
-        cprint(msg)
+        print_check_result(return_code, errors, visitor.warnings, args.nrpe)
     elif command == "plugins":
         width = 80
         tput_cols = subprocess.check_output(["tput", "cols"]).decode().strip()
@@ -310,7 +359,7 @@ def main(engines_file=None):
         )
     else:
         cprint("unknown command '%s'" % command, RED)
-        cprint("available commands: backup|restore|config|plugins", YELLOW)
+        cprint("available commands: backup|restore|config|plugins|watch", YELLOW)
     return return_code
 
 
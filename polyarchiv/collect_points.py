@@ -7,14 +7,17 @@ import os
 import re
 import shutil
 import subprocess
+import sys
 import tarfile
+import tempfile
 
 # noinspection PyProtectedMember
 from polyarchiv._vendor.lru_cache import lru_cache
-from polyarchiv.conf import Parameter, strip_split, check_directory
+from polyarchiv.conf import Parameter, strip_split, check_directory, bool_setting
 from polyarchiv.config_checks import ValidSvnUrl
 from polyarchiv.filelocks import Lock
 from polyarchiv.hooks import Hook
+from polyarchiv.metadata import MetadataStore, COLLECT_POINT
 from polyarchiv.points import Point, PointInfo
 from polyarchiv.utils import (
     text_type,
@@ -22,6 +25,7 @@ from polyarchiv.utils import (
     url_auth_split,
     DEFAULT_EMAIL,
     DEFAULT_USERNAME,
+    get_is_time_elapsed,
 )
 
 __author__ = "Matthieu Gallet"
@@ -102,6 +106,7 @@ class CollectPoint(Point):
             )
         lock_ = None
         cwd = os.getcwd()
+        self.load_source_data(info)
         try:
             if self.can_execute_command(""):
                 lock_ = self.get_lock()
@@ -129,6 +134,7 @@ class CollectPoint(Point):
             info.last_message = text_type(e)
         finally:
             os.chdir(cwd)
+        self.store_source_data(info)
 
         if lock_ is not None:
             try:
@@ -153,11 +159,25 @@ class CollectPoint(Point):
                 next_path, self.filter_private_path(filter_), allow_in_place=True
             )
 
+        self.load_source_data(self.get_info())
         self.pre_source_restore()
         for source in self.sources:
             source.restore()
         self.post_source_restore()
 
+    def load_source_data(self, info):
+        """copy the data of each source, stored in `info.data["sources"]`, to `source.info_data`"""
+        sources_data = (info.data or {}).get("sources", {})
+        for source in self.sources:
+            source.info_data = sources_data.get(source.name, {})
+
+    def store_source_data(self, info):
+        """store `source.info_data` in `info.data["sources"]`"""
+        info.data = info.data or {}
+        info.data["sources"] = {
+            source.name: source.info_data for source in self.sources if source.info_data
+        }
+
     def add_source(self, source):
         """
         :param source: source
@@ -195,6 +215,12 @@ class CollectPoint(Point):
     def metadata_path(self):
         raise NotImplementedError
 
+    @property
+    def metadata_store(self):
+        """:class:`polyarchiv.metadata.MetadataStore` of this collect point and of its
+        backup points"""
+        raise NotImplementedError
+
     def pre_source_backup(self):
         """called before the first source backup"""
         pass
@@ -290,6 +316,11 @@ class FileRepository(CollectPoint):
         self.ensure_dir(path)
         return path
 
+    @cached_property
+    def metadata_store(self):
+        path = os.path.join(self.local_path, self.METADATA_FOLDER, "metadata.sqlite3")
+        return MetadataStore(self.format_value(path))
+
     @cached_property
     def lock_filepath(self):
         return os.path.join(self.metadata_path, "lock")
@@ -309,22 +340,20 @@ class FileRepository(CollectPoint):
         return self.format_value(path)
 
     def get_info(self):
+        # JSON file of previous versions
         path = os.path.join(self.metadata_path, "%s.json" % self.name)
-        self.ensure_dir(path, parent=True)
-        if os.path.isfile(path):
-            with codecs.open(path, "r", encoding="utf-8") as fd:
-                content = fd.read()
-            return PointInfo.from_str(content)
-        else:
-            return PointInfo()
+        info = self.metadata_store.get_info(
+            COLLECT_POINT,
+            self.name,
+            legacy_path=path,
+            import_legacy=self.command_execute,
+        )
+        return PointInfo() if info is None else info
 
     def set_info(self, info):
         assert isinstance(info, PointInfo)
-        path = os.path.join(self.metadata_path, "%s.json" % self.name)
-        self.ensure_dir(path, parent=True)
-        content = info.to_str()
-        with codecs.open(path, "w", encoding="utf-8") as fd:
-            fd.write(content)
+        self.ensure_dir(self.metadata_store.path, parent=True)
+        self.metadata_store.add_run(COLLECT_POINT, self.name, info)
 
     def get_lock(self):
         self.ensure_dir(self.lock_filepath, parent=True)
@@ -374,6 +403,30 @@ class GitRepository(FileRepository):
             "commit_message",
             help_str='commit message (default: "Backup {Y}/{m}/{d} {H}:{M}") [*]',
         ),
+        Parameter(
+            "many_files",
+            converter=bool_setting,
+            help_str="speed up git on large working trees with the untracked cache, "
+            "the feature.manyFiles settings and the version 4 of the index "
+            "(default: true)",
+        ),
+        Parameter(
+            "fsmonitor",
+            converter=bool_setting,
+            help_str="use the builtin file system monitor of git (core.fsmonitor, only "
+            "available on macOS and Windows with git 2.37+, default: false)",
+        ),
+        Parameter(
+            "gc_auto",
+            converter=bool_setting,
+            help_str="run 'git gc --auto' after each commit (default: true)",
+        ),
+        Parameter(
+            "repack_frequency",
+            converter=get_is_time_elapsed,
+            help_str="run 'git repack -a -d' with this frequency (same format as the "
+            "frequency option, default: never)",
+        ),
     ]
 
     def __init__(
@@ -382,12 +435,82 @@ class GitRepository(FileRepository):
         commit_name=DEFAULT_USERNAME,
         commit_email=DEFAULT_EMAIL,
         commit_message="Backup {Y}/{m}/{d} {H}:{M}",
+        many_files=True,
+        fsmonitor=False,
+        gc_auto=True,
+        repack_frequency=None,
         **kwargs
     ):
         super(GitRepository, self).__init__(name=name, **kwargs)
         self.commit_name = commit_name
         self.commit_email = commit_email
         self.commit_message = commit_message
+        self.many_files = many_files
+        self.fsmonitor = fsmonitor
+        self.gc_auto = gc_auto
+        self.repack_frequency = repack_frequency
+
+    def get_git_settings(self):
+        """Return the list of `(key, value)` of the repository config"""
+        settings = []
+        if self.many_files:
+            settings += [
+                ("core.untrackedCache", "true"),
+                ("feature.manyFiles", "true"),
+                ("index.version", "4"),
+            ]
+        if self.fsmonitor:
+            if sys.platform in ("darwin", "win32"):
+                settings.append(("core.fsmonitor", "true"))
+            else:
+                self.print_error("core.fsmonitor is not available on this platform")
+        return settings
+
+    def apply_git_settings(self):
+        """Write the repository config, only when settings have been modified"""
+        settings = self.get_git_settings()
+        content = "".join("%s=%s\n" % x for x in settings)
+        git_dir = os.path.join(self.import_data_path, ".git")
+        settings_path = os.path.join(git_dir, "polyarchiv-settings")
+        if os.path.isfile(settings_path):
+            with codecs.open(settings_path, "r", encoding="utf-8") as fd:
+                if fd.read() == content:
+                    return
+        for key, value in settings:
+            self.execute_command(
+                [self.config.git_executable, "config", key, value],
+                cwd=self.import_data_path,
+            )
+        if self.can_execute_command(["echo", content, ">", settings_path]):
+            with codecs.open(settings_path, "w", encoding="utf-8") as fd:
+                fd.write(content)
+
+    def maintain_git_repository(self):
+        if self.gc_auto:
+            self.execute_command(
+                [self.config.git_executable, "gc", "--auto", "--quiet"],
+                cwd=self.import_data_path,
+                env={"HOME": self.metadata_path},
+            )
+        if self.repack_frequency is None:
+            return
+        repack_path = os.path.join(self.metadata_path, "git-repack")
+        previous_repack = None
+        if os.path.isfile(repack_path):
+            previous_repack = datetime.datetime.fromtimestamp(
+                os.path.getmtime(repack_path)
+            )
+        if not self.repack_frequency(datetime.datetime.now(), previous_repack):
+            return
+        self.execute_command(
+            [self.config.git_executable, "repack", "-a", "-d", "-q"],
+            cwd=self.import_data_path,
+            env={"HOME": self.metadata_path},
+        )
+        if self.can_execute_command(["touch", repack_path]):
+            with open(repack_path, "wb"):
+                pass
+            os.utime(repack_path, None)
 
     def post_source_backup(self):
         super(GitRepository, self).post_source_backup()
@@ -414,9 +537,11 @@ class GitRepository(FileRepository):
                 env={"HOME": self.metadata_path},
             )
         os.chdir(self.import_data_path)
-        self.execute_command(
-            [self.config.git_executable, "init"], cwd=self.import_data_path
-        )
+        if not os.path.exists(os.path.join(self.import_data_path, ".git")):
+            self.execute_command(
+                [self.config.git_executable, "init"], cwd=self.import_data_path
+            )
+        self.apply_git_settings()
         self.execute_command([self.config.git_executable, "add", "."])
         self.execute_command(
             [
@@ -428,6 +553,7 @@ class GitRepository(FileRepository):
             ignore_errors=True,
             env={"HOME": self.metadata_path},
         )
+        self.maintain_git_repository()
 
     def pre_source_restore(self):
         os.chdir(self.import_data_path)
@@ -534,6 +660,18 @@ class SvnRepository(FileRepository):
             "commit_message",
             help_str='commit message (default: "Backup {Y}/{m}/{d} {H}:{M}") [*]',
         ),
+        Parameter(
+            "fast_add",
+            converter=bool_setting,
+            help_str="add new files with 'svn add --force .' instead of listing them "
+            "with 'svn status' (default: true)",
+        ),
+        Parameter(
+            "commit_chunk_size",
+            converter=int,
+            help_str="commit modified files by chunks of this number of files "
+            "(default: 0, a single commit)",
+        ),
     ]
     checks = FileRepository.checks + [ValidSvnUrl("remote_url")]
 
@@ -545,6 +683,8 @@ class SvnRepository(FileRepository):
         client_cert=None,
         client_cert_password=None,
         commit_message="Backup {Y}/{m}/{d} {H}:{M}",
+        fast_add=True,
+        commit_chunk_size=0,
         **kwargs
     ):
         super(SvnRepository, self).__init__(name=name, **kwargs)
@@ -556,6 +696,8 @@ class SvnRepository(FileRepository):
         self.client_cert = client_cert
         self.commit_message = commit_message
         self.client_cert_password = client_cert_password
+        self.fast_add = fast_add
+        self.commit_chunk_size = commit_chunk_size
 
     @cached_property
     def svn_folder(self):
@@ -571,42 +713,94 @@ class SvnRepository(FileRepository):
             cmd += [self.remote_url, self.import_data_path]
             self.execute_command(cmd)
 
-    def post_source_backup(self):
-        cmd = [self.config.svn_executable, "status"]
+    def iter_status(self, *args):
+        """Yield `(item status, property status, name)` for each line of `svn status`,
+        while the output is read"""
+        cmd = [self.config.svn_executable, "status"] + list(args)
         p = subprocess.Popen(
             cmd,
             cwd=self.import_data_path,
             stdout=subprocess.PIPE,
             stderr=open(os.devnull, "wb"),
         )
-        stdout, stderr = p.communicate()
-        to_add = []
-        to_remove = []
-        for line in stdout.decode("utf-8").splitlines():
-            matcher = re.match(
-                r"^([ ADMRCXI?!~])[ MC][ L][ +][ S][ KOTB][ C] (?P<name>.*)$", line
-            )
-            if not matcher:
-                continue
-            status, name = matcher.groups()
-            if status == "?":
-                to_add.append(name)
-            elif status == "!":
-                to_remove.append(name)
-        if to_add:
+        regex = re.compile(r"^([ ADMRCXI?!~])([ MC])[ L][ +][ S][ KOTB][ C] (.*)$")
+        try:
+            for line in p.stdout:
+                matcher = regex.match(line.decode("utf-8").rstrip("\r\n"))
+                if matcher:
+                    yield matcher.groups()
+        finally:
+            p.stdout.close()
+            p.wait()
+
+    def execute_with_targets(self, cmd, names):
+        """Run a svn command on a list of paths given by a --targets file
+        (nothing is done if the list is empty)"""
+        with tempfile.NamedTemporaryFile(prefix="svn-targets") as fd:
+            for name in names:
+                fd.write((name + "\n").encode("utf-8"))
+            if fd.tell() == 0:
+                return
+            fd.flush()
             self.execute_command(
-                [self.config.svn_executable, "add"] + to_add, cwd=self.import_data_path
+                cmd + ["--targets", fd.name], cwd=self.import_data_path
             )
-        if to_remove:
+
+    def post_source_backup(self):
+        svn = self.config.svn_executable
+        if self.fast_add:
+            # unversioned files are added without listing them
             self.execute_command(
-                [self.config.svn_executable, "rm", "--force"] + to_remove,
+                [svn, "add", "--force", "--depth", "infinity", "."],
                 cwd=self.import_data_path,
             )
+        else:
+            to_add = (x[2] for x in self.iter_status() if x[0] == "?")
+            self.execute_with_targets([svn, "add"], to_add)
+        to_remove = (x[2] for x in self.iter_status() if x[0] == "!")
+        self.execute_with_targets([svn, "rm", "--force"], to_remove)
         message = self.format_value(self.commit_message)
-        cmd = [self.config.svn_executable, "ci", "-m", message]
+        if self.commit_chunk_size:
+            self.commit_chunks(message)
+        cmd = [svn, "ci", "-m", message]
         cmd += self.__svn_parameters()
         self.execute_command(cmd, cwd=self.import_data_path)
 
+    def commit_chunks(self, message):
+        """Commit modified paths by chunks of `commit_chunk_size` paths.
+        Paths are stored in a temporary file, since svn locks the working copy."""
+        with tempfile.TemporaryFile() as fd:
+            deleted_dir = None
+            for status, prop_status, name in self.iter_status("-q"):
+                if deleted_dir is not None and name.startswith(deleted_dir):
+                    continue  # deleted with its parent directory
+                elif status == "D":
+                    deleted_dir = name + os.path.sep
+                elif status not in "AMR" and prop_status != "M":
+                    continue
+                fd.write(("%s%s\n" % (status, name)).encode("utf-8"))
+            fd.seek(0)
+            chunk = []
+            for line in fd:
+                line = line.decode("utf-8").rstrip("\n")
+                chunk.append(line)
+                if len(chunk) >= self.commit_chunk_size:
+                    self.commit_chunk(chunk, message)
+                    chunk = []
+            if chunk:
+                self.commit_chunk(chunk, message)
+
+    def commit_chunk(self, chunk, message):
+        base_cmd = [self.config.svn_executable, "ci", "-m", message]
+        base_cmd += self.__svn_parameters()
+        # deleted directories are committed with their content
+        deleted = [x[1:] for x in chunk if x[0] == "D"]
+        others = [x[1:] for x in chunk if x[0] != "D"]
+        if deleted:
+            self.execute_with_targets(base_cmd, deleted)
+        if others:
+            self.execute_with_targets(base_cmd + ["--depth", "empty"], others)
+
     def __svn_parameters(self):
         result = ["--non-interactive", "--no-auth-cache"]
         if self.username:
@@ -0,0 +1,138 @@
+# -*- coding=utf-8 -*-
+"""Cache of the parsed configuration files.
+
+Parsing hundreds of `.ini` files dominates short runs (like `polyarchiv check` called by
+NRPE). The sections and options of each file are stored in a JSON file, with the
+modification time and the size of the file. A cached file is only used if these values
+are unchanged (a single `stat` call), otherwise the file is parsed again.
+
+"""
+from __future__ import unicode_literals
+
+import json
+import os
+
+from polyarchiv.utils import write_file_atomic
+
+try:
+    # noinspection PyUnresolvedReferences,PyCompatibility
+    from configparser import RawConfigParser, DEFAULTSECT
+except ImportError:
+    # noinspection PyUnresolvedReferences,PyCompatibility
+    from ConfigParser import RawConfigParser, DEFAULTSECT
+
+__author__ = "Matthieu Gallet"
+
+CONFIG_CACHE_VERSION = 1
+
+
+class ConfigCache(object):
+    """Parsed configuration files, stored as
+    `{"version": 1, "files": {path: {"mtime": …, "size": …, "defaults": …,
+    "sections": [[section, [[option, value], …]], …]}}}`.
+
+    Configuration files may contain passwords, so the cache is only readable by its
+    owner and a cached file is only used if it is also readable by the current user.
+    Cached files may also define hooks and commands, so a cache that may have been
+    written by another user is ignored.
+
+    :param path: absolute path of the JSON cache
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.files = None  # loaded on the first use
+        self.modified = False
+
+    def load(self):
+        """return the dict {path: cached file}"""
+        if self.files is None:
+            self.files = {}
+            # noinspection PyBroadException
+            try:
+                with open(self.path, "r") as fd:
+                    data = {}
+                    if self.is_trusted(os.fstat(fd.fileno())):
+                        data = json.load(fd)
+                if data.get("version") == CONFIG_CACHE_VERSION:
+                    self.files = data["files"]
+            except Exception:  # missing or invalid cache: everything will be parsed
+                pass
+        return self.files
+
+    @staticmethod
+    def is_trusted(cache_stat):
+        """Return True if the cache is owned by the current user and is not writable
+        by other users"""
+        return cache_stat.st_uid == os.geteuid() and not cache_stat.st_mode & 0o022
+
+    def get_parser(self, config_file):
+        """Return a :class:`RawConfigParser` with the content of `config_file`.
+
+        Raise the same exceptions as :meth:`RawConfigParser.read` when the file is
+        parsed (`IOError` if it cannot be read, `ConfigError` if it is invalid).
+        """
+        files = self.load()
+        config_file = os.path.abspath(config_file)
+        stat = os.stat(config_file)
+        cached = files.get(config_file)
+        if (
+            cached is not None
+            and cached["mtime"] == stat.st_mtime
+            and cached["size"] == stat.st_size
+            and os.access(config_file, os.R_OK)
+        ):
+            parser = RawConfigParser()
+            for option, value in cached["defaults"]:
+                parser.set(DEFAULTSECT, option, value)
+            for section, items in cached["sections"]:
+                parser.add_section(section)
+                for option, value in items:
+                    parser.set(section, option, value)
+            return parser
+        parser = RawConfigParser()
+        # noinspection PyTypeChecker
+        open(config_file, "rb").read(1)
+        parser.read([config_file])
+        defaults = parser.defaults()
+        files[config_file] = {
+            "mtime": stat.st_mtime,
+            "size": stat.st_size,
+            "defaults": sorted(defaults.items()),
+            "sections": [
+                [
+                    section,
+                    [
+                        [option, parser.get(section, option)]
+                        for option in parser.options(section)
+                        if defaults.get(option) != parser.get(section, option)
+                    ],
+                ]
+                for section in parser.sections()
+            ],
+        }
+        self.modified = True
+        return parser
+
+    def save(self):
+        """Write the cache if a file has been parsed, forgetting removed files (the
+        cache may be shared by several configuration directories).
+
+        :return: `True` if the cache is up to date
+        """
+        files = self.load()
+        removed_files = [x for x in files if not os.path.exists(x)]
+        if not self.modified and not removed_files:
+            return True
+        for config_file in removed_files:
+            del files[config_file]
+        content = json.dumps({"version": CONFIG_CACHE_VERSION, "files": files})
+        try:
+            dirname = os.path.dirname(self.path)
+            if dirname and not os.path.isdir(dirname):
+                os.makedirs(dirname)
+            write_file_atomic(self.path, content, mode=0o600)
+        except (IOError, OSError):  # e.g., the cache directory is not writable
+            return False
+        self.modified = False
+        return True
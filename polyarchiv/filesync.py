@@ -0,0 +1,284 @@
+# -*- coding=utf-8 -*-
+"""Pure-Python equivalent of `rsync -a --delete`, used by the `engine=native` option of
+:class:`polyarchiv.sources.LocalFiles`.
+
+Directories are scanned level by level with `os.scandir` and files are copied by a pool
+of threads, using reflinks or in-kernel copies when available.
+
+"""
+from __future__ import unicode_literals
+
+import json
+import os
+import re
+import shutil
+import stat
+import threading
+from multiprocessing.pool import ThreadPool
+
+from polyarchiv.utils import clone_file, _remove_path
+
+try:
+    # noinspection PyCompatibility
+    from os import scandir
+except ImportError:
+    scandir = None
+
+__author__ = "Matthieu Gallet"
+
+SYNC_THREADS = 8
+
+
+def rsync_pattern_to_regex(pattern):
+    """Convert a rsync filter pattern to a regular expression, matched against relative paths
+    (with a trailing "/" for directories).
+
+    >>> bool(re.match(rsync_pattern_to_regex('*.pyc'), 'folder/test.pyc'))
+    True
+    >>> bool(re.match(rsync_pattern_to_regex('/*.pyc'), 'folder/test.pyc'))
+    False
+    >>> bool(re.match(rsync_pattern_to_regex('cache/'), 'folder/cache'))
+    False
+    >>> bool(re.match(rsync_pattern_to_regex('folder/**.pyc'), 'folder/sub/test.pyc'))
+    True
+
+    """
+    if pattern.startswith("/"):
+        prefix = "^"
+        pattern = pattern[1:]
+    else:
+        prefix = "^(?:.*/)?"
+    if pattern.endswith("/"):
+        suffix = "/$"
+        pattern = pattern[:-1]
+    else:
+        suffix = "/?$"
+    regex = ""
+    index = 0
+    while index < len(pattern):
+        c = pattern[index]
+        if pattern.startswith("**", index):
+            regex += ".*"
+            index += 2
+            continue
+        elif c == "*":
+            regex += "[^/]*"
+        elif c == "?":
+            regex += "[^/]"
+        elif c == "[" and "]" in pattern[index + 1 :]:
+            end = pattern.index("]", index + 1)
+            regex += pattern[index : end + 1]
+            index = end
+        else:
+            regex += re.escape(c)
+        index += 1
+    return prefix + regex + suffix
+
+
+def read_patterns(value):
+    """Return the list of patterns given by a `exclude` or `include` option
+    (a single pattern, or "@" followed by the path of a file with one pattern per line).
+    """
+    if not value:
+        return []
+    elif not value.startswith("@"):
+        return [value]
+    with open(value[1:]) as fd:
+        lines = [line.rstrip("\r\n") for line in fd]
+    return [line for line in lines if line and line[0] not in "#;"]
+
+
+class FileSync(object):
+    """Make `dst` identical to `src`, like `rsync -a --delete`: only new or modified files
+    (compared by size and modification time) are copied, and removed files are deleted.
+
+    Excluded paths are neither copied nor deleted. Owners are only preserved when running
+    as root and special files (sockets, devices, …) are ignored.
+    A manifest of all copied entries, with one JSON list `[path, size, mtime, mode]` per line,
+    is written to `manifest_path`.
+
+    :param src: source directory
+    :param dst: destination directory
+    :param exclude: list of rsync patterns (see :func:`rsync_pattern_to_regex`)
+    :param include: list of rsync patterns, that are not excluded
+    :param preserve_hard_links: files that are hard-linked in `src` are hard-linked in `dst`
+    :param threads: number of threads used to scan directories and to copy files
+    :param manifest_path: path of the manifest (not written if None)
+    """
+
+    def __init__(
+        self,
+        src,
+        dst,
+        exclude=None,
+        include=None,
+        preserve_hard_links=False,
+        threads=SYNC_THREADS,
+        manifest_path=None,
+    ):
+        self.src = src
+        self.dst = dst
+        # like rsync, the first matching rule applies: exclude rules are given first
+        self.rules = [
+            (re.compile(rsync_pattern_to_regex(x)), False) for x in exclude or []
+        ]
+        self.rules += [
+            (re.compile(rsync_pattern_to_regex(x)), True) for x in include or []
+        ]
+        self.preserve_hard_links = preserve_hard_links
+        self.threads = threads
+        self.manifest_path = manifest_path
+        self.preserve_owner = hasattr(os, "geteuid") and os.geteuid() == 0
+        self.lock = threading.Lock()
+        self.hard_links = {}  # self.hard_links[(st_dev, st_ino)] = first dst path
+        self.pending_links = []  # list of (first destination path, destination path)
+        self.directories = []  # list of (src path, dst path), parents before children
+        self.manifest_fd = None
+
+    def is_excluded(self, relpath, is_dir):
+        if is_dir:
+            relpath += "/"
+        for regex, included in self.rules:
+            if regex.match(relpath):
+                return not included
+        return False
+
+    def run(self):
+        if not os.path.isdir(self.dst):
+            os.makedirs(self.dst)
+        if self.manifest_path:
+            self.manifest_fd = open(self.manifest_path + ".tmp", "w")
+        pool = ThreadPool(self.threads)
+        try:
+            self.directories.append((self.src, self.dst))
+            level = [""]
+            while level:
+                next_level, copies = [], []
+                for subdirs, dir_copies in pool.imap_unordered(
+                    self.sync_directory, level
+                ):
+                    next_level += subdirs
+                    copies += dir_copies
+                for __ in pool.imap_unordered(self.copy_file, copies, 64):
+                    pass
+                level = next_level
+        finally:
+            pool.close()
+            pool.join()
+            if self.manifest_fd is not None:
+                self.manifest_fd.close()
+        for first_dst_path, dst_path in self.pending_links:
+            self.link_file(first_dst_path, dst_path)
+        # directory times must be set after their content has been written
+        for src_path, dst_path in reversed(self.directories):
+            self.copy_metadata(src_path, dst_path, os.lstat(src_path))
+        if self.manifest_fd is not None:
+            os.rename(self.manifest_path + ".tmp", self.manifest_path)
+
+    def listdir(self, path):
+        """return a dict {name: (is_dir, lstat result)}"""
+        if scandir is None:
+            return {
+                name: (stat.S_ISDIR(st.st_mode), st)
+                for (name, st) in [
+                    (x, os.lstat(os.path.join(path, x))) for x in os.listdir(path)
+                ]
+            }
+        return {
+            entry.name: (
+                entry.is_dir(follow_symlinks=False),
+                entry.stat(follow_symlinks=False),
+            )
+            for entry in scandir(path)
+        }
+
+    def sync_directory(self, reldir):
+        """Delete obsolete entries of a destination directory, create new subdirectories and
+        symlinks. Return the list of subdirectories and the list of files to copy."""
+        src_dir = os.path.join(self.src, reldir)
+        dst_dir = os.path.join(self.dst, reldir)
+        src_entries = self.listdir(src_dir)
+        dst_entries = self.listdir(dst_dir)
+        subdirs, copies, manifest = [], [], []
+        for name, (is_dir, dst_st) in dst_entries.items():
+            relpath = os.path.join(reldir, name)
+            if name not in src_entries and not self.is_excluded(relpath, is_dir):
+                _remove_path(os.path.join(dst_dir, name), is_dir)
+        for name, (is_dir, src_st) in src_entries.items():
+            relpath = os.path.join(reldir, name)
+            if self.is_excluded(relpath, is_dir):
+                continue
+            src_path = os.path.join(src_dir, name)
+            dst_path = os.path.join(dst_dir, name)
+            dst_is_dir, dst_st = dst_entries.get(name, (False, None))
+            mode = src_st.st_mode
+            if stat.S_ISDIR(mode):
+                if dst_st is not None and not dst_is_dir:
+                    os.unlink(dst_path)
+                if dst_st is None or not dst_is_dir:
+                    os.mkdir(dst_path)
+                subdirs.append(relpath)
+                with self.lock:
+                    self.directories.append((src_path, dst_path))
+            elif stat.S_ISLNK(mode):
+                link_to = os.readlink(src_path)
+                if dst_st is not None:
+                    if (
+                        stat.S_ISLNK(dst_st.st_mode)
+                        and os.readlink(dst_path) == link_to
+                    ):
+                        continue
+                    _remove_path(dst_path, dst_is_dir)
+                os.symlink(link_to, dst_path)
+                if self.preserve_owner:
+                    os.lchown(dst_path, src_st.st_uid, src_st.st_gid)
+            elif not stat.S_ISREG(mode):
+                continue
+            elif self.preserve_hard_links and src_st.st_nlink > 1:
+                key = (src_st.st_dev, src_st.st_ino)
+                with self.lock:
+                    first_dst_path = self.hard_links.setdefault(key, dst_path)
+                    if first_dst_path != dst_path:
+                        # linked after the copy of the first path
+                        self.pending_links.append((first_dst_path, dst_path))
+                if first_dst_path == dst_path:
+                    copies.append((src_path, dst_path, src_st, dst_is_dir, dst_st))
+            else:
+                copies.append((src_path, dst_path, src_st, dst_is_dir, dst_st))
+            manifest.append([relpath, src_st.st_size, src_st.st_mtime, mode])
+        if self.manifest_fd is not None and manifest:
+            content = "".join(json.dumps(x) + "\n" for x in manifest)
+            with self.lock:
+                self.manifest_fd.write(content)
+        return subdirs, copies
+
+    def copy_file(self, args):
+        src_path, dst_path, src_st, dst_is_dir, dst_st = args
+        if dst_st is not None and stat.S_ISREG(dst_st.st_mode):
+            if src_st.st_size == dst_st.st_size and int(src_st.st_mtime) == int(
+                dst_st.st_mtime
+            ):
+                if src_st.st_mode != dst_st.st_mode:
+                    os.chmod(dst_path, stat.S_IMODE(src_st.st_mode))
+                return
+        if dst_st is not None:
+            _remove_path(dst_path, dst_is_dir)
+        clone_file(src_path, dst_path)
+        if self.preserve_owner:
+            os.lchown(dst_path, src_st.st_uid, src_st.st_gid)
+
+    @staticmethod
+    def link_file(first_dst_path, dst_path):
+        """replace `dst_path` (that may be a directory or a dangling symlink) by a hard
+        link to `first_dst_path`"""
+        if os.path.lexists(dst_path):
+            first_dst_st, dst_st = os.lstat(first_dst_path), os.lstat(dst_path)
+            if os.path.samestat(first_dst_st, dst_st):
+                return
+            _remove_path(dst_path, stat.S_ISDIR(dst_st.st_mode))
+        os.link(first_dst_path, dst_path)
+
+    def copy_metadata(self, src_path, dst_path, src_st):
+        shutil.copystat(src_path, dst_path)
+        if self.preserve_owner:
+            os.lchown(dst_path, src_st.st_uid, src_st.st_gid)
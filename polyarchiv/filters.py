@@ -32,7 +32,7 @@ class FileFilter(ParameterizedObject):
             and not allow_in_place
             and self.can_execute_command(["cp", "-pPR", previous_path, next_path])
         ):
-            copytree(previous_path, next_path)
+            copytree(previous_path, next_path, incremental=True)
         self.do_backup(previous_path, next_path, private_path, allow_in_place)
         return next_path
 
@@ -48,7 +48,7 @@ class FileFilter(ParameterizedObject):
             and not allow_in_place
             and self.can_execute_command(["cp", "-pPR", next_path, previous_path])
         ):
-            copytree(next_path, previous_path)
+            copytree(next_path, previous_path, incremental=True)
         self.do_restore(previous_path, next_path, private_path, allow_in_place)
         return next_path
 
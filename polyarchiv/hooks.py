@@ -6,11 +6,6 @@ import shlex
 import smtplib
 from email.mime.text import MIMEText
 
-# noinspection PyProtectedMember
-from polyarchiv._vendor import requests
-
-# noinspection PyProtectedMember
-from polyarchiv._vendor.requests.auth import HTTPBasicAuth
 from polyarchiv.conf import Parameter, strip_split, CheckOption
 from polyarchiv.points import ParameterizedObject
 from polyarchiv.utils import text_type, FileContentMonitor, DEFAULT_EMAIL
@@ -244,6 +239,12 @@ class HttpHook(Hook):
         self.headers = headers
 
     def call(self, when, cm, collect_point_results, backup_point_results):
+        # noinspection PyProtectedMember
+        from polyarchiv._vendor import requests  # slow to import: only when required
+
+        # noinspection PyProtectedMember
+        from polyarchiv._vendor.requests.auth import HTTPBasicAuth
+
         self.set_extra_variables(cm, collect_point_results, backup_point_results)
         kwargs = {}
         body = self.format_value(self.body)
@@ -0,0 +1,287 @@
+# -*- coding=utf-8 -*-
+"""Journal of the files modified in a directory between two backups.
+
+The journal is filled by an inotify watcher (started by `polyarchiv watch`) and
+consumed by :class:`polyarchiv.sources.LocalFiles`, that only sends the modified paths
+to rsync instead of scanning the whole directory.
+
+"""
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import datetime
+import errno
+import fcntl
+import os
+import select
+import struct
+
+__author__ = "Matthieu Gallet"
+
+FULL_SCAN = b""  # an empty path in the journal means that a full scan is required
+
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_DONT_FOLLOW = 0x02000000
+IN_EXCL_UNLINK = 0x04000000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = os.O_NONBLOCK
+IN_CLOEXEC = 0o2000000
+
+WATCH_MASK = (
+    IN_MODIFY
+    | IN_ATTRIB
+    | IN_CLOSE_WRITE
+    | IN_MOVED_FROM
+    | IN_MOVED_TO
+    | IN_CREATE
+    | IN_DELETE
+    | IN_DELETE_SELF
+    | IN_MOVE_SELF
+    | IN_ONLYDIR
+    | IN_DONT_FOLLOW
+    | IN_EXCL_UNLINK
+)
+EVENT_HEADER = struct.Struct(str("iIII"))
+EVENT_BUFFER_SIZE = 1024 * 1024
+
+_libc = None
+
+
+def get_libc():
+    global _libc
+    if _libc is None:
+        libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+        if not hasattr(libc, "inotify_init1"):
+            raise ValueError("inotify is not available on this system")
+        libc.inotify_add_watch.argtypes = [
+            ctypes.c_int,
+            ctypes.c_char_p,
+            ctypes.c_uint32,
+        ]
+        _libc = libc
+    return _libc
+
+
+class ChangeJournal(object):
+    """Paths modified in a directory, stored as NUL-separated relative paths.
+
+    Recorded paths are moved to a "pending" file by `take` at the beginning of a backup,
+    and this file is removed by `commit` when the backup is successful. Pending paths of
+    a failed backup are kept and merged with the next ones.
+
+    :param path: absolute path of the journal file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.pending_path = path + ".pending"
+        self.pid_path = path + ".pid"
+        self.full_scan_path = path + ".full-scan"
+
+    def record(self, relpaths):
+        """append some paths (relative to the watched directory) to the journal"""
+        content = b"".join(relpath + b"\0" for relpath in relpaths)
+        if not content:
+            return
+        with open(self.path, "ab") as fd:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            try:
+                fd.write(content)
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def request_full_scan(self):
+        self.record([FULL_SCAN])
+
+    def is_watched(self):
+        """return True if a watcher is currently filling this journal"""
+        try:
+            with open(self.pid_path, "rb") as fd:
+                pid = int(fd.read().strip())
+            os.kill(pid, 0)
+        except (IOError, OSError, ValueError):
+            return False
+        return True
+
+    @property
+    def last_full_scan(self):
+        """date of the last successful full scan (or None)"""
+        if not os.path.isfile(self.full_scan_path):
+            return None
+        return datetime.datetime.fromtimestamp(os.path.getmtime(self.full_scan_path))
+
+    def take(self):
+        """Move the recorded paths to the pending file.
+
+        :return: False if a full scan is required, True if the pending file contains
+            all modified paths since the last successful backup
+        """
+        if os.path.isfile(self.path):
+            with open(self.path, "r+b") as fd:
+                fcntl.flock(fd, fcntl.LOCK_EX)
+                try:
+                    with open(self.pending_path, "ab") as pending_fd:
+                        for block in iter(lambda: fd.read(EVENT_BUFFER_SIZE), b""):
+                            pending_fd.write(block)
+                    fd.seek(0)
+                    fd.truncate()
+                finally:
+                    fcntl.flock(fd, fcntl.LOCK_UN)
+        if not self.is_watched() or self.last_full_scan is None:
+            return False
+        elif not os.path.isfile(self.pending_path):
+            return True
+        previous = b"\0"
+        with open(self.pending_path, "rb") as fd:
+            for block in iter(lambda: fd.read(EVENT_BUFFER_SIZE), b""):
+                # an empty path is either the first one or follows another \0
+                if previous + block[:1] == b"\0\0" or b"\0\0" in block:
+                    return False
+                previous = block[-1:]
+        return True
+
+    def has_pending_changes(self):
+        return (
+            os.path.isfile(self.pending_path) and os.path.getsize(self.pending_path) > 0
+        )
+
+    def commit(self, full_scan=False):
+        """the backup of the pending paths (or of the whole directory) is successful"""
+        if os.path.isfile(self.pending_path):
+            os.remove(self.pending_path)
+        if full_scan:
+            with open(self.full_scan_path, "wb"):
+                pass
+            os.utime(self.full_scan_path, None)
+
+
+class InotifyWatcher(object):
+    """Watch a directory tree with inotify and record all modified paths in a journal.
+
+    :param root: absolute path of the watched directory
+    :param journal: :class:`ChangeJournal`
+    """
+
+    def __init__(self, root, journal):
+        if not isinstance(root, bytes):
+            root = root.encode("utf-8")
+        self.root = os.path.abspath(root)
+        self.journal = journal
+        self.fd = None
+        self.relpaths = {}  # self.relpaths[watch descriptor] = relative path
+
+    def fileno(self):
+        return self.fd
+
+    def start(self):
+        libc = get_libc()
+        self.fd = libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+        with open(self.journal.pid_path, "wb") as fd:
+            fd.write(("%d\n" % os.getpid()).encode("utf-8"))
+        self.add_tree(b".")
+        # changes may have been missed before the start of the watcher
+        self.journal.request_full_scan()
+
+    def stop(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+        if os.path.isfile(self.journal.pid_path):
+            os.remove(self.journal.pid_path)
+
+    def add_watch(self, relpath):
+        path = os.path.normpath(os.path.join(self.root, relpath))
+        wd = get_libc().inotify_add_watch(self.fd, path, WATCH_MASK)
+        if wd < 0:
+            err = ctypes.get_errno()
+            if err == errno.ENOSPC:
+                # too many watched directories (see fs.inotify.max_user_watches)
+                self.journal.request_full_scan()
+            return False
+        self.relpaths[wd] = relpath
+        return True
+
+    def add_tree(self, relpath):
+        """watch a new directory and all its subdirectories.
+        Return the list of all paths in this directory."""
+        relpaths = [relpath]
+        if not self.add_watch(relpath):
+            return relpaths
+        for dirpath, dirnames, filenames in os.walk(os.path.join(self.root, relpath)):
+            dir_relpath = os.path.relpath(dirpath, self.root)
+            for dirname in dirnames:
+                dir_child = os.path.normpath(os.path.join(dir_relpath, dirname))
+                self.add_watch(dir_child)
+                relpaths.append(dir_child)
+            relpaths += [
+                os.path.normpath(os.path.join(dir_relpath, x)) for x in filenames
+            ]
+        return relpaths
+
+    def read_events(self):
+        """read all available events and record the modified paths"""
+        try:
+            data = os.read(self.fd, EVENT_BUFFER_SIZE)
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                return
+            raise
+        relpaths = set()
+        offset = 0
+        while offset < len(data):
+            wd, mask, __, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset : offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                relpaths.add(FULL_SCAN)
+                continue
+            elif mask & IN_IGNORED:
+                self.relpaths.pop(wd, None)
+                continue
+            dir_relpath = self.relpaths.get(wd)
+            if dir_relpath is None or not name:
+                continue
+            relpath = os.path.normpath(os.path.join(dir_relpath, name))
+            relpaths.add(relpath)
+            if mask & (IN_CREATE | IN_DELETE | IN_MOVED_FROM | IN_MOVED_TO):
+                # the modification time of the parent directory is also modified
+                relpaths.add(dir_relpath)
+            if mask & IN_ISDIR and mask & (IN_CREATE | IN_MOVED_TO):
+                relpaths.update(self.add_tree(relpath))
+        self.journal.record(sorted(relpaths))
+
+
+def watch(watchers, timeout=None):
+    """Watch all directories until interrupted.
+
+    :param watchers: list of :class:`InotifyWatcher`
+    :param timeout: stop after `timeout` seconds without any event (None: never stop)
+    """
+    for watcher in watchers:
+        watcher.start()
+    try:
+        while True:
+            ready, __, __ = select.select(watchers, [], [], timeout)
+            if not ready:
+                break
+            for watcher in ready:
+                watcher.read_events()
+    finally:
+        for watcher in watchers:
+            watcher.stop()
@@ -0,0 +1,124 @@
+# -*- coding=utf-8 -*-
+"""History of the runs of a collect point and of its backup points.
+
+All states are stored in a SQLite database in the `metadata` folder of the collect
+point. Each run appends a single row with the complete state of the point (a
+serialized :class:`polyarchiv.points.PointInfo`), so the current state of a point is its
+last row and the previous rows give the history of timings, sizes and messages.
+The JSON files used by previous versions are imported on their first read.
+
+"""
+from __future__ import unicode_literals
+
+import codecs
+import datetime
+import os
+import sqlite3
+
+from polyarchiv.points import PointInfo
+
+__author__ = "Matthieu Gallet"
+
+COLLECT_POINT = "collect_point"
+BACKUP_POINT = "backup_point"
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    date TEXT NOT NULL,
+    state INTEGER,
+    total_size INTEGER,
+    message TEXT,
+    info TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_point ON runs (kind, name, id);
+"""
+
+
+class MetadataStore(object):
+    """Append-only store of :class:`polyarchiv.points.PointInfo`.
+
+    A point is identified by its kind (:data:`COLLECT_POINT` or :data:`BACKUP_POINT`)
+    and its name.
+
+    :param path: absolute path of the SQLite database
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.initialized = False
+
+    def connect(self):
+        initialize = not self.initialized or not os.path.isfile(self.path)
+        connection = sqlite3.connect(self.path, timeout=60)
+        if initialize:
+            connection.executescript(SCHEMA)
+            self.initialized = True
+        return connection
+
+    def add_run(self, kind, name, info):
+        """record the state of a point after a run (a single insert, in a transaction)"""
+        assert isinstance(info, PointInfo)
+        connection = self.connect()
+        try:
+            with connection:
+                connection.execute(
+                    "INSERT INTO runs (kind, name, date, state, total_size, message, "
+                    "info) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        kind,
+                        name,
+                        PointInfo.datetime_to_str(datetime.datetime.now()),
+                        info.last_state_valid,
+                        info.total_size,
+                        info.last_message,
+                        info.to_str(),
+                    ),
+                )
+        finally:
+            connection.close()
+
+    def get_runs(self, kind, name, limit=None):
+        """Return the recorded states of a point, the most recent first, as a list of
+        `(date, PointInfo)`."""
+        if not os.path.isfile(self.path):
+            return []
+        query = (
+            "SELECT date, info FROM runs WHERE kind = ? AND name = ? ORDER BY id DESC"
+        )
+        args = [kind, name]
+        if limit is not None:
+            query += " LIMIT ?"
+            args.append(limit)
+        connection = self.connect()
+        try:
+            rows = connection.execute(query, args).fetchall()
+        finally:
+            connection.close()
+        return [
+            (PointInfo.datetime_from_str(x[0]), PointInfo.from_str(x[1])) for x in rows
+        ]
+
+    def get_info(self, kind, name, legacy_path=None, import_legacy=True):
+        """Return the last state of a point.
+
+        :param legacy_path: JSON file used by previous versions, read if this point has
+            no recorded state
+        :param import_legacy: record the content of `legacy_path` in the store
+        :return: :class:`polyarchiv.points.PointInfo` or None
+        """
+        runs = self.get_runs(kind, name, limit=1)
+        if runs:
+            return runs[0][1]
+        elif not legacy_path or not os.path.isfile(legacy_path):
+            return None
+        with codecs.open(legacy_path, "r", encoding="utf-8") as fd:
+            content = fd.read()
+        try:
+            info = PointInfo.from_str(content)
+        except (ValueError, KeyError, AssertionError):
+            return None
+        if import_legacy:
+            self.add_run(kind, name, info)
+        return info
@@ -238,6 +238,9 @@ class ParameterizedObject(object):
                 os.makedirs(dirname)
                 return True
             except OSError:
+                # may be concurrently created by another thread
+                if os.path.isdir(dirname):
+                    return True
                 raise ValueError("Unable to create the %s directory" % dirname)
         return False
 
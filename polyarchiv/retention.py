@@ -0,0 +1,169 @@
+# -*- coding=utf-8 -*-
+"""Retention of the archives created by :class:`polyarchiv.backup_points.RollingTarArchive`.
+
+The history of archives is stored in the backup point info as a sorted list of
+timestamps, and :func:`plan_retention` selects the archives to keep with a binary search
+per kept archive instead of a scan of the whole history for each granularity.
+
+"""
+from __future__ import unicode_literals
+
+import bisect
+import datetime
+
+from polyarchiv.utils import TIME_VARIABLES
+
+__author__ = "Matthieu Gallet"
+
+HISTORY_VERSION = 2
+EPOCH = datetime.datetime(1970, 1, 1)
+HOUR = 3600
+DAY = 24 * HOUR
+
+
+def datetime_to_timestamp(value):
+    """Number of seconds of a naive datetime since 1970-01-01
+
+    >>> datetime_to_timestamp(datetime.datetime(2016, 1, 1, 12, 30))
+    1451651400
+    """
+    delta = value - EPOCH
+    return delta.days * DAY + delta.seconds
+
+
+def timestamp_to_datetime(value):
+    """
+    >>> timestamp_to_datetime(1451651400)
+    datetime.datetime(2016, 1, 1, 12, 30)
+    """
+    return EPOCH + datetime.timedelta(seconds=value)
+
+
+def plan_retention(timestamps, rules, now):
+    """Select the archives to keep: for each rule `(interval, count)`, at least one
+    archive is kept in each `interval` (in seconds) during the last `count` intervals.
+    Archives are selected from the most recent one, like successive calls to
+    :meth:`polyarchiv.backup_points.RollingTarArchive.set_accepted_times`.
+
+    :param timestamps: sorted list of distinct timestamps
+    :param rules: list of `(interval, count)`
+    :param now: current timestamp
+    :return: sorted list of the indices of the kept timestamps
+
+    >>> plan_retention([0, 3, 4, 5, 7, 8, 9], [(3, 5)], now=9)
+    [0, 3, 6]
+    >>> plan_retention([0, 3, 4, 5, 7, 8, 9], [(3, 2), (1, 1)], now=9)
+    [3, 5, 6]
+    """
+    kept = []  # sorted indices
+    for interval, count in rules:
+        if not count:
+            continue
+        lowest = bisect.bisect_left(timestamps, now - interval * count)
+        index = len(timestamps) - 1
+        while index >= lowest:
+            position = bisect.bisect_left(kept, index)
+            if position == len(kept) or kept[position] != index:
+                kept.insert(position, index)
+            # the next kept archive is either old enough or already kept
+            older = bisect.bisect_right(
+                timestamps, timestamps[index] - interval, lowest, index
+            )
+            index = max(older - 1, kept[position - 1] if position > 0 else -1)
+    return kept
+
+
+def time_variables(timestamp):
+    """Return the variables of a datetime, like :func:`polyarchiv.utils.base_variables`"""
+    value = timestamp_to_datetime(timestamp)
+    return {x: value.strftime("%" + x) for x in TIME_VARIABLES}
+
+
+class ArchiveHistory(object):
+    """Timestamps of the existing archives, with the other variables (like the hostname
+    or the microseconds) required to build their URL.
+
+    Stored as `{"version": 2, "variables": [dict], "archives": [[timestamp, index]],
+    "errors": [[timestamp, message]]}`, where the index refers to the list of distinct
+    variables and errors are the failed deletions of expired archives.
+    The previous format (a list of dict of variables) is converted on load.
+    """
+
+    def __init__(self):
+        self.timestamps = []  # sorted list
+        self.other_variables = {}  # self.other_variables[timestamp] = dict
+        self.errors = {}  # self.errors[timestamp] = error message of the last deletion
+
+    @classmethod
+    def from_data(cls, data):
+        history = cls()
+        if isinstance(data, list):
+            for variables in data:
+                history.add(variables)
+        elif data:
+            all_variables = data["variables"]
+            archives = sorted(data["archives"])
+            history.timestamps = [x[0] for x in archives]
+            history.other_variables = {x[0]: all_variables[x[1]] for x in archives}
+            history.errors = {x[0]: x[1] for x in data.get("errors", [])}
+        return history
+
+    def to_data(self):
+        all_variables, indices = [], {}
+        archives = []
+        for timestamp in self.timestamps:
+            variables = self.other_variables[timestamp]
+            key = tuple(sorted(variables.items()))
+            if key not in indices:
+                indices[key] = len(all_variables)
+                all_variables.append(variables)
+            archives.append([timestamp, indices[key]])
+        return {
+            "version": HISTORY_VERSION,
+            "variables": all_variables,
+            "archives": archives,
+            "errors": sorted([k, v] for (k, v) in self.errors.items()),
+        }
+
+    def add(self, variables):
+        """add an archive, given by the variables used to format its URL"""
+        value = datetime.datetime(
+            year=int(variables["Y"]),
+            month=int(variables["m"]),
+            day=int(variables["d"]),
+            hour=int(variables["H"]),
+            minute=int(variables["M"]),
+            second=int(variables["S"]),
+        )
+        timestamp = datetime_to_timestamp(value)
+        index = bisect.bisect_left(self.timestamps, timestamp)
+        if index == len(self.timestamps) or self.timestamps[index] != timestamp:
+            self.timestamps.insert(index, timestamp)
+        # time variables that cannot be rebuilt from the timestamp (like the microseconds
+        # "f") are kept with the other ones
+        rebuilt_variables = time_variables(timestamp)
+        self.other_variables[timestamp] = {
+            k: v for (k, v) in variables.items() if rebuilt_variables.get(k) != v
+        }
+        return timestamp
+
+    def get_variables(self, timestamp):
+        """variables used to format the URL of an archive"""
+        variables = time_variables(timestamp)
+        variables.update(self.other_variables[timestamp])
+        return variables
+
+    def plan(self, rules, now):
+        """Return the list of timestamps to keep and the list of timestamps to remove"""
+        kept = plan_retention(self.timestamps, rules, datetime_to_timestamp(now))
+        kept_set = set(kept)
+        to_keep = [self.timestamps[i] for i in kept]
+        to_remove = [x for (i, x) in enumerate(self.timestamps) if i not in kept_set]
+        return to_keep, to_remove
+
+    def remove(self, timestamps):
+        removed = set(timestamps)
+        self.timestamps = [x for x in self.timestamps if x not in removed]
+        for timestamp in removed:
+            self.other_variables.pop(timestamp, None)
+            self.errors.pop(timestamp, None)
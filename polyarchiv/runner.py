@@ -4,25 +4,28 @@
 from __future__ import unicode_literals
 
 import errno
-import fnmatch
+import functools
 import glob
 import os
 import pwd
 import shlex
 import tempfile
+from collections import OrderedDict
 
 try:
-    from pkg_resources import iter_entry_points
+    # noinspection PyCompatibility
+    from collections.abc import Mapping
 except ImportError:
-    iter_entry_points = None
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from collections import Mapping
 
-from polyarchiv.backup_points import BackupPoint
-from polyarchiv.collect_points import CollectPoint
+# noinspection PyProtectedMember
+from polyarchiv._vendor.lru_cache import lru_cache
+from polyarchiv.associations import AssociationIndex, can_associate
 from polyarchiv.conf import Parameter
-from polyarchiv.filters import FileFilter
-from polyarchiv.hooks import Hook
+from polyarchiv.config_cache import ConfigCache
 from polyarchiv.points import ParameterizedObject, PointInfo, Config
-from polyarchiv.sources import Source
+from polyarchiv.status import StatusIndex
 from polyarchiv.utils import (
     import_string,
     text_type,
@@ -40,6 +43,81 @@ except ImportError:
 __author__ = "Matthieu Gallet"
 
 
+def iter_entry_points(group):
+    """Return the entry points of a group. `importlib.metadata` is preferred to
+    `pkg_resources`, that is much slower to import."""
+    try:
+        # noinspection PyCompatibility
+        from importlib.metadata import entry_points
+    except ImportError:
+        try:
+            from pkg_resources import iter_entry_points as pkg_iter_entry_points
+        except ImportError:
+            return []
+        return pkg_iter_entry_points(group)
+    points = entry_points()
+    if hasattr(points, "select"):
+        return points.select(group=group)
+    return points.get(group, [])
+
+
+class EngineRegistry(Mapping):
+    """Map engine names to engine classes. Engines are only registered by name: their
+    module is imported on the first access to the class.
+
+    An engine that cannot be imported is considered as missing (`KeyError`) when
+    registered with `ignore_errors`, otherwise the `ImportError` is raised.
+    """
+
+    def __init__(self):
+        self.loaders = OrderedDict()
+        self.engines = {}
+
+    def register(self, name, loader, ignore_errors=False):
+        """:param loader: callable returning the engine class"""
+        name = name.lower()
+        self.loaders[name] = (loader, ignore_errors)
+        self.engines.pop(name, None)
+
+    def __getitem__(self, name):
+        if name in self.engines:
+            return self.engines[name]
+        loader, ignore_errors = self.loaders[name]
+        if ignore_errors:
+            # noinspection PyBroadException
+            try:
+                engine_cls = loader()
+            except Exception:
+                del self.loaders[name]
+                raise KeyError(name)
+        else:
+            engine_cls = loader()
+        self.engines[name] = engine_cls
+        return engine_cls
+
+    def __contains__(self, name):
+        return name in self.loaders
+
+    def __iter__(self):
+        return iter(list(self.loaders))
+
+    def __len__(self):
+        return len(self.loaders)
+
+    def items(self):
+        """load all engines, skipping the invalid ones"""
+        result = []
+        for name in self:
+            try:
+                result.append((name, self[name]))
+            except KeyError:
+                pass
+        return result
+
+    def values(self):
+        return [x[1] for x in self.items()]
+
+
 class Runner(ParameterizedObject):
     """Run backup and restore operations for all specified configurations
     """
@@ -56,7 +134,15 @@ class Runner(ParameterizedObject):
     hook_section = "hook "
     collect_point_variables_section = "variables "
 
-    def __init__(self, config_directories, engines_file=None, log_file=None, **kwargs):
+    def __init__(
+        self,
+        config_directories,
+        engines_file=None,
+        log_file=None,
+        status_file=None,
+        config_cache_file=None,
+        **kwargs
+    ):
         super(Runner, self).__init__("runner", **kwargs)
         self.config_directories = config_directories
         self.available_collect_point_engines, self.available_source_engines, self.available_backup_point_engines, self.available_filter_engines, self.available_hook_engines = self.find_available_engines(
@@ -64,76 +150,49 @@ class Runner(ParameterizedObject):
         )
         self.collect_points = {}
         self.backup_points = {}
+        self.associations = None  # computed on demand by get_associations()
         self.global_config_parameters = {}
         self.collect_point_config_files = []
         self.backup_point_config_files = []
         self.hooks = []
         self.log_file = log_file
+        self.status_file = status_file  # updated after each backup (if not None)
+        self.config_cache = None
+        if config_cache_file:
+            self.config_cache = ConfigCache(config_cache_file)
         self.output_temp_fd = None
         if self.log_file:
             self.output_temp_fd = open(self.log_file, "wb")
 
     @staticmethod
+    @lru_cache()
     def find_available_engines(engines_file=None):
-        available_collect_point_engines = {}
-        available_backup_point_engines = {}
-        available_source_engines = {}
-        available_filter_engines = {}
-        available_hook_engines = {}
-        if iter_entry_points:
-
-            def import_points(name):
-                result = {}
-                for x in iter_entry_points(name):
-                    # noinspection PyBroadException
-                    try:
-                        result[x.name.lower()] = x.load()
-                    except:
-                        pass
-                return result
-
-            available_collect_point_engines.update(
-                import_points("polyarchiv.collect_points")
-            )
-            available_backup_point_engines.update(
-                import_points("polyarchiv.backup_points")
-            )
-            available_source_engines.update(import_points("polyarchiv.sources"))
-            available_filter_engines.update(import_points("polyarchiv.filters"))
-            available_hook_engines.update(import_points("polyarchiv.hooks"))
+        """Return the registries of collect point, source, backup point, filter and hook
+        engines, declared as entry points or in `engines_file`.
+        No engine module is imported before its first use."""
+        groups = ["collect_points", "sources", "backup_points", "filters", "hooks"]
+        registries = [EngineRegistry() for __ in groups]
+        for group, registry in zip(groups, registries):
+            for x in iter_entry_points("polyarchiv.%s" % group):
+                registry.register(x.name, x.load, ignore_errors=True)
         if engines_file is not None:
             parser = RawConfigParser()
             parser.read([engines_file])
-
-            def import_items(name):
-                return (
-                    {
-                        key.lower(): import_string(value)
-                        for key, value in parser.items(name)
-                    }
-                    if parser.has_section(name)
-                    else {}
-                )
-
-            available_source_engines.update(import_items("sources"))
-            available_backup_point_engines.update(import_items("backup_points"))
-            available_collect_point_engines.update(import_items("collect_points"))
-            available_filter_engines.update(import_items("filters"))
-            available_hook_engines.update(import_items("hooks"))
-        return (
-            available_collect_point_engines,
-            available_source_engines,
-            available_backup_point_engines,
-            available_filter_engines,
-            available_hook_engines,
-        )
+            for group, registry in zip(groups, registries):
+                if not parser.has_section(group):
+                    continue
+                for key, value in parser.items(group):
+                    registry.register(key, functools.partial(import_string, value))
+        return tuple(registries)
 
     def load(self, show_errors=True):
         result = True
         self._load_global_config()
+        self.associations = None
         try:
             self._find_collect_points()
             self._find_backup_points()
+            self.get_associations()
         except ValueError as e:
             result = False
             if show_errors:
@@ -142,6 +201,10 @@ class Runner(ParameterizedObject):
             result = False
             if show_errors:
                 self.print_error(text_type(e))
+        # internal file: written without confirmation, except in dry mode
+        if self.config_cache is not None and self.command_execute:
+            if not self.config_cache.save():
+                self.print_info("unable to write %s" % self.config_cache.path)
         return result
 
     def _get_args_from_parser(self, config_file, parser, section, engine_cls):
@@ -203,9 +266,8 @@ class Runner(ParameterizedObject):
             raise ValueError(msg)
         engine = parser.get(section, self.engine_option)
         engine_alias = engine.lower()
-        if engine_alias in available_engines:
-            engine_cls = available_engines[engine_alias]
-        else:
+        engine_cls = available_engines.get(engine_alias)
+        if engine_cls is None:
             try:
                 engine_cls = import_string(engine)
             except ImportError:
@@ -234,11 +296,8 @@ class Runner(ParameterizedObject):
             file_list.sort()
             for config_file in file_list:
                 count += 1
-                parser = RawConfigParser()
                 try:
-                    # noinspection PyTypeChecker
-                    open(config_file, "rb").read(1)
-                    parser.read([config_file])
+                    parser = self._get_config_parser(config_file)
                 except IOError as e:
                     if e.errno == errno.EACCES:
                         username = pwd.getpwuid(os.getuid())[0]
@@ -257,6 +316,15 @@ class Runner(ParameterizedObject):
             if count == 0:
                 self.print_info("No %s file found in %s" % (pattern, path))
 
+    def _get_config_parser(self, config_file):
+        if self.config_cache is not None:
+            return self.config_cache.get_parser(config_file)
+        parser = RawConfigParser()
+        # noinspection PyTypeChecker
+        open(config_file, "rb").read(1)
+        parser.read([config_file])
+        return parser
+
     @staticmethod
     def _decompose_section_name(config_file, section_name, prefix):
         if not section_name.startswith(prefix):
@@ -269,6 +337,8 @@ class Runner(ParameterizedObject):
         return values[0]
 
     def _load_global_config(self):
+        from polyarchiv.hooks import Hook
+
         global_result = {}
         self.variables.update(base_variables())
         for config_file, parser in self._iter_config_parsers(self.global_pattern):
@@ -300,6 +370,11 @@ class Runner(ParameterizedObject):
         self.config = Config(**global_result)
 
     def _find_collect_points(self):
+        from polyarchiv.collect_points import CollectPoint
+        from polyarchiv.filters import FileFilter
+        from polyarchiv.hooks import Hook
+        from polyarchiv.sources import Source
+
         base_variable = base_variables(use_constants=False)
         for config_file, parser in self._iter_config_parsers(self.collect_pattern):
             # noinspection PyTypeChecker
@@ -380,6 +455,10 @@ class Runner(ParameterizedObject):
             self.collect_points[collect_point_name] = collect_point
 
     def _find_backup_points(self):
+        from polyarchiv.backup_points import BackupPoint
+        from polyarchiv.filters import FileFilter
+        from polyarchiv.hooks import Hook
+
         for config_file, parser in self._iter_config_parsers(self.backup_pattern):
             # noinspection PyTypeChecker
             backup_point_name = os.path.basename(config_file).rpartition(".")[0]
@@ -460,28 +539,25 @@ class Runner(ParameterizedObject):
     @staticmethod
     def can_associate(collect_point, backup_point):
         """Return True if the backup point can be associated to the collect point
+        (prefer :meth:`get_associations` for the loaded points)
         :param collect_point:
         :param backup_point:
         """
+        from polyarchiv.backup_points import BackupPoint
+        from polyarchiv.collect_points import CollectPoint
+
         assert isinstance(collect_point, CollectPoint)
         assert isinstance(backup_point, BackupPoint)
-        for collect_point_tag in collect_point.collect_point_tags:
-            for backup_point_pattern in backup_point.excluded_collect_point_tags:
-                if fnmatch.fnmatch(collect_point_tag, backup_point_pattern):
-                    return False
-        for backup_point_tag in backup_point.backup_point_tags:
-            for collect_point_pattern in collect_point.excluded_backup_point_tags:
-                if fnmatch.fnmatch(backup_point_tag, collect_point_pattern):
-                    return False
-        for collect_point_tag in collect_point.collect_point_tags:
-            for backup_point_pattern in backup_point.included_collect_point_tags:
-                if fnmatch.fnmatch(collect_point_tag, backup_point_pattern):
-                    return True
-        for backup_point_tag in backup_point.backup_point_tags:
-            for collect_point_pattern in collect_point.included_backup_point_tags:
-                if fnmatch.fnmatch(backup_point_tag, collect_point_pattern):
-                    return True
-        return False
+        return can_associate(collect_point, backup_point)
+
+    def get_associations(self):
+        """Return the :class:`polyarchiv.associations.AssociationIndex` of the loaded
+        collect points and backup points, computed once"""
+        if self.associations is None:
+            self.associations = AssociationIndex(
+                list(self.collect_points.values()), list(self.backup_points.values())
+            )
+        return self.associations
 
     def visit(self, visitor=None, only_collect_points=None, only_backup_points=None):
         """ Apply the given commands to the available collect/backup points.
@@ -493,6 +569,9 @@ class Runner(ParameterizedObject):
         :return:
         :rtype:
         """
+        from polyarchiv.backup_points import BackupPoint
+        from polyarchiv.collect_points import CollectPoint
+
         visitor.visit_runner(self)
         collect_points = [
             collect_point
@@ -504,15 +583,14 @@ class Runner(ParameterizedObject):
             for backup_point_name, backup_point in self.backup_points.items()
             if not only_backup_points or backup_point_name in only_backup_points
         ]
+        associations = self.get_associations()
         visitor.visit_backup_points(self, backup_points)
         for backup_point in backup_points:
             assert isinstance(backup_point, BackupPoint)
             visitor.visit_backup_point(self, backup_point)
-            filtered_collect_points = [
-                collect_point
-                for collect_point in collect_points
-                if self.can_associate(collect_point, backup_point)
-            ]
+            filtered_collect_points = associations.filter_collect_points(
+                collect_points, backup_point
+            )
             visitor.visit_backup_point_collect_points(
                 self, backup_point, filtered_collect_points
             )
@@ -520,11 +598,9 @@ class Runner(ParameterizedObject):
         for collect_point in collect_points:
             assert isinstance(collect_point, CollectPoint)
             visitor.visit_collect_point(self, collect_point)
-            filtered_backup_points = [
-                backup_point
-                for backup_point in backup_points
-                if self.can_associate(collect_point, backup_point)
-            ]
+            filtered_backup_points = associations.filter_backup_points(
+                backup_points, collect_point
+            )
             visitor.visit_backup_points_collect_point(
                 self, filtered_backup_points, collect_point
             )
@@ -554,76 +630,131 @@ class Runner(ParameterizedObject):
         :param skip_backup: do not execute the backup point phase
         :return:
         """
+        from polyarchiv.backup_points import BackupPoint, PENDING_BACKUP
+        from polyarchiv.collect_points import CollectPoint
+
         with FileContentMonitor(self.output_temp_fd) as global_cm:
             self.execute_hook("before_backup", global_cm, {}, {})
             collect_point_results = {}
             backup_point_results = {}
-            for collect_point_name, collect_point in self.collect_points.items():
-                if (
-                    only_collect_points
-                    and collect_point_name not in only_collect_points
-                ):
-                    continue
-                assert isinstance(collect_point, CollectPoint)
-                if not skip_collect:
-                    with FileContentMonitor(collect_point.output_temp_fd) as cm:
-                        collect_point.execute_hook("before_backup", cm)
-                        # HOOK before_backup(collect_point, when, cm, collect_point_results, backup_point_results)
-                        result = collect_point.backup(force=force)
+            associations = self.get_associations()
+            batch_backup_points = []
+            for backup_point_name, backup_point in self.backup_points.items():
+                if not only_backup_points or backup_point_name in only_backup_points:
+                    # info are uploaded at once, after all collect points
+                    backup_point.begin_metadata_batch()
+                    batch_backup_points.append(backup_point)
+            try:
+                self.prefetch_metadata(only_collect_points, only_backup_points)
+                for collect_point_name, collect_point in self.collect_points.items():
+                    if (
+                        only_collect_points
+                        and collect_point_name not in only_collect_points
+                    ):
+                        continue
+                    assert isinstance(collect_point, CollectPoint)
+                    if not skip_collect:
+                        with FileContentMonitor(collect_point.output_temp_fd) as cm:
+                            collect_point.execute_hook("before_backup", cm)
+                            # HOOK before_backup(collect_point, when, cm, collect_point_results, backup_point_results)
+                            result = collect_point.backup(force=force)
+                            if result:
+                                collect_point.print_success(
+                                    "[OK] collect point %s" % collect_point.name
+                                )
+                            else:
+                                collect_point.print_error(
+                                    "[KO] collect point %s" % collect_point.name
+                                )
+                        collect_point_results[collect_point.name] = result
                         if result:
-                            collect_point.print_success(
-                                "[OK] collect point %s" % collect_point.name
+                            collect_point.execute_hook(
+                                "backup_success", cm, result=result
                             )
                         else:
-                            collect_point.print_error(
-                                "[KO] collect point %s" % collect_point.name
+                            collect_point.execute_hook(
+                                "backup_error", cm, result=result
                             )
-                    collect_point_results[collect_point.name] = result
-                    if result:
-                        collect_point.execute_hook("backup_success", cm, result=result)
-                    else:
-                        collect_point.execute_hook("backup_error", cm, result=result)
-                        continue
-                    collect_point.execute_hook("after_backup", cm, result=result)
-                    cm.copy_content(self.output_temp_fd, close=True)
+                            continue
+                        collect_point.execute_hook("after_backup", cm, result=result)
+                        cm.copy_content(self.output_temp_fd, close=True)
+                    for backup_point_name, backup_point in self.backup_points.items():
+                        if (
+                            only_backup_points
+                            and backup_point_name not in only_backup_points
+                            and not skip_backup
+                        ):
+                            continue
+                        assert isinstance(backup_point, BackupPoint)
+                        if not associations.can_associate(collect_point, backup_point):
+                            continue
+                        with FileContentMonitor(backup_point.output_temp_fd) as cm:
+                            backup_point.execute_hook(
+                                "before_backup", cm, collect_point
+                            )
+                            result = backup_point.backup(collect_point, force=force)
+                            if result == PENDING_BACKUP:
+                                backup_point.print_info(
+                                    "[..] backup point %s on collect point %s is delayed"
+                                    % (backup_point.name, collect_point.name)
+                                )
+                            elif result:
+                                backup_point.print_info(
+                                    "[OK] backup point %s on collect point %s"
+                                    % (backup_point.name, collect_point.name)
+                                )
+                            else:
+                                backup_point.print_error(
+                                    "[KO] backup point %s on collect point %s"
+                                    % (backup_point.name, collect_point.name)
+                                )
+                        if result != PENDING_BACKUP:
+                            # delayed backups are registered by flush_backups
+                            self.register_backup_point_result(
+                                backup_point,
+                                collect_point,
+                                result,
+                                cm,
+                                backup_point_results,
+                            )
+                        cm.copy_content(self.output_temp_fd, close=False)
                 for backup_point_name, backup_point in self.backup_points.items():
                     if (
                         only_backup_points
                         and backup_point_name not in only_backup_points
-                        and not skip_backup
                     ):
                         continue
                     assert isinstance(backup_point, BackupPoint)
-                    if not self.can_associate(collect_point, backup_point):
-                        continue
+                    # some backup points delay their work to process all collect points
                     with FileContentMonitor(backup_point.output_temp_fd) as cm:
-                        backup_point.execute_hook("before_backup", cm, collect_point)
-                        result = backup_point.backup(collect_point, force=force)
-                        if result:
-                            backup_point.print_info(
-                                "[OK] backup point %s on collect point %s"
-                                % (backup_point.name, collect_point.name)
-                            )
-                        else:
-                            backup_point.print_error(
-                                "[KO] backup point %s on collect point %s"
-                                % (backup_point.name, collect_point.name)
-                            )
-                    backup_point_results[
-                        (backup_point.name, collect_point.name)
-                    ] = result
-                    if result:
-                        backup_point.execute_hook(
-                            "backup_success", cm, collect_point, result=result
-                        )
-                    else:
-                        backup_point.execute_hook(
-                            "backup_error", cm, collect_point, result=result
+                        results = backup_point.flush_backups()
+                        for collect_point_name, result in results.items():
+                            if result:
+                                backup_point.print_info(
+                                    "[OK] backup point %s on collect point %s"
+                                    % (backup_point.name, collect_point_name)
+                                )
+                            else:
+                                backup_point.print_error(
+                                    "[KO] backup point %s on collect point %s"
+                                    % (backup_point.name, collect_point_name)
+                                )
+                    for collect_point_name, result in results.items():
+                        self.register_backup_point_result(
+                            backup_point,
+                            self.collect_points[collect_point_name],
+                            result,
+                            cm,
+                            backup_point_results,
                         )
-                    backup_point.execute_hook(
-                        "after_backup", cm, collect_point, result=result
-                    )
                     cm.copy_content(self.output_temp_fd, close=False)
+            finally:
+                # pending info must be sent even if a backup point has failed
+                for backup_point in batch_backup_points:
+                    with FileContentMonitor(backup_point.output_temp_fd) as cm:
+                        backup_point.flush_metadata()
+                    cm.copy_content(self.output_temp_fd, close=False)
+        self.update_status_index(collect_point_results, backup_point_results)
         self.execute_hook(
             "after_backup", global_cm, collect_point_results, backup_point_results
         )
@@ -637,12 +768,121 @@ class Runner(ParameterizedObject):
             )
         return collect_point_results, backup_point_results
 
+    @staticmethod
+    def register_backup_point_result(
+        backup_point, collect_point, result, cm, backup_point_results
+    ):
+        """store the result of a backup point and execute the corresponding hooks
+        :param cm: :class:`FileContentMonitor` of the backup output
+        """
+        backup_point_results[(backup_point.name, collect_point.name)] = result
+        if result:
+            backup_point.execute_hook("backup_success", cm, collect_point, result=result)
+        else:
+            backup_point.execute_hook("backup_error", cm, collect_point, result=result)
+        backup_point.execute_hook("after_backup", cm, collect_point, result=result)
+
+    def update_status_index(self, collect_point_results, backup_point_results):
+        """Write the state of the points processed by a backup to the status index.
+        Points that are no longer configured are removed, and configured points that
+        are missing from the index are added."""
+        # internal file: written without confirmation, except in dry mode
+        if self.status_file is None or not self.command_execute:
+            return
+        index = StatusIndex(self.status_file)
+        try:
+            indexed_names = set(index.load())
+            names, points = set(), []
+            for collect_point in self.collect_points.values():
+                name = collect_point.name
+                names.add(name)
+                if name in collect_point_results or name not in indexed_names:
+                    points.append(
+                        (
+                            name,
+                            collect_point.get_info(),
+                            collect_point.check_out_of_date_backup,
+                        )
+                    )
+            for collect_point_name, backup_point_name in sorted(
+                self.get_associations().pairs
+            ):
+                collect_point = self.collect_points[collect_point_name]
+                backup_point = self.backup_points[backup_point_name]
+                name = "%s:%s" % (collect_point_name, backup_point_name)
+                names.add(name)
+                result_key = (backup_point_name, collect_point_name)
+                if result_key in backup_point_results or name not in indexed_names:
+                    points.append(
+                        (
+                            name,
+                            backup_point.get_info(collect_point),
+                            collect_point.check_out_of_date_backup,
+                        )
+                    )
+            index.update(points, names=names)
+        except Exception as e:
+            self.print_error(
+                "unable to update %s: %s" % (self.status_file, text_type(e))
+            )
+
+    def prefetch_metadata(self, only_collect_points=None, only_backup_points=None):
+        """Let each backup point fetch the info of all its collect points at once"""
+        from polyarchiv.backup_points import BackupPoint
+
+        collect_points = [
+            collect_point
+            for collect_point_name, collect_point in self.collect_points.items()
+            if not only_collect_points or collect_point_name in only_collect_points
+        ]
+        associations = self.get_associations()
+        for backup_point_name, backup_point in self.backup_points.items():
+            assert isinstance(backup_point, BackupPoint)
+            if only_backup_points and backup_point_name not in only_backup_points:
+                continue
+            backup_point.prefetch_metadata(
+                associations.filter_collect_points(collect_points, backup_point)
+            )
+
     def execute_hook(self, when, cm, collect_point_results, backup_point_results):
+        from polyarchiv.hooks import Hook
+
         for hook in self.hooks:
             assert isinstance(hook, Hook)
             if when in hook.hooked_events:
                 hook.call(when, cm, collect_point_results, backup_point_results)
 
+    def watch(self, only_collect_points=None, timeout=None):
+        """Record the files modified in the `LocalFiles` sources with `use_journal = true`
+
+        :param only_collect_points: limit to the selected collect points
+        :type only_collect_points: :class:`list` of `str`
+        :param timeout: stop after `timeout` seconds without any modification
+        :return: False if there is no source to watch
+        """
+        from polyarchiv.collect_points import CollectPoint
+        from polyarchiv.journal import InotifyWatcher, watch
+        from polyarchiv.sources import LocalFiles
+
+        watchers = []
+        for collect_point_name, collect_point in self.collect_points.items():
+            assert isinstance(collect_point, CollectPoint)
+            if only_collect_points and collect_point_name not in only_collect_points:
+                continue
+            for source in collect_point.sources:
+                if not isinstance(source, LocalFiles) or not source.use_journal:
+                    continue
+                self.print_info(
+                    "watching %s (collect point %s)"
+                    % (source.source_path, collect_point_name)
+                )
+                watchers.append(InotifyWatcher(source.source_path, source.journal))
+        if not watchers:
+            self.print_error("no source to watch (use_journal is not set)")
+            return False
+        watch(watchers, timeout=timeout)
+        return True
+
     def restore(
         self, only_collect_points=None, only_backup_points=None, no_backup_point=False
     ):
@@ -655,6 +895,12 @@ class Runner(ParameterizedObject):
         :type only_backup_points: :class:`list` of `str`
         :return:
         """
+        from polyarchiv.backup_points import BackupPoint
+        from polyarchiv.collect_points import CollectPoint
+
+        associations = self.get_associations()
+        if not no_backup_point:
+            self.prefetch_metadata(only_collect_points, only_backup_points)
         for collect_point_name, collect_point in self.collect_points.items():
             assert isinstance(collect_point, CollectPoint)
             if only_collect_points and collect_point_name not in only_collect_points:
@@ -669,7 +915,7 @@ class Runner(ParameterizedObject):
                         and backup_point_name not in only_backup_points
                     ):
                         continue
-                    elif not self.can_associate(collect_point, backup_point):
+                    elif not associations.can_associate(collect_point, backup_point):
                         continue
                     backup_point_info = backup_point.get_info(collect_point)
                     assert isinstance(backup_point_info, PointInfo)
@@ -0,0 +1,235 @@
+# -*- coding=utf-8 -*-
+"""Filesystem snapshots, used to backup a frozen copy of a directory.
+
+  * btrfs (the directory must belong to a btrfs subvolume)
+  * ZFS
+  * LVM (the directory must belong to a mounted logical volume)
+  * fake (plain copy in a temporary directory, only intended for tests)
+
+"""
+from __future__ import unicode_literals
+
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+
+__author__ = "Matthieu Gallet"
+
+BTRFS_SUBVOLUME_INODE = 256
+
+
+class Snapshot(object):
+    """Base snapshot class: `create` returns the path of the frozen copy of `source_path`
+    and `release` removes this copy.
+
+    `release` only undoes what has been done, so it can be called after a failed
+    `create` and called several times. `create` removes a stale snapshot with the same
+    name (left by an interrupted run).
+
+    :param source_path: absolute path of the directory to freeze
+    :param point: :class:`polyarchiv.points.ParameterizedObject` used to run commands
+    :param name: name of the snapshot (must be unique for a given source path)
+    :param size: size of the snapshot (only used by LVM)
+    """
+
+    def __init__(self, source_path, point, name="polyarchiv", size=None):
+        self.source_path = os.path.abspath(source_path)
+        self.point = point
+        self.name = re.sub(r"[^\w.-]", "_", name)
+        self.size = size
+        self.snapshot_path = None  # path of the frozen copy of `source_path`
+
+    def create(self):
+        """Create the snapshot and return the path of the frozen copy of `source_path`.
+        Return `source_path` when commands are not executed (dry mode)."""
+        raise NotImplementedError
+
+    def release(self):
+        """Remove the snapshot (or what has been created by a failed `create`)"""
+        raise NotImplementedError
+
+    def get_output(self, cmd):
+        """run the command and return its stdout (or None in dry mode)"""
+        __, stdout, __ = self.point.execute_command(cmd, stdout=subprocess.PIPE)
+        if stdout is None:
+            return None
+        return stdout.decode("utf-8")
+
+    def __enter__(self):
+        return self.create()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.release()
+
+
+class BtrfsSnapshot(Snapshot):
+    """Read-only snapshot of the btrfs subvolume containing `source_path`,
+    created at the root of this subvolume."""
+
+    def __init__(self, *args, **kwargs):
+        super(BtrfsSnapshot, self).__init__(*args, **kwargs)
+        self.subvolume_path = None
+
+    def create(self):
+        subvolume_path = self.source_path
+        while os.stat(subvolume_path).st_ino != BTRFS_SUBVOLUME_INODE:
+            parent = os.path.dirname(subvolume_path)
+            if parent == subvolume_path:
+                raise ValueError("%s is not in a btrfs subvolume" % self.source_path)
+            subvolume_path = parent
+        snapshot_root = os.path.join(subvolume_path, ".%s" % self.name)
+        cmd = ["btrfs", "subvolume", "snapshot", "-r", subvolume_path, snapshot_root]
+        if not self.point.can_execute_command(cmd):
+            return self.source_path
+        if os.path.exists(snapshot_root):
+            self.point.execute_command(["btrfs", "subvolume", "delete", snapshot_root])
+        self.point.execute_command(cmd)
+        self.subvolume_path = snapshot_root
+        relpath = os.path.relpath(self.source_path, subvolume_path)
+        self.snapshot_path = os.path.normpath(os.path.join(snapshot_root, relpath))
+        return self.snapshot_path
+
+    def release(self):
+        if self.subvolume_path is None:
+            return
+        self.point.execute_command(
+            ["btrfs", "subvolume", "delete", self.subvolume_path]
+        )
+        self.subvolume_path = None
+
+
+class ZfsSnapshot(Snapshot):
+    """Snapshot of the ZFS dataset containing `source_path`,
+    read through the hidden `.zfs/snapshot` directory of the dataset."""
+
+    def __init__(self, *args, **kwargs):
+        super(ZfsSnapshot, self).__init__(*args, **kwargs)
+        self.snapshot_name = None
+
+    def create(self):
+        output = self.get_output(
+            ["zfs", "list", "-H", "-o", "name,mountpoint", self.source_path]
+        )
+        if output is None:
+            return self.source_path
+        dataset, __, mountpoint = output.strip().partition("\t")
+        snapshot_name = "%s@%s" % (dataset, self.name)
+        returncode, __, __ = self.point.execute_command(
+            ["zfs", "list", "-H", "-t", "snapshot", snapshot_name],
+            ignore_errors=True,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.PIPE,
+        )
+        if returncode == 0:
+            self.point.execute_command(["zfs", "destroy", snapshot_name])
+        self.point.execute_command(["zfs", "snapshot", snapshot_name])
+        self.snapshot_name = snapshot_name
+        relpath = os.path.relpath(self.source_path, mountpoint)
+        self.snapshot_path = os.path.normpath(
+            os.path.join(mountpoint, ".zfs", "snapshot", self.name, relpath)
+        )
+        return self.snapshot_path
+
+    def release(self):
+        if self.snapshot_name is None:
+            return
+        self.point.execute_command(["zfs", "destroy", self.snapshot_name])
+        self.snapshot_name = None
+
+
+class LvmSnapshot(Snapshot):
+    """Snapshot of the logical volume mounted on the filesystem containing `source_path`,
+    mounted read-only in a temporary directory."""
+
+    def __init__(self, *args, **kwargs):
+        super(LvmSnapshot, self).__init__(*args, **kwargs)
+        self.snapshot_device = None
+        self.mount_path = None
+        self.mounted = False
+
+    def create(self):
+        output = self.get_output(
+            [
+                "findmnt",
+                "-n",
+                "-o",
+                "SOURCE,TARGET,FSTYPE",
+                "--target",
+                self.source_path,
+            ]
+        )
+        if output is None:
+            return self.source_path
+        device, mountpoint, fstype = output.split()
+        volume_group = self.get_output(
+            ["lvs", "--noheadings", "-o", "vg_name", device]
+        ).strip()
+        snapshot_device = "/dev/%s/%s" % (volume_group, self.name)
+        if os.path.exists(snapshot_device):
+            self.point.execute_command(["umount", snapshot_device], ignore_errors=True)
+            self.point.execute_command(["lvremove", "-f", snapshot_device])
+        self.point.execute_command(
+            [
+                "lvcreate",
+                "--snapshot",
+                "--size",
+                self.size or "1G",
+                "--name",
+                self.name,
+                device,
+            ]
+        )
+        self.snapshot_device = snapshot_device
+        self.mount_path = tempfile.mkdtemp(prefix="polyarchiv-snapshot")
+        options = "ro,nouuid" if fstype == "xfs" else "ro"
+        self.point.execute_command(
+            ["mount", "-o", options, self.snapshot_device, self.mount_path]
+        )
+        self.mounted = True
+        relpath = os.path.relpath(self.source_path, mountpoint)
+        self.snapshot_path = os.path.normpath(os.path.join(self.mount_path, relpath))
+        return self.snapshot_path
+
+    def release(self):
+        if self.mounted:
+            self.point.execute_command(["umount", self.mount_path])
+            self.mounted = False
+        if self.mount_path is not None:
+            os.rmdir(self.mount_path)
+            self.mount_path = None
+        if self.snapshot_device is not None:
+            self.point.execute_command(["lvremove", "-f", self.snapshot_device])
+            self.snapshot_device = None
+
+
+class FakeSnapshot(Snapshot):
+    """Copy `source_path` to a temporary directory. Only intended for tests."""
+
+    def create(self):
+        snapshot_path = os.path.join(
+            tempfile.mkdtemp(prefix="polyarchiv-snapshot"), self.name
+        )
+        if not self.point.can_execute_command(
+            ["cp", "-pPR", self.source_path, snapshot_path]
+        ):
+            os.rmdir(os.path.dirname(snapshot_path))
+            return self.source_path
+        self.snapshot_path = snapshot_path  # removed by release, even if the copy fails
+        shutil.copytree(self.source_path, snapshot_path, symlinks=True)
+        return self.snapshot_path
+
+    def release(self):
+        if self.snapshot_path is None:
+            return
+        shutil.rmtree(os.path.dirname(self.snapshot_path))
+        self.snapshot_path = None
+
+
+snapshot_providers = {
+    "btrfs": BtrfsSnapshot,
+    "zfs": ZfsSnapshot,
+    "lvm": LvmSnapshot,
+    "fake": FakeSnapshot,
+}
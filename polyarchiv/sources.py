@@ -9,12 +9,21 @@
 """
 from __future__ import unicode_literals
 
+import bz2
+import datetime
+import fnmatch
+import glob
 import grp
+import gzip
+import hashlib
 import io
 import os
 import pwd
 import re
 import subprocess
+import tempfile
+import threading
+from multiprocessing.pool import ThreadPool
 
 # noinspection PyProtectedMember
 from polyarchiv._vendor.ldif3 import LDIFParser
@@ -27,11 +36,43 @@ from polyarchiv.conf import (
     check_executable,
     check_username,
     check_file,
+    CheckOption,
+    strip_split,
 )
-from polyarchiv.points import ParameterizedObject
+from polyarchiv.filesync import FileSync, read_patterns, SYNC_THREADS
+from polyarchiv.journal import ChangeJournal
+from polyarchiv.points import ParameterizedObject, PointInfo
+from polyarchiv.snapshots import snapshot_providers
+from polyarchiv.utils import (
+    cached_property,
+    get_is_time_elapsed,
+    text_type,
+    smart_quote,
+    COPY_CHUNK_SIZE,
+)
+
+try:
+    import lzma
+except ImportError:
+    lzma = None
+
+try:
+    # noinspection PyCompatibility
+    from urllib.parse import urlparse
+except ImportError:
+    # noinspection PyCompatibility,PyUnresolvedReferences
+    from urlparse import urlparse
 
 __author__ = "Matthieu Gallet"
 
+REMOTE_FILES_CONCURRENCY = 4
+# LDIF_COMPRESSIONS[compression] = (suffix, Python opener, equivalent command)
+LDIF_COMPRESSIONS = {
+    "gzip": (".gz", gzip.open, "gzip"),
+    "bz2": (".bz2", bz2.BZ2File, "bzip2"),
+    "xz": (".xz", lzma.open if lzma is not None else None, "xz"),
+}
+
 
 class Source(ParameterizedObject):
     """base source class"""
@@ -42,6 +83,8 @@ class Source(ParameterizedObject):
         super(Source, self).__init__(name, **kwargs)
         assert isinstance(collect_point, CollectPoint)
         self.collect_point = collect_point
+        self.info_data = {}
+        # data kept between two runs, stored in the info of the collect point
 
     def backup(self):
         """Backup data corresponding to this source"""
@@ -64,8 +107,8 @@ class Source(ParameterizedObject):
 
 
 class LocalFiles(Source):
-    """copy all files from the given source_path to the collect point using 'rsync'.
-    The destination is a folder inside the collect point.
+    """copy all files from the given source_path to the collect point using 'rsync'
+    (or an equivalent Python implementation). The destination is a folder inside the collect point.
     """
 
     parameters = Source.parameters + [
@@ -97,6 +140,42 @@ class LocalFiles(Source):
             converter=bool_setting,
             help_str="true|false: preserve hard links",
         ),
+        Parameter(
+            "snapshot",
+            converter=CheckOption(sorted(snapshot_providers)),
+            help_str="copy files from a temporary snapshot of source_path: %s "
+            '(default: no snapshot, "fake" is only intended for tests)'
+            % "|".join(sorted(snapshot_providers)),
+        ),
+        Parameter(
+            "snapshot_size",
+            help_str='size of the LVM snapshot (default: "1G")',
+        ),
+        Parameter(
+            "use_journal",
+            converter=bool_setting,
+            help_str="true|false: only copy files modified since the last backup, "
+            'as recorded by "polyarchiv watch" (default: false)',
+        ),
+        Parameter(
+            "full_scan_interval",
+            converter=get_is_time_elapsed,
+            help_str="when use_journal is true, frequency of full scans of source_path "
+            '(same format as the frequency option, default: "weekly")',
+        ),
+        Parameter(
+            "engine",
+            converter=CheckOption(["rsync", "native"]),
+            help_str="rsync|native: copy files with rsync or with parallel Python "
+            "threads, that also write the list of copied files to the metadata folder "
+            '(use_journal is only available with rsync, default: "rsync")',
+        ),
+        Parameter(
+            "threads",
+            converter=int,
+            help_str="number of threads used by the native engine (default: %d)"
+            % SYNC_THREADS,
+        ),
     ]
 
     def __init__(
@@ -108,6 +187,12 @@ class LocalFiles(Source):
         exclude="",
         include="",
         preserve_hard_links="",
+        snapshot=None,
+        snapshot_size=None,
+        use_journal=False,
+        full_scan_interval=None,
+        engine="rsync",
+        threads=SYNC_THREADS,
         **kwargs
     ):
         """
@@ -119,6 +204,13 @@ class LocalFiles(Source):
         :param include: don't exclude files matching PATTERN. If PATTERN starts with '@', it must be the absolute path
             of a file (cf. the --include-from option from rsync)
         :param preserve_hard_links: preserve hard links
+        :param snapshot: name of a snapshot provider (see :mod:`polyarchiv.snapshots`)
+        :param snapshot_size: size of the snapshot (only used by LVM)
+        :param use_journal: only copy the files recorded in the change journal
+        :param full_scan_interval: `(current_time, previous_time)` function returning
+            True when a full scan of `source_path` is required
+        :param engine: "rsync" or "native" (see :class:`polyarchiv.filesync.FileSync`)
+        :param threads: number of threads used by the native engine
         """
         super(LocalFiles, self).__init__(name, collect_point, **kwargs)
         self.source_path = source_path
@@ -131,6 +223,42 @@ class LocalFiles(Source):
             "on",
             "1",
         )
+        self.snapshot = snapshot
+        self.snapshot_size = snapshot_size
+        self.use_journal = use_journal
+        self.full_scan_interval = full_scan_interval or get_is_time_elapsed("weekly")
+        self.engine = engine
+        self.threads = threads
+
+    @cached_property
+    def journal(self):
+        """journal of the files modified in `source_path`, filled by `polyarchiv watch`"""
+        path = os.path.join(self.collect_point.metadata_path, "journal-%s" % self.name)
+        return ChangeJournal(path)
+
+    @property
+    def manifest_path(self):
+        """list of the files copied by the native engine"""
+        return os.path.join(
+            self.collect_point.metadata_path, "manifest-%s.jsonl" % self.name
+        )
+
+    def sync(
+        self, cmd, source, destination, exclude=None, include=None, manifest=False
+    ):
+        """run the rsync command, or the native engine with the same options"""
+        if self.engine != "native":
+            self.execute_command(cmd)
+        elif self.can_execute_command(cmd):
+            FileSync(
+                source,
+                destination,
+                exclude=read_patterns(exclude),
+                include=read_patterns(include),
+                preserve_hard_links=self.preserve_hard_links,
+                threads=self.threads,
+                manifest_path=self.manifest_path if manifest else None,
+            ).run()
 
     def backup(self):
         cmd = [self.config.rsync_executable, "-a", "--delete", "-S"]
@@ -150,13 +278,66 @@ class LocalFiles(Source):
             self.collect_point.import_data_path, self.destination_path
         )
         self.ensure_dir(dirname)
+        journal = None
+        full_scan = True
+        if (
+            self.use_journal
+            and self.engine == "rsync"
+            and self.can_execute_command("# read the change journal")
+        ):
+            journal = self.journal
+            if not journal.take():
+                self.print_info("the change journal is incomplete: full scan required")
+            elif self.full_scan_interval(
+                current_time=datetime.datetime.now(),
+                previous_time=journal.last_full_scan,
+            ):
+                self.print_info("periodic full scan of %s" % self.source_path)
+            elif not journal.has_pending_changes():
+                self.print_success("no modified file in %s" % self.source_path)
+                journal.commit()
+                return
+            else:
+                full_scan = False
+                cmd.remove("--delete")
+                # --force: removed folders are not empty in the collect point
+                cmd += [
+                    "--files-from",
+                    journal.pending_path,
+                    "--from0",
+                    "--delete-missing-args",
+                    "--force",
+                ]
+        snapshot = None
         source = self.source_path
-        if not source.endswith(os.path.sep):
-            source += os.path.sep
-        if not dirname.endswith(os.path.sep):
-            dirname += os.path.sep
-        cmd += [source, dirname]
-        self.execute_command(cmd)
+        if self.snapshot:
+            snapshot = snapshot_providers[self.snapshot](
+                self.source_path,
+                self,
+                name="polyarchiv-%s-%s" % (self.collect_point.name, self.name),
+                size=self.snapshot_size,
+            )
+        try:
+            if snapshot is not None:
+                source = snapshot.create()
+            if not source.endswith(os.path.sep):
+                source += os.path.sep
+            if not dirname.endswith(os.path.sep):
+                dirname += os.path.sep
+            cmd += [source, dirname]
+            self.sync(
+                cmd,
+                source,
+                dirname,
+                exclude=self.exclude,
+                include=self.include,
+                manifest=True,
+            )
+        finally:
+            if snapshot is not None:
+                snapshot.release()
+        if journal is not None:
+            journal.commit(full_scan=full_scan)
 
     def restore(self):
         cmd = [self.config.rsync_executable, "-a", "--delete", "-S"]
@@ -173,7 +354,7 @@ class LocalFiles(Source):
         if not dirname.endswith(os.path.sep):
             dirname += os.path.sep
         cmd += [dirname, source]
-        self.execute_command(cmd)
+        self.sync(cmd, dirname, source)
 
 
 class MySQL(Source):
@@ -195,6 +376,33 @@ class MySQL(Source):
             "destination_path",
             help_str='relative path of the backup destination (e.g. "database.sql")',
         ),
+        Parameter(
+            "parallel_tables",
+            converter=int,
+            help_str="number of tables dumped and restored simultaneously. "
+            "destination_path is then a folder, with one file per table "
+            "(default: 0, a single dump file)",
+        ),
+        Parameter(
+            "lock_strategy",
+            converter=CheckOption(["auto", "snapshot", "lock"]),
+            help_str="auto|snapshot|lock: consistency of the dump. "
+            '"snapshot" reads all tables in a single transaction (InnoDB only), '
+            '"lock" blocks all writes during the dump (required for MyISAM tables), '
+            '"auto" selects "lock" if a table does not use InnoDB '
+            "(default: mysqldump defaults with a single dump file, "
+            '"snapshot" with a mysql_binlog source, "auto" with parallel_tables)',
+        ),
+        Parameter(
+            "skip_unchanged",
+            converter=CheckOption(["update_time", "checksum", "binlog"]),
+            help_str="update_time|checksum|binlog: do not dump the database again "
+            "if it has not been modified since the last backup, detected with the "
+            "update times of the tables (reset when the server restarts), "
+            'the "CHECKSUM TABLE" command (that reads all data) '
+            "or the binary log position (modified by any database of the server) "
+            "(default: always dump the database)",
+        ),
         Parameter(
             "dump_executable",
             converter=check_executable,
@@ -220,6 +428,9 @@ class MySQL(Source):
         sudo_user=None,
         dump_executable="mysqldump",
         restore_executable="mysql",
+        parallel_tables=0,
+        lock_strategy=None,
+        skip_unchanged=None,
         **kwargs
     ):
         super(MySQL, self).__init__(name, collect_point, **kwargs)
@@ -232,13 +443,48 @@ class MySQL(Source):
         self.password = password
         self.database = database
         self.destination_path = destination_path
+        self.parallel_tables = parallel_tables
+        self.lock_strategy = lock_strategy
+        self.skip_unchanged = skip_unchanged
 
     def backup(self):
+        marker = None
+        if self.skip_unchanged:
+            marker = self.get_change_marker()
+            path = os.path.join(
+                self.collect_point.import_data_path, self.destination_path
+            )
+            previous_marker = self.info_data.get("change_marker")
+            if marker is None:
+                self.print_info(
+                    "modifications of %s cannot be detected: dump required"
+                    % self.database
+                )
+            elif marker == previous_marker and os.path.exists(path):
+                self.print_success(
+                    "%s has not been modified since the last backup" % self.database
+                )
+                return
+            # the dump may fail: the marker of the previous dump is not valid anymore
+            self.info_data.pop("change_marker", None)
+        start = datetime.datetime.now()
+        self.info_data.pop("binlog_position", None)
+        if self.parallel_tables:
+            self.backup_tables()
+        else:
+            self.backup_file()
+        if marker is not None:
+            self.info_data["change_marker"] = marker
+        # start of the last dump, used for point-in-time recoveries
+        self.info_data["dump_time"] = PointInfo.datetime_to_str(start)
+
+    def backup_file(self):
         filename = os.path.join(
             self.collect_point.import_data_path, self.destination_path
         )
         self.ensure_dir(filename, parent=True)
         cmd = self.get_dump_cmd_list()
+        cmd = cmd[:-1] + self.get_dump_options() + cmd[-1:]
         if self.sudo_user:
             cmd = ["sudo", "-u", self.sudo_user] + cmd
         env = os.environ.copy()
@@ -252,8 +498,16 @@ class MySQL(Source):
             p.communicate()
         if p.returncode != 0:
             raise subprocess.CalledProcessError(p.returncode, cmd[0])
+        if "--master-data=2" in cmd and filename != os.devnull:
+            with open(filename, "rb") as fd:
+                position = read_mysql_binlog_position(fd)
+            if position:
+                self.info_data["binlog_position"] = position
 
     def restore(self):
+        if self.parallel_tables:
+            self.restore_tables()
+            return
         filename = os.path.join(
             self.collect_point.import_data_path, self.destination_path
         )
@@ -276,7 +530,13 @@ class MySQL(Source):
         """ :return:
         :rtype: :class:`list` of :class:`str`
         """
-        command = [self.dump_executable]
+        return [self.dump_executable] + self.get_connection_options() + [self.database]
+
+    def get_connection_options(self):
+        """ :return: options required to connect to the server
+        :rtype: :class:`list` of :class:`str`
+        """
+        command = []
         if self.user:
             command += ["--user=%s" % self.user]
         if self.password:
@@ -285,7 +545,6 @@ class MySQL(Source):
             command += ["--host=%s" % self.host]
         if self.port:
             command += ["--port=%s" % self.port]
-        command += [self.database]
         return command
 
     def get_restore_cmd_list(self):
@@ -300,12 +559,325 @@ class MySQL(Source):
         """Extra environment variables to be passed to shell execution"""
         return {}
 
+    def get_full_env(self):
+        env = os.environ.copy()
+        env.update(self.get_env())
+        return env
+
+    def sudo(self, cmd):
+        if self.sudo_user:
+            return ["sudo", "-u", self.sudo_user] + cmd
+        return cmd
+
+    def get_dump_options(self):
+        """options added to the dump command, depending on the lock strategy"""
+        options = []
+        if self.has_binlog_source():
+            # binary log coordinates of the dump, written as a comment
+            options.append("--master-data=2")
+        if self.lock_strategy is None:
+            if options:
+                # --master-data alone silently enables --lock-all-tables
+                options += ["--single-transaction", "--quick"]
+            return options
+        strategy = self.get_lock_strategy(self.get_tables())
+        if strategy == "snapshot":
+            return options + ["--single-transaction", "--quick"]
+        return options + ["--lock-all-tables", "--quick"]
+
+    def has_binlog_source(self):
+        """Return True if the binary logs of the server are copied by a 'mysql_binlog'
+        source of the collect point, that requires the position of the dumps"""
+        return any(
+            isinstance(x, MySQLBinlog) and (x.host, x.port) == (self.host, self.port)
+            for x in self.collect_point.sources
+        )
+
+    def get_binlog_position(self):
+        """Return the current `[binary log, position]` of the server (or None)"""
+        for line in self.run_query("SHOW MASTER STATUS").splitlines():
+            values = line.split("\t")
+            if len(values) >= 2 and values[1].isdigit():
+                return [values[0], int(values[1])]
+        return None
+
+    def get_client_cmd_list(self):
+        """mysql command, connected to the server but not to the database"""
+        return self.sudo([self.restore_executable] + self.get_connection_options())
+
+    def run_query(self, query):
+        """Run a read-only SQL query (even in dry mode) and return its raw output"""
+        cmd = [self.restore_executable] + self.get_connection_options()
+        cmd += ["--batch", "--skip-column-names", "-e", query]
+        if self.database:
+            cmd.append(self.database)
+        cmd = self.sudo(cmd)
+        self.print_command(cmd)
+        p = subprocess.Popen(
+            cmd, env=self.get_full_env(), stdout=subprocess.PIPE, stderr=self.stderr
+        )
+        stdout, __ = p.communicate()
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd[0])
+        return stdout.decode("utf-8")
+
+    def get_change_marker(self):
+        """Return a value that is modified each time the database is modified
+        (None if the modifications cannot be detected)"""
+        if self.skip_unchanged == "binlog":
+            output = self.run_query("SHOW MASTER STATUS")
+            if not output.strip():  # binary logs are disabled
+                return None
+        elif self.skip_unchanged == "checksum":
+            tables = [x[0] for x in self.get_tables() if x[1] == "BASE TABLE"]
+            names = ["`%s`" % x.replace("`", "``") for x in sorted(tables)]
+            output = self.run_query("CHECKSUM TABLE %s" % ", ".join(names))
+            if not self.has_known_values(output):
+                return None
+        else:
+            # update times are not persistent: the start time of the server is added
+            output = self.run_query(
+                "SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME "
+                "FROM information_schema.TABLES WHERE TABLE_SCHEMA = '%s' "
+                "ORDER BY TABLE_NAME" % self.get_quoted_database()
+            )
+            if not self.has_known_values(output):
+                # UPDATE_TIME is not maintained by InnoDB on many versions
+                return None
+            values = self.run_query(
+                "SELECT UNIX_TIMESTAMP(); SHOW GLOBAL STATUS LIKE 'Uptime'"
+            ).split()
+            output += "\nstart time: %d" % ((int(values[0]) - int(values[-1])) // 60)
+        return hashlib.sha256(output.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def has_known_values(output):
+        """Return True if the last column of a query output has at least one non-NULL
+        value
+
+        >>> MySQL.has_known_values("table1\\t2016-06-15\\tNULL\\n")
+        False
+        >>> MySQL.has_known_values("table1\\tNULL\\ntable2\\t12\\n")
+        True
+        """
+        values = [line.split("\t")[-1] for line in output.splitlines() if line]
+        return any(x != "NULL" for x in values)
+
+    def get_quoted_database(self):
+        return self.database.replace("\\", "\\\\").replace("'", "\\'")
+
+    def get_tables(self):
+        """Return the list of `(table name, table type, engine, size)` of the database"""
+        output = self.run_query(
+            "SELECT TABLE_NAME, TABLE_TYPE, ENGINE, DATA_LENGTH + INDEX_LENGTH "
+            "FROM information_schema.TABLES WHERE TABLE_SCHEMA = '%s'"
+            % self.get_quoted_database()
+        )
+        result = []
+        for line in output.splitlines():
+            name, table_type, engine, size = line.split("\t")
+            size = int(size) if size.isdigit() else 0
+            result.append((name, table_type, engine, size))
+        return result
+
+    def get_lock_strategy(self, tables):
+        if self.lock_strategy in ("snapshot", "lock"):
+            return self.lock_strategy
+        engines = {x[2] for x in tables if x[1] == "BASE TABLE"}
+        return "snapshot" if engines <= {"InnoDB"} else "lock"
+
+    def backup_tables(self):
+        """Dump all tables in parallel, with one file per table in the `tables` subfolder.
+
+        A global read lock (FLUSH TABLES WITH READ LOCK, that requires the RELOAD privilege)
+        is held until each mysqldump process has started its transaction with the
+        "snapshot" strategy, and until the end of the dump with the "lock" strategy.
+        Views are dumped afterwards in `views.sql`."""
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        tables = self.get_tables()
+        strategy = self.get_lock_strategy(tables)
+        base_tables = [x for x in tables if x[1] == "BASE TABLE"]
+        # split tables in groups of similar sizes, one mysqldump process per group
+        groups = [[0, []] for __ in range(min(self.parallel_tables, len(base_tables)))]
+        for name, table_type, engine, size in sorted(base_tables, key=lambda x: -x[3]):
+            group = min(groups, key=lambda x: x[0])
+            group[0] += size
+            group[1].append(name)
+        options = ["--quick", "--skip-lock-tables"]
+        if strategy == "snapshot":
+            options.append("--single-transaction")
+        cmd = self.get_dump_cmd_list()
+        cmd_list = [
+            self.sudo(cmd[:-1] + options + cmd[-1:] + names) for __, names in groups
+        ]
+        text = "# %s tables dumped by %d processes in %s (lock strategy: %s)"
+        text %= (len(base_tables), len(cmd_list), dirname, strategy)
+        if not self.can_execute_command(text):
+            return
+        self.ensure_absent(dirname)
+        self.ensure_dir(os.path.join(dirname, "tables"))
+        env = self.get_full_env()
+        lock_process = self.lock_all_tables(env)
+        processes, threads = [], []
+        try:
+            if self.has_binlog_source():
+                # no transaction can be committed while the global read lock is held
+                self.info_data["binlog_position"] = self.get_binlog_position()
+            for dump_cmd in cmd_list:
+                self.print_command(dump_cmd)
+                p = subprocess.Popen(
+                    dump_cmd, env=env, stdout=subprocess.PIPE, stderr=self.stderr
+                )
+                started = threading.Event()
+                thread = threading.Thread(
+                    target=split_mysql_dump,
+                    args=(p.stdout, os.path.join(dirname, "tables"), started),
+                )
+                thread.start()
+                processes.append(p)
+                threads.append((thread, started))
+            if strategy == "snapshot":
+                for thread, started in threads:
+                    started.wait()
+                self.unlock_all_tables(lock_process)
+            for thread, started in threads:
+                thread.join()
+            for p, dump_cmd in zip(processes, cmd_list):
+                if p.wait() != 0:
+                    raise subprocess.CalledProcessError(p.returncode, dump_cmd[0])
+        finally:
+            self.unlock_all_tables(lock_process)
+        views = sorted(x[0] for x in tables if x[1] == "VIEW")
+        if views:
+            views_cmd = self.sudo(cmd[:-1] + ["--no-data", "--skip-lock-tables"])
+            with open(os.path.join(dirname, "views.sql"), "wb") as fd:
+                self.execute_command(
+                    views_cmd + cmd[-1:] + views, env=env, stdout=fd, stderr=self.stderr
+                )
+
+    def lock_all_tables(self, env):
+        """Start a mysql client that holds a global read lock, released by `unlock_all_tables`"""
+        cmd = self.get_client_cmd_list() + ["--batch", "--unbuffered"]
+        self.print_command(cmd + ["<<<", "FLUSH TABLES WITH READ LOCK;"])
+        p = subprocess.Popen(
+            cmd,
+            env=env,
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+            stderr=self.stderr,
+        )
+        p.stdin.write(b"FLUSH TABLES WITH READ LOCK;\nSELECT 'locked' AS state;\n")
+        p.stdin.flush()
+        for line in iter(p.stdout.readline, b""):
+            if line.strip() == b"locked":
+                return p
+        p.wait()
+        raise ValueError("unable to lock the tables of %s" % self.database)
+
+    def unlock_all_tables(self, lock_process):
+        if lock_process.stdin.closed:
+            return
+        lock_process.stdin.write(b"UNLOCK TABLES;\n")
+        lock_process.stdin.close()
+        lock_process.communicate()
+
+    def restore_tables(self):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        tables_dirname = os.path.join(dirname, "tables")
+        if not os.path.isdir(tables_dirname):
+            return
+        filenames = [
+            os.path.join(tables_dirname, x)
+            for x in sorted(os.listdir(tables_dirname))
+            if x.endswith(".sql")
+        ]
+        pool = ThreadPool(self.parallel_tables)
+        try:
+            pool.map(self.restore_file, filenames)
+        finally:
+            pool.close()
+            pool.join()
+        views_filename = os.path.join(dirname, "views.sql")
+        if os.path.isfile(views_filename):
+            self.restore_file(views_filename)
+
+    def restore_file(self, filename):
+        cmd = self.sudo(self.get_restore_cmd_list())
+        with open(filename, "rb") as fd:
+            self.execute_command(
+                cmd,
+                env=self.get_full_env(),
+                stdin=fd,
+                stderr=self.stderr,
+                stdout=self.stdout,
+            )
+
+
+def read_mysql_binlog_position(fd, max_lines=1000):
+    """Return the `[binary log, position]` written in the header of a dump made by
+    `mysqldump --master-data=2` (or None)."""
+    regexp = re.compile(
+        r"^-- CHANGE (?:MASTER|REPLICATION SOURCE) TO (?:MASTER|SOURCE)_LOG_FILE="
+        r"'([^']+)', (?:MASTER|SOURCE)_LOG_POS=(\d+);"
+    )
+    for index, line in enumerate(fd):
+        matcher = regexp.match(line.decode("utf-8", "replace"))
+        if matcher:
+            return [matcher.group(1), int(matcher.group(2))]
+        elif index >= max_lines:
+            break
+    return None
+
+
+def split_mysql_dump(stream, dirname, started):
+    """Write each table of a mysqldump output to a separate file of `dirname`, prefixed by
+    the header of the dump. `started` is set as soon as the first table is dumped
+    (then the transaction of mysqldump is started)."""
+    marker = b"-- Table structure for table `"
+    header = []
+    fd = None
+    try:
+        for line in iter(stream.readline, b""):
+            if line.startswith(marker):
+                started.set()
+                if fd is not None:
+                    fd.close()
+                table = line.strip()[len(marker) : -1].decode("utf-8")
+                filename = os.path.join(dirname, "%s.sql" % table.replace("/", "_"))
+                fd = open(filename, "wb")
+                fd.writelines(header)
+            elif fd is None:
+                header.append(line)
+                continue
+            fd.write(line)
+    finally:
+        started.set()
+        if fd is not None:
+            fd.close()
+
 
 class PostgresSQL(MySQL):
     """Dump the content of a PostgresSQL database with the pg_dump utility to a filename in the collect point.
     Require the 'pg_dump' and 'psql' utilities."""
 
-    parameters = MySQL.parameters[:-2] + [
+    parameters = [
+        x
+        for x in MySQL.parameters[:-2]
+        if x.arg_name not in ("lock_strategy", "skip_unchanged")
+    ] + [
+        Parameter(
+            "skip_unchanged",
+            converter=CheckOption(["stats", "wal"]),
+            help_str="stats|wal: do not dump the database again if it has not been "
+            "modified since the last backup, detected with the counters of "
+            "pg_stat_database or with the current WAL position "
+            "(modified by any database of the server) "
+            "(default: always dump the database)",
+        ),
         Parameter(
             "dump_executable",
             converter=check_executable,
@@ -316,6 +888,12 @@ class PostgresSQL(MySQL):
             converter=check_executable,
             help_str='path of the psql executable (default: "psql")',
         ),
+        Parameter(
+            "parallel_restore_executable",
+            converter=check_executable,
+            help_str="path of the pg_restore executable, used with parallel_tables "
+            '(default: "pg_restore")',
+        ),
     ]
 
     def __init__(
@@ -325,6 +903,7 @@ class PostgresSQL(MySQL):
         port="5432",
         dump_executable="pg_dump",
         restore_executable="psql",
+        parallel_restore_executable="pg_restore",
         **kwargs
     ):
         super(PostgresSQL, self).__init__(
@@ -335,16 +914,75 @@ class PostgresSQL(MySQL):
             restore_executable=restore_executable,
             **kwargs
         )
+        self.parallel_restore_executable = parallel_restore_executable
 
-    def get_dump_cmd_list(self):
-        command = [self.dump_executable]
+    def get_dump_options(self):
+        return []
+
+    def run_query(self, query):
+        cmd = [self.restore_executable] + self.get_connection_options()
+        cmd += ["--no-psqlrc", "--tuples-only", "--no-align", "--command=%s" % query]
+        cmd = self.sudo(cmd + [self.database])
+        self.print_command(cmd)
+        p = subprocess.Popen(
+            cmd, env=self.get_full_env(), stdout=subprocess.PIPE, stderr=self.stderr
+        )
+        stdout, __ = p.communicate()
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd[0])
+        return stdout.decode("utf-8")
+
+    def get_change_marker(self):
+        if self.skip_unchanged == "wal":
+            output = self.run_query("SELECT pg_current_wal_lsn()")
+        else:
+            # counters are reset after a crash: the start time of the server is added
+            output = self.run_query(
+                "SELECT tup_inserted, tup_updated, tup_deleted, stats_reset, "
+                "pg_postmaster_start_time() FROM pg_stat_database "
+                "WHERE datname = current_database()"
+            )
+        return hashlib.sha256(output.encode("utf-8")).hexdigest()
+
+    def backup_tables(self):
+        """pg_dump natively dumps tables in parallel in a consistent snapshot"""
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        self.ensure_absent(dirname)
+        self.ensure_dir(dirname, parent=True)
+        cmd = self.get_dump_cmd_list()
+        cmd = cmd[:-1] + [
+            "--format=directory",
+            "--jobs=%d" % self.parallel_tables,
+            "--file=%s" % dirname,
+        ]
+        self.execute_command(self.sudo(cmd + [self.database]), env=self.get_full_env())
+
+    def restore_tables(self):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        if not os.path.isdir(dirname):
+            return
+        cmd = [self.parallel_restore_executable] + self.get_connection_options()
+        cmd += [
+            "--clean",
+            "--if-exists",
+            "--jobs=%d" % self.parallel_tables,
+            "--dbname=%s" % self.database,
+            dirname,
+        ]
+        self.execute_command(self.sudo(cmd), env=self.get_full_env())
+
+    def get_connection_options(self):
+        command = []
         if self.user:
             command += ["--username=%s" % self.user]
         if self.host:
             command += ["--host=%s" % self.host]
         if self.port:
             command += ["--port=%s" % self.port]
-        command += [self.database]
         return command
 
     def get_env(self):
@@ -354,6 +992,368 @@ class PostgresSQL(MySQL):
         return {}
 
 
+class MySQLBinlog(MySQL):
+    """Copy the binary logs of a MySQL server to a folder of the collect point with mysqlbinlog.
+    Binary logs are replayed after the restore of the full dump of a 'mysql' source (that must be defined before
+    in the same collect point), allowing point-in-time recoveries.
+    The user requires the REPLICATION SLAVE and REPLICATION CLIENT privileges.
+    Require the 'mysqlbinlog' and 'mysql' utilities."""
+
+    parameters = [
+        x
+        for x in MySQL.parameters
+        if x.arg_name
+        not in (
+            "database",
+            "destination_path",
+            "parallel_tables",
+            "lock_strategy",
+            "skip_unchanged",
+            "dump_executable",
+            "restore_executable",
+        )
+    ] + [
+        Parameter(
+            "destination_path",
+            help_str="relative path of the folder of binary logs "
+            '(default: "mysql_binlog")',
+        ),
+        Parameter(
+            "restore_start_datetime",
+            help_str="replay binary logs of all databases from this date "
+            '("YYYY-MM-DD HH:MM:SS", default: the logs of each database of a "mysql" '
+            "source of this collect point are replayed from the binary log position "
+            "recorded by its last dump)",
+        ),
+        Parameter(
+            "restore_stop_datetime",
+            help_str="point-in-time recovery: replay binary logs until this date "
+            '("YYYY-MM-DD HH:MM:SS", default: replay all binary logs)',
+        ),
+        Parameter(
+            "binlog_executable",
+            converter=check_executable,
+            help_str='path of the mysqlbinlog executable (default: "mysqlbinlog")',
+        ),
+        Parameter(
+            "restore_executable",
+            converter=check_executable,
+            help_str='path of the mysql executable (default: "mysql")',
+        ),
+    ]
+
+    def __init__(
+        self,
+        name,
+        collect_point,
+        destination_path="mysql_binlog",
+        binlog_executable="mysqlbinlog",
+        restore_start_datetime=None,
+        restore_stop_datetime=None,
+        **kwargs
+    ):
+        super(MySQLBinlog, self).__init__(
+            name, collect_point, destination_path=destination_path, **kwargs
+        )
+        self.binlog_executable = binlog_executable
+        self.restore_start_datetime = restore_start_datetime
+        self.restore_stop_datetime = restore_stop_datetime
+
+    def backup(self):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        self.ensure_dir(dirname)
+        server_logs = [
+            line.split("\t")[0]
+            for line in self.run_query("SHOW BINARY LOGS").splitlines()
+            if line
+        ]
+        if not server_logs:
+            raise ValueError("binary logs are not enabled on %s" % self.host)
+        local_logs = sorted(os.listdir(dirname)) if os.path.isdir(dirname) else []
+        # the last copied log may have been modified since the previous backup
+        start_logs = [x for x in local_logs if x in server_logs][-1:] or server_logs
+        if local_logs and local_logs[-1] < server_logs[0]:
+            self.print_error(
+                "binary logs between %s and %s have been purged from the server"
+                % (local_logs[-1], server_logs[0])
+            )
+        cmd = [self.binlog_executable] + self.get_connection_options()
+        cmd += ["--read-from-remote-server", "--raw", "--to-last-log"]
+        cmd += ["--result-file=%s" % os.path.join(dirname, ""), start_logs[0]]
+        self.execute_command(self.sudo(cmd), env=self.get_full_env())
+        self.info_data["last_log"] = server_logs[-1]
+
+    def get_replays(self):
+        """Return the list of `(first binary log, mysqlbinlog options, database)` to
+        replay after the restore of the dumps.
+
+        Each database is replayed separately from the position recorded by its dump
+        (or from its start date for dumps made by previous versions).
+        Raise ValueError if the start of a replay is unknown, unless `restore_start_datetime` is set.
+        """
+        if self.restore_start_datetime:
+            return [(None, ["--start-datetime=%s" % self.restore_start_datetime], None)]
+        result = []
+        for source in self.collect_point.sources:
+            if (
+                not isinstance(source, MySQL)
+                or isinstance(source, MySQLBinlog)
+                or (source.host, source.port) != (self.host, self.port)
+            ):
+                continue
+            position = source.info_data.get("binlog_position")
+            dump_time = source.info_data.get("dump_time")
+            if position:
+                replay = (position[0], ["--start-position=%d" % position[1]])
+            elif dump_time:
+                replay = (None, ["--start-datetime=%s" % dump_time.replace("T", " ")])
+            else:
+                raise ValueError(
+                    "the binary log position of the dump of %s is unknown: "
+                    "set restore_start_datetime" % source.database
+                )
+            result.append(replay + (source.database,))
+        if not result:
+            raise ValueError(
+                "no dump of the server of %s in this collect point: "
+                "set restore_start_datetime" % self.name
+            )
+        return result
+
+    def restore(self):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        if not os.path.isdir(dirname):
+            return
+        logs = sorted(x for x in os.listdir(dirname) if re.match(r"^.+\.\d+$", x))
+        if not logs:
+            return
+        replays = self.get_replays()
+        for first_log, options, database in replays:
+            # the position is only valid in the first log
+            if first_log is not None and first_log not in logs:
+                raise ValueError(
+                    "binary log %s of the dump of %s is missing" % (first_log, database)
+                )
+        for first_log, options, database in replays:
+            cmd = [self.binlog_executable] + options
+            if database:
+                cmd.append("--database=%s" % database)
+            if self.restore_stop_datetime:
+                cmd.append("--stop-datetime=%s" % self.restore_stop_datetime)
+            cmd += [
+                os.path.join(dirname, x)
+                for x in logs
+                if first_log is None or x >= first_log
+            ]
+            self.replay(cmd)
+
+    def replay(self, cmd):
+        """pipe the output of the mysqlbinlog command `cmd` to the mysql client"""
+        restore_cmd = self.get_client_cmd_list()
+        if not self.can_execute_command(cmd + ["|"] + restore_cmd):
+            return
+        env = self.get_full_env()
+        p1 = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=self.stderr)
+        p2 = subprocess.Popen(
+            restore_cmd,
+            env=env,
+            stdin=p1.stdout,
+            stdout=self.stdout,
+            stderr=self.stderr,
+        )
+        p1.stdout.close()
+        p2.communicate()
+        p1.wait()
+        if p1.returncode != 0:
+            raise subprocess.CalledProcessError(p1.returncode, cmd[0])
+        if p2.returncode != 0:
+            raise subprocess.CalledProcessError(p2.returncode, restore_cmd[0])
+
+
+class PostgresWAL(PostgresSQL):
+    """Copy the WAL files of a PostgreSQL server to a folder of the collect point with pg_receivewal,
+    through a replication slot, as well as periodic base backups made by pg_basebackup.
+    The restore extracts the base backup in the data directory of the stopped server and configures a
+    point-in-time recovery, performed by the next start of the server.
+    The user requires the REPLICATION privilege. Require the 'pg_receivewal', 'pg_basebackup' and 'psql' utilities."""
+
+    parameters = [
+        x
+        for x in PostgresSQL.parameters
+        if x.arg_name
+        not in (
+            "destination_path",
+            "parallel_tables",
+            "skip_unchanged",
+            "dump_executable",
+            "parallel_restore_executable",
+        )
+    ] + [
+        Parameter(
+            "destination_path",
+            help_str="relative path of the folder of WAL files "
+            '(default: "postgresql_wal")',
+        ),
+        Parameter(
+            "slot_name",
+            help_str='name of the replication slot (default: "polyarchiv"). '
+            "The server keeps WAL files until they are copied: remove the slot if "
+            "you stop the backups",
+        ),
+        Parameter(
+            "base_backup_interval",
+            converter=get_is_time_elapsed,
+            help_str="frequency of base backups (same format as the frequency option, "
+            'default: "weekly"). Older WAL files are removed after each base backup',
+        ),
+        Parameter(
+            "data_directory",
+            help_str="data directory of the stopped server, used by the restore",
+        ),
+        Parameter(
+            "recovery_target_time",
+            help_str="point-in-time recovery: replay WAL files until this date "
+            "(default: replay all WAL files)",
+        ),
+        Parameter(
+            "receivewal_executable",
+            converter=check_executable,
+            help_str='path of the pg_receivewal executable (default: "pg_receivewal")',
+        ),
+        Parameter(
+            "basebackup_executable",
+            converter=check_executable,
+            help_str='path of the pg_basebackup executable (default: "pg_basebackup")',
+        ),
+    ]
+
+    def __init__(
+        self,
+        name,
+        collect_point,
+        destination_path="postgresql_wal",
+        database="postgres",
+        slot_name="polyarchiv",
+        base_backup_interval=None,
+        data_directory=None,
+        recovery_target_time=None,
+        receivewal_executable="pg_receivewal",
+        basebackup_executable="pg_basebackup",
+        **kwargs
+    ):
+        super(PostgresWAL, self).__init__(
+            name,
+            collect_point,
+            destination_path=destination_path,
+            database=database,
+            **kwargs
+        )
+        self.slot_name = slot_name
+        self.base_backup_interval = base_backup_interval or get_is_time_elapsed(
+            "weekly"
+        )
+        self.data_directory = data_directory
+        self.recovery_target_time = recovery_target_time
+        self.receivewal_executable = receivewal_executable
+        self.basebackup_executable = basebackup_executable
+
+    def backup(self):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        base_dirname = os.path.join(dirname, "base")
+        wal_dirname = os.path.join(dirname, "wal")
+        self.ensure_dir(wal_dirname)
+        env = self.get_full_env()
+        cmd = [self.receivewal_executable] + self.get_connection_options()
+        cmd += ["--slot=%s" % self.slot_name]
+        # the slot must exist before the base backup, to keep all required WAL files
+        self.execute_command(
+            self.sudo(cmd + ["--create-slot", "--if-not-exists"]), env=env
+        )
+        now = datetime.datetime.now()
+        previous_time = PointInfo.datetime_from_str(
+            self.info_data.get("base_backup_time")
+        )
+        if not os.path.isdir(base_dirname) or self.base_backup_interval(
+            current_time=now, previous_time=previous_time
+        ):
+            self.base_backup(base_dirname, wal_dirname, env)
+            self.info_data["base_backup_time"] = PointInfo.datetime_to_str(now)
+        end_lsn = self.run_query("SELECT pg_current_wal_lsn()").strip()
+        cmd += ["--directory=%s" % wal_dirname, "--endpos=%s" % end_lsn, "--no-loop"]
+        self.execute_command(self.sudo(cmd), env=env)
+        self.info_data["last_lsn"] = end_lsn
+
+    def base_backup(self, base_dirname, wal_dirname, env):
+        """replace the previous base backup and remove the WAL files that are older"""
+        first_wal = self.run_query("SELECT pg_walfile_name(pg_current_wal_lsn())")
+        first_wal = first_wal.strip()
+        new_dirname = base_dirname + ".new"
+        self.ensure_absent(new_dirname)
+        cmd = [self.basebackup_executable] + self.get_connection_options()
+        cmd += [
+            "--pgdata=%s" % new_dirname,
+            "--format=tar",
+            "--gzip",
+            "--wal-method=none",
+            "--checkpoint=fast",
+        ]
+        self.execute_command(self.sudo(cmd), env=env)
+        self.ensure_absent(base_dirname)
+        if self.can_execute_command(["mv", new_dirname, base_dirname]):
+            os.rename(new_dirname, base_dirname)
+        if not os.path.isdir(wal_dirname) or not first_wal:
+            return
+        for filename in sorted(os.listdir(wal_dirname)):
+            # WAL file names are made of 24 hexadecimal digits
+            if filename[:24] < first_wal:
+                self.ensure_absent(os.path.join(wal_dirname, filename))
+
+    def restore(self):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        base_filename = os.path.join(dirname, "base", "base.tar.gz")
+        wal_dirname = os.path.join(dirname, "wal")
+        if not os.path.isfile(base_filename):
+            return
+        elif not self.data_directory:
+            raise ValueError("data_directory is required to restore %s" % self.name)
+        self.execute_command(self.sudo(["mkdir", "-p", self.data_directory]))
+        self.execute_command(
+            self.sudo(["tar", "-xzf", base_filename, "-C", self.data_directory])
+        )
+        wal_path = os.path.join(wal_dirname, "%f")
+        restore_command = "cp %s %%p || cp %s.partial %%p" % (
+            smart_quote(wal_path),
+            smart_quote(wal_path),
+        )
+        settings = ["restore_command = '%s'" % restore_command.replace("'", "''")]
+        if self.recovery_target_time:
+            settings += [
+                "recovery_target_time = '%s'" % self.recovery_target_time,
+                "recovery_target_action = 'promote'",
+            ]
+        content = "".join("%s\n" % x for x in settings).encode("utf-8")
+        conf_path = os.path.join(self.data_directory, "postgresql.auto.conf")
+        with tempfile.NamedTemporaryFile() as fd, io.open(os.devnull, "wb") as devnull:
+            fd.write(content)
+            fd.seek(0)
+            self.execute_command(
+                self.sudo(["tee", "-a", conf_path]), stdin=fd, stdout=devnull
+            )
+        signal_path = os.path.join(self.data_directory, "recovery.signal")
+        self.execute_command(self.sudo(["touch", signal_path]))
+        self.print_success(
+            "start the PostgreSQL server to replay WAL files from %s" % wal_dirname
+        )
+
+
 class Ldap(Source):
     """Dump a OpenLDAP database using slapcat to a filename in the collect point.
     Must be run on the LDAP server with a sudoer account (or 'root'). Require the 'slapcat' and 'slapadd' utilities. """
@@ -375,6 +1375,25 @@ class Ldap(Source):
             "ldap_base", help_str="your LDAP base dn (if you want to restrict the dump)"
         ),
         Parameter("database", help_str="database number (default: 1)", converter=int),
+        Parameter(
+            "compression",
+            converter=CheckOption(sorted(LDIF_COMPRESSIONS)),
+            help_str="%s: compress the dump, adding the corresponding suffix to "
+            "destination_path (default: no compression)"
+            % "|".join(sorted(LDIF_COMPRESSIONS)),
+        ),
+        Parameter(
+            "quick",
+            converter=bool_setting,
+            help_str="restore with 'slapadd -q' (faster, but without consistency "
+            "checks, yes/no)",
+        ),
+        Parameter(
+            "tool_threads",
+            converter=int,
+            help_str="number of threads used by slapadd for indexing (olcToolThreads "
+            "option, set with slapmodify during the restore, and then restored)",
+        ),
         Parameter(
             "dump_executable",
             converter=check_executable,
@@ -385,6 +1404,11 @@ class Ldap(Source):
             converter=check_executable,
             help_str='path of the slapadd executable (default: "slapadd")',
         ),
+        Parameter(
+            "modify_executable",
+            converter=check_executable,
+            help_str='path of the slapmodify executable (default: "slapmodify")',
+        ),
     ]
 
     def __init__(
@@ -397,6 +1421,10 @@ class Ldap(Source):
         restore_executable="slapadd",
         database=1,
         ldap_base=None,
+        compression=None,
+        quick=False,
+        tool_threads=None,
+        modify_executable="slapmodify",
         **kwargs
     ):
         super(Ldap, self).__init__(name, collect_point, **kwargs)
@@ -406,11 +1434,30 @@ class Ldap(Source):
         self.use_sudo = use_sudo
         self.ldap_base = ldap_base
         self.database = database
+        self.compression = compression
+        self.quick = quick
+        self.tool_threads = tool_threads
+        self.modify_executable = modify_executable
 
-    def backup(self):
+    @property
+    def dump_filename(self):
         filename = os.path.join(
             self.collect_point.import_data_path, self.destination_path
         )
+        if self.compression:
+            filename += LDIF_COMPRESSIONS[self.compression][0]
+        return filename
+
+    def open_dump(self, filename, mode):
+        if not self.compression:
+            return open(filename, mode)
+        opener = LDIF_COMPRESSIONS[self.compression][1]
+        if opener is None:
+            raise ValueError("%s compression is not available" % self.compression)
+        return opener(filename, mode)
+
+    def backup(self):
+        filename = self.dump_filename
         self.ensure_dir(filename, parent=True)
         cmd = []
         if self.use_sudo:
@@ -419,19 +1466,37 @@ class Ldap(Source):
         if self.ldap_base:
             cmd += ["-b", self.ldap_base]
         cmd += ["-n", str(self.database)]
-        self.execute_command(cmd)
-        if not self.can_execute_command(cmd + [">", filename]):
+        cmd_text = list(cmd)
+        if self.compression:
+            cmd_text += ["|", LDIF_COMPRESSIONS[self.compression][2]]
+        if not self.can_execute_command(cmd_text + [">", filename]):
             filename = os.devnull  # run the dump even in dry mode
-        with open(filename, "wb") as fd:
-            p = subprocess.Popen(cmd, stdout=fd, stderr=self.stderr)
-            p.communicate()
+        checksum = hashlib.sha256()
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=self.stderr)
+        with self.open_dump(filename, "wb") as fd:
+            for block in iter(lambda: p.stdout.read(COPY_CHUNK_SIZE), b""):
+                checksum.update(block)
+                fd.write(block)
+        p.wait()
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd[0])
+        # checksum of the uncompressed dump
+        self.info_data["sha256"] = checksum.hexdigest()
+
+    def get_checksum(self, filename):
+        checksum = hashlib.sha256()
+        with self.open_dump(filename, "rb") as fd:
+            for block in iter(lambda: fd.read(COPY_CHUNK_SIZE), b""):
+                checksum.update(block)
+        return checksum.hexdigest()
 
     def restore(self):
-        filename = os.path.join(
-            self.collect_point.import_data_path, self.destination_path
-        )
+        filename = self.dump_filename
         if not os.path.isfile(filename):
             return
+        expected_checksum = self.info_data.get("sha256")
+        if expected_checksum and self.get_checksum(filename) != expected_checksum:
+            raise ValueError("%s is corrupted (invalid checksum)" % filename)
         prefix = []
         if self.use_sudo:
             prefix += ["sudo"]
@@ -458,12 +1523,65 @@ class Ldap(Source):
         self.execute_command(prefix + ["service", "slapd", "stop"])
         self.execute_command(prefix + ["rm", "-rf", database_folder])
         self.execute_command(prefix + ["mkdir", "-p", database_folder])
-        self.execute_command(prefix + [self.restore_executable, "-l", filename])
+        previous_tool_threads = None
+        if self.tool_threads:
+            previous_tool_threads = self.get_tool_threads(io.BytesIO(stdout))
+            self.set_tool_threads(prefix, self.tool_threads)
+        try:
+            self.import_dump(prefix, filename)
+        finally:
+            if self.tool_threads:
+                # olcToolThreads is only modified during the import
+                self.set_tool_threads(prefix, previous_tool_threads)
         self.execute_command(
             prefix + ["chown", "-R", "%s:%s" % (user, group), database_folder]
         )
         self.execute_command(prefix + ["service", "slapd", "start"])
 
+    def import_dump(self, prefix, filename):
+        cmd = prefix + [self.restore_executable, "-n", str(self.database)]
+        if self.quick:
+            cmd.append("-q")
+        if not self.compression:
+            self.execute_command(cmd + ["-l", filename])
+        elif self.can_execute_command(
+            [LDIF_COMPRESSIONS[self.compression][2], "-dc", filename, "|"] + cmd
+        ):
+            p = subprocess.Popen(
+                cmd, stdin=subprocess.PIPE, stdout=self.stdout, stderr=self.stderr
+            )
+            with self.open_dump(filename, "rb") as fd:
+                for block in iter(lambda: fd.read(COPY_CHUNK_SIZE), b""):
+                    p.stdin.write(block)
+            p.stdin.close()
+            p.wait()
+            if p.returncode != 0:
+                raise subprocess.CalledProcessError(p.returncode, cmd[0])
+
+    def set_tool_threads(self, prefix, value):
+        """Set the olcToolThreads option of cn=config (removed if `value` is None)"""
+        if value is None:
+            ldif = "dn: cn=config\nchangetype: modify\ndelete: olcToolThreads\n"
+        else:
+            ldif = (
+                "dn: cn=config\nchangetype: modify\nreplace: olcToolThreads\n"
+                "olcToolThreads: %s\n" % value
+            )
+        with tempfile.NamedTemporaryFile() as fd:
+            fd.write(ldif.encode("utf-8"))
+            fd.flush()
+            fd.seek(0)
+            self.execute_command(prefix + [self.modify_executable, "-n", "0"], stdin=fd)
+
+    @staticmethod
+    def get_tool_threads(ldif_config):
+        """Return the olcToolThreads option of cn=config (or None if not set)"""
+        parser = LDIFParser(ldif_config)
+        for dn, entry in parser.parse():
+            if dn == "cn=config":
+                return entry.get("olcToolThreads", [None])[0]
+        return None
+
     @staticmethod
     def get_database_folder(ldif_config, database_number):
         parser = LDIFParser(ldif_config)
@@ -476,7 +1594,12 @@ class Ldap(Source):
 
 
 class Dovecot(Source):
-    """Dump a OpenLDAP database using slapcat to a filename in the collect point. Require the 'doveadm' utility."""
+    """Dump Dovecot mailboxes with 'doveadm backup' to a folder in the collect point. Require the 'doveadm' utility.
+    By default, a single 'doveadm backup' dumps all users (or the users matching `user_mask`).
+    With `parallel_users`, users are listed with 'doveadm user' and each of them is dumped to its own subfolder,
+    with at most `parallel_users` simultaneous dumps.
+    With `skip_unchanged`, users whose 'doveadm mailbox status' (uidnext, highestmodseq, vsize, …) is identical
+    to the one of the last backup are not dumped again."""
 
     parameters = Source.parameters + [
         Parameter(
@@ -493,6 +1616,19 @@ class Dovecot(Source):
             "user_mask",
             help_str='only sync this user ("*" and "?" wildcards can be used).',
         ),
+        Parameter(
+            "parallel_users",
+            converter=int,
+            help_str="list users with 'doveadm user' and back them up separately, "
+            "with this max. number of simultaneous users (default: 0, a single "
+            "'doveadm backup' for all users)",
+        ),
+        Parameter(
+            "skip_unchanged",
+            converter=bool_setting,
+            help_str="with parallel_users, skip users whose mailboxes have not been "
+            "modified since the last backup (yes/no)",
+        ),
         Parameter(
             "dump_executable",
             converter=check_executable,
@@ -509,6 +1645,8 @@ class Dovecot(Source):
         mailbox=None,
         user_mask=None,
         socket=None,
+        parallel_users=0,
+        skip_unchanged=False,
         **kwargs
     ):
         super(Dovecot, self).__init__(name, collect_point, **kwargs)
@@ -517,25 +1655,37 @@ class Dovecot(Source):
         self.dump_executable = dump_executable
         self.mailbox = mailbox
         self.user_mask = user_mask
+        self.parallel_users = parallel_users
+        self.skip_unchanged = skip_unchanged
 
     def backup(self):
-        self.perform_action(restore=False)
+        if self.parallel_users:
+            self.perform_users_action(restore=False)
+        else:
+            self.perform_action(restore=False)
 
     def restore(self):
-        self.perform_action(restore=True)
+        if self.parallel_users:
+            self.perform_users_action(restore=True)
+        else:
+            self.perform_action(restore=True)
+
+    def get_doveadm_cmd(self, *command):
+        cmd = [self.dump_executable] + list(command)
+        if self.socket:
+            cmd += ["-S", self.socket]
+        return cmd
 
     def perform_action(self, restore):
         dirname = os.path.join(
             self.collect_point.import_data_path, self.destination_path
         )
         self.ensure_dir(dirname)
-        cmd = [self.dump_executable, "backup"]
+        cmd = self.get_doveadm_cmd("backup")
         if restore:
             cmd += ["-R"]
         if self.mailbox:
             cmd += ["-m", self.mailbox]
-        if self.socket:
-            cmd += ["-S", self.socket]
         if self.user_mask is None:
             cmd += ["-A"]
         else:
@@ -543,10 +1693,101 @@ class Dovecot(Source):
         cmd += [dirname]
         self.execute_command(cmd)
 
+    def run_doveadm(self, cmd):
+        """Run a read-only doveadm command (even in dry mode) and return its output"""
+        self.print_command(cmd)
+        p = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=self.stderr)
+        stdout, __ = p.communicate()
+        if p.returncode != 0:
+            raise subprocess.CalledProcessError(p.returncode, cmd[0])
+        return stdout.decode("utf-8")
+
+    def get_users(self):
+        cmd = self.get_doveadm_cmd("user") + [self.user_mask or "*"]
+        return [x for x in self.run_doveadm(cmd).splitlines() if x.strip()]
+
+    def get_user_marker(self, user):
+        """Return a value that is modified each time a mailbox of the user is modified"""
+        cmd = self.get_doveadm_cmd("-f", "flow", "mailbox", "status", "-u", user)
+        cmd += ["messages uidnext uidvalidity highestmodseq vsize", self.mailbox or "*"]
+        output = self.run_doveadm(cmd)
+        return hashlib.sha256(output.encode("utf-8")).hexdigest()
+
+    def perform_users_action(self, restore):
+        dirname = os.path.join(
+            self.collect_point.import_data_path, self.destination_path
+        )
+        self.ensure_dir(dirname)
+        if restore:
+            users = [
+                x
+                for x in sorted(os.listdir(dirname))
+                if os.path.isdir(os.path.join(dirname, x))
+            ]
+            if self.user_mask:
+                users = [x for x in users if fnmatch.fnmatch(x, self.user_mask)]
+        else:
+            users = self.get_users()
+        markers = self.info_data.setdefault("users", {})
+        pool = ThreadPool(max(1, min(self.parallel_users, len(users))))
+        try:
+            results = pool.map(
+                lambda user: self._perform_user_action(dirname, user, restore), users
+            )
+        finally:
+            pool.close()
+            pool.join()
+        errors = []
+        for user, marker, error in results:
+            if error:
+                errors.append(user)
+                markers.pop(user, None)
+            elif marker is not None:
+                markers[user] = marker
+        if not restore:
+            # removed users are neither kept in the collect point info nor restored
+            for user in set(markers) - set(users):
+                del markers[user]
+            user_dirnames = os.listdir(dirname) if os.path.isdir(dirname) else []
+            for user in sorted(set(user_dirnames) - set(users)):
+                user_dirname = os.path.join(dirname, user)
+                if os.path.isdir(user_dirname):
+                    self.ensure_absent(user_dirname)
+        if errors:
+            action = "restore" if restore else "backup"
+            raise ValueError(
+                "unable to %s %d/%d users: %s"
+                % (action, len(errors), len(users), ", ".join(errors))
+            )
+
+    def _perform_user_action(self, dirname, user, restore):
+        """Return `(user, new change marker or None, error message or None)`"""
+        user_dirname = os.path.join(dirname, user)
+        try:
+            marker = None
+            if self.skip_unchanged and not restore:
+                marker = self.get_user_marker(user)
+                if self.info_data.get("users", {}).get(user) == marker and (
+                    os.path.isdir(user_dirname)
+                ):
+                    return user, None, None
+            cmd = self.get_doveadm_cmd("backup")
+            if restore:
+                cmd += ["-R"]
+            if self.mailbox:
+                cmd += ["-m", self.mailbox]
+            cmd += ["-u", user, user_dirname]
+            self.execute_command(cmd)
+        except Exception as e:
+            action = "restore" if restore else "backup"
+            self.print_error("unable to %s %s: %s" % (action, user, text_type(e)))
+            return user, None, text_type(e) or e.__class__.__name__
+        return user, marker, None
+
 
 class RemoteFiles(Source):
     """copy the remote files from the given server/source_path to the collect point.
-    The destination is a folder inside the collect point.
+    The destination is a folder inside the collect point, with one subfolder per URL when several URLs are given.
     Require 'rsync'.
     """
 
@@ -554,7 +1795,9 @@ class RemoteFiles(Source):
         Parameter(
             "source_url",
             required=True,
-            help_str="synchronize data from this URL. Must ends by a folder name",
+            help_str="synchronize data from this URL. Must ends by a folder name. "
+            "Several URLs can be separated by spaces, local paths can contain "
+            'wildcards and "{host}" is replaced by each host of the inventory file',
         ),
         Parameter(
             "destination_path",
@@ -576,6 +1819,19 @@ class RemoteFiles(Source):
             converter=check_file,
             help_str="absolute path of the keytab file (for Kerberos authentication)",
         ),
+        Parameter(
+            "inventory",
+            converter=check_file,
+            help_str="absolute path of a file with one host per line "
+            '(replacing "{host}" in source_url)',
+        ),
+        Parameter(
+            "concurrency",
+            converter=strip_split,
+            help_str="max. number of simultaneous transfers per protocol, "
+            'like "ssh:8, https:2, 4" (default: %d for each protocol)'
+            % REMOTE_FILES_CONCURRENCY,
+        ),
     ]
 
     def __init__(
@@ -588,12 +1844,16 @@ class RemoteFiles(Source):
         private_key=None,
         ca_cert=None,
         ssh_options=None,
+        inventory=None,
+        concurrency=None,
         **kwargs
     ):
         """
         :param collect_point: collect point where files are stored
         :param source_url: remote folders to add to the collect point
         :param destination_path: relative path of the backup destination (must be a directory name, e.g. "data")
+        :param inventory: file with one host per line, replacing "{host}" in `source_url`
+        :param concurrency: list of "protocol:max. number of transfers" (or a single number for all protocols)
         """
         super(RemoteFiles, self).__init__(name, collect_point, **kwargs)
         self.destination_path = destination_path
@@ -602,18 +1862,116 @@ class RemoteFiles(Source):
         self.private_key = private_key
         self.ca_cert = ca_cert
         self.ssh_options = ssh_options
+        self.inventory = inventory
+        self.concurrency = {"": REMOTE_FILES_CONCURRENCY}
+        for value in concurrency or []:
+            scheme, __, count = value.rpartition(":")
+            self.concurrency[scheme] = int(count)
+
+    def get_source_urls(self):
+        """Return a dict {subfolder name: URL}.
+        The subfolder name is empty if `source_url` is a single URL."""
+        urls = self.source_url.split()
+        if self.inventory:
+            with io.open(self.inventory, "r", encoding="utf-8") as fd:
+                hosts = [line.strip() for line in fd]
+            hosts = [x for x in hosts if x and not x.startswith("#")]
+            urls = [
+                url.replace("{host}", host)
+                for url in urls
+                for host in (hosts if "{host}" in url else ["{host}"])
+            ]
+        expanded_urls = []
+        for url in urls:
+            parsed_url = urlparse(url)
+            if parsed_url.scheme not in ("", "file") or not re.search(r"[*?[]", url):
+                expanded_urls.append(url)
+                continue
+            prefix = "file://" if parsed_url.scheme else ""
+            expanded_urls += [prefix + x for x in sorted(glob.glob(parsed_url.path))]
+        if expanded_urls == [self.source_url.strip()]:
+            return {"": expanded_urls[0]}
+        urls_by_name = {}
+        for url in expanded_urls:
+            parsed_url = urlparse(url)
+            name = parsed_url.hostname or os.path.basename(parsed_url.path.rstrip("/"))
+            urls_by_name.setdefault(name, []).append(url)
+        result = {}
+        for name, urls in urls_by_name.items():
+            for url in urls:
+                if len(urls) > 1:
+                    path = urlparse(url).path.strip("/")
+                    url_name = "%s-%s" % (name, re.sub(r"[^\w.-]+", "_", path))
+                else:
+                    url_name = name
+                result[url_name] = url
+        return result
 
     def backup(self):
-        backend = self._get_backend()
         dirname = os.path.join(
             self.collect_point.import_data_path, self.destination_path
         )
-        backend.sync_dir_to_local(dirname)
+        source_urls = self.get_source_urls()
+        if list(source_urls) == [""]:
+            self._get_backend(source_urls[""]).sync_dir_to_local(dirname)
+            return
+        results = self.sync_urls(dirname, source_urls, to_local=True)
+        hosts = self.info_data.get("hosts", {})
+        now = PointInfo.datetime_to_str(datetime.datetime.now())
+        errors = []
+        for url_name, url, error in results:
+            host = hosts.get(url_name, {})
+            host["url"] = url
+            host["last_message"] = error or "ok"
+            if error:
+                host["last_fail"] = now
+                errors.append(url_name)
+            else:
+                host["last_success"] = now
+            hosts[url_name] = host
+        self.info_data["hosts"] = {x: hosts[x] for x in source_urls}
+        if errors:
+            raise ValueError(
+                "unable to fetch %d/%d URLs: %s"
+                % (len(errors), len(source_urls), ", ".join(sorted(errors)))
+            )
 
-    def _get_backend(self):
+    def sync_urls(self, dirname, source_urls, to_local=True):
+        """Synchronize each URL with a subfolder of `dirname`, using a pool of threads per protocol.
+        Return a list of `(subfolder name, URL, error message or None)`."""
+        items_by_scheme = {}
+        for url_name, url in sorted(source_urls.items()):
+            scheme = urlparse(url).scheme or "file"
+            item = (url_name, url, os.path.join(dirname, url_name), to_local)
+            items_by_scheme.setdefault(scheme, []).append(item)
+        pools, async_results = [], []
+        for scheme, items in items_by_scheme.items():
+            size = self.concurrency.get(scheme, self.concurrency[""])
+            pool = ThreadPool(max(1, min(size, len(items))))
+            async_results.append(pool.map_async(self._sync_url, items))
+            pools.append(pool)
+        for pool in pools:
+            pool.close()
+            pool.join()
+        return [result for x in async_results for result in x.get()]
+
+    def _sync_url(self, item):
+        url_name, url, local_dirname, to_local = item
+        try:
+            backend = self._get_backend(url)
+            if to_local:
+                backend.sync_dir_to_local(local_dirname)
+            else:
+                backend.sync_dir_from_local(local_dirname)
+        except Exception as e:
+            self.print_error("unable to synchronize %s: %s" % (url, text_type(e)))
+            return url_name, url, text_type(e) or e.__class__.__name__
+        return url_name, url, None
+
+    def _get_backend(self, source_url=None):
         backend = get_backend(
             self.collect_point,
-            self.source_url,
+            source_url or self.source_url,
             keytab=self.keytab,
             private_key=self.private_key,
             ca_cert=self.ca_cert,
@@ -623,8 +1981,17 @@ class RemoteFiles(Source):
         return backend
 
     def restore(self):
-        backend = self._get_backend()
         dirname = os.path.join(
             self.collect_point.import_data_path, self.destination_path
         )
-        backend.sync_dir_from_local(dirname)
+        source_urls = self.get_source_urls()
+        if list(source_urls) == [""]:
+            self._get_backend(source_urls[""]).sync_dir_from_local(dirname)
+            return
+        results = self.sync_urls(dirname, source_urls, to_local=False)
+        errors = [x for x in results if x[2]]
+        if errors:
+            raise ValueError(
+                "unable to restore %d/%d URLs: %s"
+                % (len(errors), len(source_urls), ", ".join(x[0] for x in errors))
+            )
@@ -0,0 +1,136 @@
+# -*- coding=utf-8 -*-
+"""Status index, summarizing the last backup of each point on this host.
+
+The index is a small JSON file updated at the end of each backup run. `polyarchiv
+check --fast` only reads this file: no configuration file is loaded and no remote
+metadata is fetched. Each point is stored with the date its last backup becomes out of
+date, so the check does not need the `frequency` of the point.
+
+"""
+from __future__ import unicode_literals
+
+import datetime
+import json
+import os
+
+from polyarchiv.points import PointInfo
+from polyarchiv.utils import write_file_atomic
+
+__author__ = "Matthieu Gallet"
+
+STATUS_VERSION = 1
+MIN_DUE_DELAY = datetime.timedelta(days=1)
+MAX_DUE_DELAY = datetime.timedelta(days=3660)
+
+
+def get_due_date(check_out_of_date_backup, last_success):
+    """Return the first date (at one second) when a backup made at `last_success` is
+    out of date, by a binary search on `check_out_of_date_backup`.
+    Return None if the backup is still valid after :data:`MAX_DUE_DELAY`.
+
+    >>> from polyarchiv.utils import get_is_time_elapsed
+    >>> get_due_date(get_is_time_elapsed('daily:4'), datetime.datetime(2016, 6, 15, 12))
+    datetime.datetime(2016, 6, 16, 4, 0)
+    >>> get_due_date(get_is_time_elapsed('3600'), datetime.datetime(2016, 6, 15, 12))
+    datetime.datetime(2016, 6, 15, 13, 0, 1)
+    >>> get_due_date(get_is_time_elapsed('8640000'), datetime.datetime(2016, 6, 15, 12))
+    datetime.datetime(2016, 9, 23, 12, 0, 1)
+    """
+    if last_success is None:
+        return None
+    elif check_out_of_date_backup(last_success, last_success):
+        return last_success
+    low, delay = last_success, MIN_DUE_DELAY
+    while not check_out_of_date_backup(last_success + delay, last_success):
+        if delay >= MAX_DUE_DELAY:
+            return None  # never out of date
+        low, delay = last_success + delay, delay * 2
+    high = last_success + delay
+    while (high - low).total_seconds() > 1:
+        middle = low + datetime.timedelta(seconds=(high - low).total_seconds() // 2)
+        if check_out_of_date_backup(middle, last_success):
+            high = middle
+        else:
+            low = middle
+    return high
+
+
+class StatusIndex(object):
+    """Last state of each point, stored as
+    `{"version": 1, "points": {name: {"last_success": …, "due": …, …}}}`.
+
+    Collect points are named by their name, and backup points by
+    `"collect point name:backup point name"`, like in the messages of the `check`
+    command.
+
+    :param path: absolute path of the JSON index
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        """return the dict {name: status}"""
+        if not os.path.isfile(self.path):
+            return {}
+        with open(self.path, "r") as fd:
+            data = json.load(fd)
+        if data.get("version") != STATUS_VERSION:
+            return {}
+        return data["points"]
+
+    def update(self, points, names=None):
+        """Replace the status of some points and keep the other ones.
+
+        :param points: list of `(name, PointInfo, check_out_of_date_backup)`
+        :param names: if not None, names of all configured points: the other ones are
+          removed from the index
+        """
+        statuses = self.load()
+        if names is not None:
+            statuses = {k: v for (k, v) in statuses.items() if k in names}
+        for name, info, check_out_of_date_backup in points:
+            assert isinstance(info, PointInfo)
+            statuses[name] = {
+                "last_success": PointInfo.datetime_to_str(info.last_success),
+                "last_fail": PointInfo.datetime_to_str(info.last_fail),
+                "last_state_valid": info.last_state_valid,
+                "last_message": info.last_message,
+                "due": PointInfo.datetime_to_str(
+                    get_due_date(check_out_of_date_backup, info.last_success)
+                ),
+            }
+        dirname = os.path.dirname(self.path)
+        if dirname and not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        content = json.dumps({"version": STATUS_VERSION, "points": statuses})
+        write_file_atomic(self.path, content)
+
+    def check(self, now=None):
+        """Check the status of all points, like :class:`polyarchiv.visitors.CheckVisitor`.
+
+        :return: `(return_code, errors)` (return code is 3 if the index is missing)
+        """
+        if not os.path.isfile(self.path):
+            return 3, ["status index %s not found" % self.path]
+        if now is None:
+            now = datetime.datetime.now()
+        return_code, errors = 0, []
+        for name, status in sorted(self.load().items()):
+            due = PointInfo.datetime_from_str(status["due"])
+            last_success = PointInfo.datetime_from_str(status["last_success"])
+            if last_success is None:
+                return_code = 2
+                errors += ["no successful backup of %s" % name]
+            elif due is not None and due <= now:
+                return_code = max(return_code, 1)
+                errors += [
+                    "the last backup of %s is out of date: %s" % (name, last_success)
+                ]
+            if status["last_state_valid"] is False:
+                return_code = 2
+                errors += [
+                    "the last backup of %s has failed. %s"
+                    % (name, status["last_message"])
+                ]
+        return return_code, errors
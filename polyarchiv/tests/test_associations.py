@@ -0,0 +1,95 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import fnmatch
+from unittest import TestCase
+
+from polyarchiv.associations import AssociationIndex, can_associate
+from polyarchiv.backup_points import BackupPoint
+from polyarchiv.collect_points import CollectPoint
+
+
+def fnmatch_associate(collect_point, backup_point):
+    """previous implementation, with nested fnmatch loops"""
+    for tag in collect_point.collect_point_tags:
+        for pattern in backup_point.excluded_collect_point_tags:
+            if fnmatch.fnmatch(tag, pattern):
+                return False
+    for tag in backup_point.backup_point_tags:
+        for pattern in collect_point.excluded_backup_point_tags:
+            if fnmatch.fnmatch(tag, pattern):
+                return False
+    for tag in collect_point.collect_point_tags:
+        for pattern in backup_point.included_collect_point_tags:
+            if fnmatch.fnmatch(tag, pattern):
+                return True
+    for tag in backup_point.backup_point_tags:
+        for pattern in collect_point.included_backup_point_tags:
+            if fnmatch.fnmatch(tag, pattern):
+                return True
+    return False
+
+
+class TestAssociations(TestCase):
+    def test_index(self):
+        collect_points = [
+            CollectPoint("default"),
+            CollectPoint("db", collect_point_tags=["db-mysql", "daily"]),
+            CollectPoint(
+                "private",
+                collect_point_tags=["private"],
+                included_backup_point_tags=[],
+                excluded_backup_point_tags=["offsite*"],
+            ),
+            CollectPoint(
+                "literal",
+                collect_point_tags=["web"],
+                included_backup_point_tags=["offsite-[ab]"],
+            ),
+        ]
+        backup_points = [
+            BackupPoint("default"),
+            BackupPoint(
+                "offsite",
+                backup_point_tags=["offsite-a"],
+                included_collect_point_tags=["db-*", "private"],
+            ),
+            BackupPoint(
+                "local",
+                backup_point_tags=["local"],
+                excluded_collect_point_tags=["d?il[xy]", "web"],
+            ),
+        ]
+        index = AssociationIndex(collect_points, backup_points)
+        expected = {
+            ("default", "default"),
+            ("default", "local"),
+            ("default", "offsite"),
+            ("db", "default"),
+            ("db", "offsite"),
+            ("private", "default"),
+            ("private", "local"),
+            ("literal", "default"),
+            ("literal", "offsite"),
+        }
+        self.assertEqual(expected, index.pairs)
+        for collect_point in collect_points:
+            for backup_point in backup_points:
+                self.assertEqual(
+                    fnmatch_associate(collect_point, backup_point),
+                    can_associate(collect_point, backup_point),
+                )
+        self.assertEqual(
+            ["default", "db", "literal"],
+            [
+                x.name
+                for x in index.filter_collect_points(collect_points, backup_points[1])
+            ],
+        )
+        self.assertEqual(
+            ["default", "offsite"],
+            [
+                x.name
+                for x in index.filter_backup_points(backup_points, collect_points[1])
+            ],
+        )
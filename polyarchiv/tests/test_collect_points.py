@@ -3,16 +3,21 @@ from __future__ import unicode_literals
 
 import os
 import shutil
+import subprocess
+import time
 
 from polyarchiv.collect_points import (
     FileRepository,
     CollectPoint,
     GitRepository,
     ArchiveRepository,
+    SvnRepository,
 )
 from polyarchiv.backup_points import BackupPoint
+from polyarchiv.points import Config
 from polyarchiv.sources import LocalFiles
 from polyarchiv.tests.test_base import FileTestCase
+from polyarchiv.utils import get_is_time_elapsed
 
 
 class TestCollectPoint(FileTestCase):
@@ -64,3 +69,74 @@ class TestArchiveCollectPoint(TestCollectPoint):
             command_display=True,
             command_keep_output=True,
         )
+
+
+class TestGitSettings(FileTestCase):
+    def test_git_settings(self):
+        collect_point = GitRepository(
+            "test_repo",
+            local_path=self.collect_point_path,
+            repack_frequency=get_is_time_elapsed("daily"),
+            config=Config(),
+        )
+        collect_point.variables.update(BackupPoint.constant_format_values)
+        collect_point.ensure_dir(collect_point.metadata_path)
+        collect_point.ensure_dir(collect_point.import_data_path)
+        with open(os.path.join(collect_point.import_data_path, "file.txt"), "w") as fd:
+            fd.write("content")
+        collect_point.post_source_backup()
+        git_config = subprocess.check_output(
+            ["git", "config", "--get", "index.version"],
+            cwd=collect_point.import_data_path,
+        )
+        self.assertEqual(b"4", git_config.strip())
+        repack_path = os.path.join(collect_point.metadata_path, "git-repack")
+        self.assertTrue(os.path.isfile(repack_path))
+        repack_time = int(time.time()) - 60
+        os.utime(repack_path, (repack_time, repack_time))
+        # settings are only written once, the previous repack is recent enough
+        collect_point.post_source_backup()
+        self.assertEqual(repack_time, os.path.getmtime(repack_path))
+
+
+class TestSvnChunks(FileTestCase):
+    def test_commit_chunks(self):
+        # fake "svn status -q" output
+        svn_path = os.path.join(self.empty_dir_path, "svn")
+        with open(svn_path, "w") as fd:
+            fd.write(
+                "#!/bin/sh\n"
+                "echo 'A       new'\n"
+                "echo 'A       new/file.txt'\n"
+                "echo 'D       old'\n"
+                "echo 'D       old/file.txt'\n"
+                "echo 'M       modified.txt'\n"
+                "echo ' M      .'\n"
+            )
+        os.chmod(svn_path, 0o755)
+        commits = []
+
+        class FakeSvnRepository(SvnRepository):
+            def execute_command(self, cmd, *args, **kwargs):
+                with open(cmd[-1]) as fd:
+                    targets = fd.read().splitlines()
+                commits.append(("--depth" in cmd, targets))
+
+        collect_point = FakeSvnRepository(
+            "test_repo",
+            local_path=self.collect_point_path,
+            remote_url="file:///tmp/svn",
+            commit_chunk_size=2,
+            config=Config(svn_executable=svn_path),
+        )
+        collect_point.ensure_dir(collect_point.import_data_path)
+        collect_point.commit_chunks("message")
+        self.assertEqual(
+            [
+                (True, ["new", "new/file.txt"]),
+                (False, ["old"]),
+                (True, ["modified.txt"]),
+                (True, ["."]),
+            ],
+            commits,
+        )
@@ -0,0 +1,102 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+import shutil
+import stat
+import tempfile
+from unittest import TestCase
+
+from polyarchiv.config_cache import ConfigCache
+from polyarchiv.runner import Runner
+
+
+class TestConfigCache(TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp(prefix="config-cache")
+        self.config_file = os.path.join(self.dirname, "test.collect")
+        self.cache_file = os.path.join(self.dirname, "cache", "config.json")
+        self.write_config("[DEFAULT]\nkeep = 1\n[point]\nengine = files\nkeep = 2\n")
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def write_config(self, content):
+        with open(self.config_file, "w") as fd:
+            fd.write(content)
+
+    def get_parser(self):
+        cache = ConfigCache(self.cache_file)
+        parser = cache.get_parser(self.config_file)
+        self.assertTrue(cache.save())
+        return cache, parser
+
+    def test_cache(self):
+        cache, parser = self.get_parser()
+        self.assertTrue(cache.modified is False)
+        self.assertEqual(0o600, stat.S_IMODE(os.stat(self.cache_file).st_mode))
+        self.assertEqual({"keep": "2", "engine": "files"}, dict(parser.items("point")))
+        # the cached content is used
+        cache, parser = self.get_parser()
+        self.assertEqual("2", parser.get("point", "keep"))
+        self.assertEqual({"keep": "1"}, dict(parser.defaults()))
+        self.assertEqual([self.config_file], list(cache.load()))
+        # a modified file is parsed again
+        self.write_config('[point]\nengine = files\n[source "files"]\npath = /tmp\n')
+        cache, parser = self.get_parser()
+        self.assertEqual(["point", 'source "files"'], parser.sections())
+        self.assertFalse(parser.has_option("point", "keep"))
+        # files of other configurations are kept, removed files are forgotten
+        other_file = os.path.join(self.dirname, "other.collect")
+        with open(other_file, "w") as fd:
+            fd.write("[point]\nengine = files\n")
+        cache = ConfigCache(self.cache_file)
+        cache.get_parser(other_file)
+        self.assertTrue(cache.save())
+        self.assertEqual(2, len(ConfigCache(self.cache_file).load()))
+        os.remove(self.config_file)
+        cache = ConfigCache(self.cache_file)
+        self.assertTrue(cache.save())
+        self.assertEqual([other_file], list(ConfigCache(self.cache_file).load()))
+
+    def test_untrusted_cache(self):
+        self.get_parser()
+        self.assertEqual([self.config_file], list(ConfigCache(self.cache_file).load()))
+        # may have been modified by another user
+        os.chmod(self.cache_file, 0o622)
+        self.assertEqual({}, ConfigCache(self.cache_file).load())
+        os.chmod(self.cache_file, 0o600)
+        if os.geteuid() == 0:
+            os.chown(self.cache_file, 1, -1)
+            self.assertEqual({}, ConfigCache(self.cache_file).load())
+        # the cache is written again by the current user
+        cache, parser = self.get_parser()
+        self.assertEqual("2", parser.get("point", "keep"))
+        self.assertEqual(os.geteuid(), os.stat(self.cache_file).st_uid)
+        self.assertEqual([self.config_file], list(ConfigCache(self.cache_file).load()))
+
+    def test_dry_mode(self):
+        for command_execute in (False, True):
+            runner = Runner(
+                [self.dirname],
+                config_cache_file=self.cache_file,
+                command_execute=command_execute,
+                verbosity=0,
+            )
+            runner.load(show_errors=False)
+            self.assertEqual(command_execute, os.path.isfile(self.cache_file))
+
+    def test_confirm_commands(self):
+        runner = Runner(
+            [self.dirname],
+            config_cache_file=self.cache_file,
+            command_confirm=True,
+            verbosity=0,
+        )
+
+        def can_execute_command(text):
+            self.fail("the update of the cache must not be confirmed: %s" % text)
+
+        runner.can_execute_command = can_execute_command
+        runner.load(show_errors=False)
+        self.assertTrue(os.path.isfile(self.cache_file))
@@ -0,0 +1,83 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import codecs
+import json
+import os
+import tempfile
+
+from polyarchiv.filesync import FileSync
+from polyarchiv.tests.test_base import FileTestCase
+
+
+class TestFileSync(FileTestCase):
+    def write(self, *path):
+        with codecs.open(os.path.join(*path), "w", encoding="utf-8") as fd:
+            fd.write("/".join(path[1:]))
+
+    def test_sync(self):
+        src, dst = self.original_dir_path, self.copy_dir_path
+        self.write(src, "folder", "test.pyc")
+        self.write(dst, "obsolete.txt")
+        os.makedirs(os.path.join(dst, "obsolete", "folder"))
+        os.symlink("test.py", os.path.join(src, "link"))
+        os.link(os.path.join(src, "test.py"), os.path.join(src, "folder", "hard"))
+        manifest_path = os.path.join(self.collect_point_path, "manifest.jsonl")
+        FileSync(
+            src,
+            dst,
+            exclude=["*.pyc"],
+            preserve_hard_links=True,
+            threads=2,
+            manifest_path=manifest_path,
+        ).run()
+        self.assertFalse(os.path.exists(os.path.join(dst, "folder", "test.pyc")))
+        self.assertFalse(os.path.exists(os.path.join(dst, "obsolete.txt")))
+        self.assertFalse(os.path.exists(os.path.join(dst, "obsolete")))
+        self.assertEqual("test.py", os.readlink(os.path.join(dst, "link")))
+        self.assertTrue(
+            os.path.samefile(
+                os.path.join(dst, "test.py"), os.path.join(dst, "folder", "hard")
+            )
+        )
+        with open(manifest_path) as fd:
+            paths = {json.loads(line)[0] for line in fd}
+        self.assertEqual(
+            {"test.py", "link", "folder", "folder/hard", "folder/sub_test.py"}, paths
+        )
+        os.remove(os.path.join(src, "folder", "test.pyc"))
+        self.assertEqualPaths(src, dst)
+
+        # excluded files are not removed, modified files are copied
+        self.write(dst, "folder", "test.pyc")
+        self.write(src, "test.py")
+        os.remove(os.path.join(src, "folder", "sub_test.py"))
+        FileSync(src, dst, exclude=["*.pyc"]).run()
+        self.assertTrue(os.path.isfile(os.path.join(dst, "folder", "test.pyc")))
+        self.assertFalse(os.path.exists(os.path.join(dst, "folder", "sub_test.py")))
+        with codecs.open(os.path.join(dst, "test.py"), "r", encoding="utf-8") as fd:
+            self.assertEqual("test.py", fd.read())
+
+    def test_replaced_hard_links(self):
+        src, dst = self.original_dir_path, self.copy_dir_path
+        os.link(os.path.join(src, "test.py"), os.path.join(src, "folder", "hard"))
+        hard_path = os.path.join(dst, "folder", "hard")
+        # a directory, then a dangling symlink, are replaced by the hard link
+        os.makedirs(os.path.join(hard_path, "sub"))
+        self.write(hard_path, "sub", "file.txt")
+        FileSync(src, dst, preserve_hard_links=True).run()
+        self.assertTrue(os.path.samefile(os.path.join(dst, "test.py"), hard_path))
+        os.remove(hard_path)
+        os.symlink("missing", hard_path)
+        FileSync(src, dst, preserve_hard_links=True).run()
+        self.assertTrue(os.path.samefile(os.path.join(dst, "test.py"), hard_path))
+        self.assertEqualPaths(src, dst)
+
+    def test_include(self):
+        dst = tempfile.mkdtemp(prefix="copy-dir")
+        self.temp_data.append(dst)
+        FileSync(
+            self.original_dir_path, dst, exclude=["*.py"], include=["sub_test.py"]
+        ).run()
+        self.assertFalse(os.path.exists(os.path.join(dst, "test.py")))
+        self.assertFalse(os.path.exists(os.path.join(dst, "folder", "sub_test.py")))
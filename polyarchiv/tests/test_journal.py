@@ -0,0 +1,56 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from polyarchiv.journal import ChangeJournal, InotifyWatcher
+
+
+class TestChangeJournal(TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp(prefix="watched-dir")
+        self.metadata_path = tempfile.mkdtemp(prefix="metadata")
+        self.journal = ChangeJournal(os.path.join(self.metadata_path, "journal"))
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+        shutil.rmtree(self.metadata_path)
+
+    def get_pending(self):
+        with open(self.journal.pending_path, "rb") as fd:
+            return set(fd.read().split(b"\0")[:-1])
+
+    def test_journal(self):
+        self.assertFalse(self.journal.take())  # no watcher
+        watcher = InotifyWatcher(self.root, self.journal)
+        watcher.start()
+        try:
+            self.assertTrue(self.journal.is_watched())
+            self.assertFalse(self.journal.take())  # watcher has just been started
+            self.journal.commit(full_scan=True)
+            self.assertTrue(self.journal.take())
+            self.assertFalse(self.journal.has_pending_changes())
+
+            os.makedirs(os.path.join(self.root, "folder"))
+            watcher.read_events()
+            with open(os.path.join(self.root, "folder", "file.txt"), "w") as fd:
+                fd.write("content")
+            watcher.read_events()
+            self.assertTrue(self.journal.take())
+            self.assertEqual({b".", b"folder", b"folder/file.txt"}, self.get_pending())
+            # failed backup: pending paths are kept
+            os.remove(os.path.join(self.root, "folder", "file.txt"))
+            watcher.read_events()
+            self.assertTrue(self.journal.take())
+            self.assertEqual({b".", b"folder", b"folder/file.txt"}, self.get_pending())
+            self.journal.commit()
+            self.assertFalse(self.journal.has_pending_changes())
+
+            self.journal.request_full_scan()
+            self.assertFalse(self.journal.take())
+        finally:
+            watcher.stop()
+        self.assertFalse(self.journal.is_watched())
@@ -0,0 +1,67 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import codecs
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from polyarchiv.backup_points import BackupPoint
+from polyarchiv.collect_points import FileRepository
+from polyarchiv.metadata import MetadataStore, COLLECT_POINT, BACKUP_POINT
+from polyarchiv.points import PointInfo
+
+
+class TestMetadataStore(TestCase):
+    def setUp(self):
+        self.local_path = tempfile.mkdtemp(prefix="collect-point")
+
+    def tearDown(self):
+        shutil.rmtree(self.local_path)
+
+    def test_runs(self):
+        store = MetadataStore(os.path.join(self.local_path, "metadata.sqlite3"))
+        self.assertIsNone(store.get_info(COLLECT_POINT, "test_repo"))
+        self.assertEqual([], store.get_runs(COLLECT_POINT, "test_repo"))
+        for count in range(3):
+            store.add_run(
+                COLLECT_POINT,
+                "test_repo",
+                PointInfo(success_count=count, last_message="run %d" % count),
+            )
+        store.add_run(BACKUP_POINT, "test_repo", PointInfo(fail_count=1))
+        self.assertEqual(2, store.get_info(COLLECT_POINT, "test_repo").success_count)
+        self.assertEqual(1, store.get_info(BACKUP_POINT, "test_repo").fail_count)
+        runs = store.get_runs(COLLECT_POINT, "test_repo", limit=2)
+        self.assertEqual(["run 2", "run 1"], [x[1].last_message for x in runs])
+        self.assertIsInstance(runs[0][0], datetime.datetime)
+
+    def test_migration(self):
+        collect_point = FileRepository("test_repo", local_path=self.local_path)
+        backup_point = BackupPoint("remote")
+        legacy_info = PointInfo(
+            success_count=4, last_success=datetime.datetime(2016, 1, 1)
+        )
+        for path in (
+            os.path.join(collect_point.metadata_path, "test_repo.json"),
+            os.path.join(backup_point.private_path(collect_point), "remote.json"),
+        ):
+            if not os.path.isdir(os.path.dirname(path)):
+                os.makedirs(os.path.dirname(path))
+            with codecs.open(path, "w", encoding="utf-8") as fd:
+                fd.write(legacy_info.to_str())
+        self.assertEqual(4, collect_point.get_info().success_count)
+        self.assertEqual(4, backup_point.get_info(collect_point).success_count)
+        store = collect_point.metadata_store
+        self.assertEqual(1, len(store.get_runs(COLLECT_POINT, "test_repo")))
+        self.assertEqual(1, len(store.get_runs(BACKUP_POINT, "remote")))
+        # JSON files are ignored once imported
+        os.remove(os.path.join(collect_point.metadata_path, "test_repo.json"))
+        info = collect_point.get_info()
+        self.assertEqual(legacy_info.last_success, info.last_success)
+        info.success_count += 1
+        collect_point.set_info(info)
+        self.assertEqual(5, collect_point.get_info().success_count)
+        self.assertEqual(2, len(store.get_runs(COLLECT_POINT, "test_repo")))
@@ -2,11 +2,13 @@
 from __future__ import unicode_literals, print_function
 
 import os
+import subprocess
+import sys
 from unittest import TestCase
 
 from polyarchiv.conf import Parameter
 from polyarchiv.points import ParameterizedObject
-from polyarchiv.runner import Runner
+from polyarchiv.runner import Runner, EngineRegistry
 
 
 class TestEngineParameters(TestCase):
@@ -20,3 +22,47 @@ class TestEngineParameters(TestCase):
                 assert issubclass(engine_cls, ParameterizedObject)
                 for param in engine_cls.parameters:
                     assert isinstance(param, Parameter)
+
+    def test_lazy_engines(self):
+        registry = EngineRegistry()
+        registry.register("Files", lambda: ParameterizedObject)
+        registry.register("broken", lambda: 1 / 0, ignore_errors=True)
+        self.assertEqual(["files", "broken"], list(registry))
+        self.assertIn("broken", registry)
+        self.assertEqual([("files", ParameterizedObject)], registry.items())
+        self.assertNotIn("broken", registry)
+        self.assertIsNone(registry.get("broken"))
+
+    def test_startup_imports(self):
+        root = os.path.dirname(os.path.dirname(os.path.dirname(__file__)))
+        # engine modules are only imported by the configuration that uses them
+        engine_modules = [
+            "backup_points",
+            "collect_points",
+            "filters",
+            "hooks",
+            "journal",
+            "sources",
+            "visitors",
+        ]
+        code = (
+            "import sys\n"
+            "from polyarchiv.cli import main\n"
+            "from polyarchiv.runner import Runner\n"
+            "Runner([])\n"
+            "print(' '.join(sorted(sys.modules)))\n"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=root)
+        modules = output.decode("utf-8").split()
+        for name in engine_modules:
+            self.assertNotIn("polyarchiv.%s" % name, modules)
+        # the vendored requests is only imported by engines that require it
+        code = (
+            "import sys\n"
+            "from polyarchiv.runner import Runner\n"
+            "for engines in Runner.find_available_engines():\n"
+            "    assert engines.items() is not None\n"
+            "print('polyarchiv._vendor.requests' in sys.modules)\n"
+        )
+        output = subprocess.check_output([sys.executable, "-c", code], cwd=root)
+        self.assertEqual(b"False", output.strip())
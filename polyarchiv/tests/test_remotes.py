@@ -14,7 +14,11 @@ from polyarchiv.backup_points import (
     GitRepository,
     TarArchive,
     RollingTarArchive,
+    Restic,
+    PENDING_BACKUP,
 )
+from polyarchiv.points import Config, PointInfo
+from polyarchiv.runner import Runner
 from polyarchiv.sources import LocalFiles
 from polyarchiv.tests.test_base import FileTestCase
 
@@ -116,3 +120,243 @@ class RollingTarArchiveRemoteTestCase(RemoteTestCase):
             command_display=True,
             command_keep_output=False,
         )
+
+
+class BackendCacheTestCase(FileTestCase):
+    def test_cached_backend(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        collect_point.variables.update(BackupPoint.constant_format_values)
+        backup_point = RollingTarArchive(
+            "remote",
+            remote_url="https://example.org/{name}-{Y}-{m}.tar.gz",
+            metadata_url="https://example.org/metadata/",
+            config=Config(),
+        )
+        backend = backup_point._get_backend(collect_point)
+        self.assertIs(backend, backup_point._get_backend(collect_point))
+        metadata_backend = backup_point._get_metadata_backend(collect_point)
+        self.assertIs(
+            metadata_backend, backup_point._get_metadata_backend(collect_point)
+        )
+        self.assertIsNot(backend, metadata_backend)
+        # variables of a previous archive
+        old_backend = backup_point._get_backend(collect_point, variables={"Y": "2015"})
+        self.assertIsNot(backend, old_backend)
+        self.assertEqual(
+            "https://example.org/test_repo-2015-01.tar.gz", old_backend.root_url
+        )
+        # modified variables of the collect point
+        collect_point.variables["m"] = "02"
+        self.assertEqual(
+            "https://example.org/test_repo-2016-02.tar.gz",
+            backup_point._get_backend(collect_point).root_url,
+        )
+        # registered only once
+        self.assertEqual(
+            [backup_point.remote_url], backup_point.metadata_url_requirements
+        )
+
+
+class MetadataBatchTestCase(FileTestCase):
+    def test_metadata_batch(self):
+        metadata_dir = os.path.join(self.empty_dir_path, "metadata")
+        backup_point = TarArchive(
+            "remote",
+            remote_url="file:///backups/{name}.tar.gz",
+            metadata_url="file://%s/" % metadata_dir,
+            config=Config(),
+        )
+        collect_points = [
+            FileRepository(name, local_path=os.path.join(self.collect_point_path, name))
+            for name in ("repo1", "repo2")
+        ]
+        backup_point.begin_metadata_batch()
+        for collect_point in collect_points:
+            backup_point.set_info(collect_point, PointInfo(success_count=3))
+        self.assertFalse(os.path.exists(metadata_dir))
+        backup_point.flush_metadata()
+        self.assertEqual(["repo1.json", "repo2.json"], sorted(os.listdir(metadata_dir)))
+        # uploaded as soon as possible outside a batch
+        backup_point.set_info(collect_points[0], PointInfo(success_count=4))
+        with open(os.path.join(metadata_dir, "repo1.json")) as fd:
+            self.assertEqual(4, PointInfo.from_str(fd.read()).success_count)
+
+        # local states are lost: fetched again
+        for collect_point in collect_points:
+            os.remove(collect_point.metadata_store.path)
+            os.remove(backup_point.metadata_file_path(collect_point))
+        backup_point.prefetch_metadata(collect_points)
+        self.assertEqual(4, backup_point.get_info(collect_points[0]).success_count)
+        self.assertEqual(3, backup_point.get_info(collect_points[1]).success_count)
+
+    def test_failed_flush(self):
+        class FailingArchive(TarArchive):
+            def do_backup(self, collect_point, export_data_path, info):
+                return True
+
+            def flush_backups(self):
+                raise ValueError("flush")
+
+        metadata_dir = os.path.join(self.empty_dir_path, "metadata")
+        config = Config()
+        runner = Runner([], config=config, verbosity=0)
+        runner.collect_points["repo1"] = FileRepository(
+            "repo1", local_path=self.collect_point_path, config=config
+        )
+        runner.backup_points["remote"] = FailingArchive(
+            "remote",
+            remote_url="file:///backups/{name}.tar.gz",
+            metadata_url="file://%s/" % metadata_dir,
+            config=config,
+        )
+        self.assertRaises(ValueError, runner.backup, skip_collect=True)
+        self.assertEqual(["repo1.json"], os.listdir(metadata_dir))
+
+
+class GitLargeFilesTestCase(FileTestCase):
+    def test_large_files(self):
+        remote_storage_dir, large_files_dir = RemoteTestCase.get_storage_dirs()
+        self.temp_data += [remote_storage_dir, large_files_dir]
+        subprocess.check_call(
+            ["git", "init", "-q", "--bare", "%s/project.git" % remote_storage_dir]
+        )
+        config = Config()
+        collect_point = FileRepository(
+            "test_repo", local_path=self.collect_point_path, config=config
+        )
+        collect_point.variables.update(BackupPoint.constant_format_values)
+        backup_point = GitRepository(
+            "remote",
+            remote_url="file://%s/project.git" % remote_storage_dir,
+            large_file_threshold=1024,
+            large_files_url="file://%s/" % large_files_dir,
+            pack_threads=1,
+            config=config,
+        )
+        os.makedirs(os.path.join(backup_point.private_path(collect_point)))
+        with open(os.path.join(self.original_dir_path, "small.txt"), "w") as fd:
+            fd.write("small")
+        backup_point.do_backup(collect_point, self.original_dir_path, PointInfo())
+        tracked = subprocess.check_output(
+            ["git", "--git-dir", "%s/project.git" % remote_storage_dir]
+            + ["ls-tree", "-r", "--name-only", "master"]
+        )
+        self.assertEqual(
+            [b".polyarchiv-large-files.json", b"small.txt"], tracked.split()
+        )
+        # test.py and folder/sub_test.py have the same content
+        self.assertEqual(1, len(os.listdir(large_files_dir)))
+        shutil.rmtree(self.copy_dir_path)
+        backup_point.do_restore(collect_point, self.copy_dir_path)
+        os.remove(os.path.join(self.copy_dir_path, ".git"))
+        self.assertEqualPaths(self.original_dir_path, self.copy_dir_path)
+
+
+class ResticTestCase(FileTestCase):
+    def test_backup(self):
+        # fake restic executable, recording its arguments
+        restic_path = os.path.join(self.empty_dir_path, "restic")
+        args_path = os.path.join(self.empty_dir_path, "args.txt")
+        with open(restic_path, "w") as fd:
+            fd.write(
+                "#!/bin/sh\n"
+                'echo "$@" >> %s\n'
+                'echo \'{"message_type":"summary","files_new":3,"data_added":12,'
+                '"snapshot_id":"0123abcd"}\'\n' % args_path
+            )
+        os.chmod(restic_path, 0o755)
+        config = Config(restic_executable=restic_path)
+        collect_point = FileRepository(
+            "test_repo", local_path=self.collect_point_path, config=config
+        )
+        backup_point = Restic(
+            "restic",
+            remote_url="/tmp/restic-repository",
+            password="password",
+            compression="max",
+            daily_count=7,
+            cache_dir=os.path.join(self.empty_dir_path, "cache"),
+            config=config,
+        )
+        info = PointInfo()
+        backup_point.do_backup(collect_point, self.original_dir_path, info)
+        self.assertEqual("0123abcd", info.data["snapshot_id"])
+        self.assertEqual(3, info.data["summary"]["files_new"])
+        backup_point.do_backup(collect_point, self.original_dir_path, info)
+        with open(args_path) as fd:
+            commands = [line.split() for line in fd]
+        self.assertEqual(4, len(commands))
+        self.assertIn("max", commands[0])
+        self.assertNotIn("--parent", commands[0])
+        self.assertEqual(["forget", "--keep-daily", "7", "--prune"], commands[1][2:])
+        self.assertIn("0123abcd", commands[2])
+
+    def test_single_snapshot(self):
+        restic_path = os.path.join(self.empty_dir_path, "restic")
+        args_path = os.path.join(self.empty_dir_path, "args.txt")
+        with open(restic_path, "w") as fd:
+            fd.write(
+                "#!/bin/sh\n"
+                'echo "$@" >> %s\n'
+                'echo \'{"message_type":"summary","snapshot_id":"0123abcd"}\'\n'
+                % args_path
+            )
+        os.chmod(restic_path, 0o755)
+        config = Config(restic_executable=restic_path)
+        cache_dir = os.path.join(self.empty_dir_path, "cache")
+        backup_point = Restic(
+            "restic",
+            remote_url="/tmp/restic-repository",
+            password="password",
+            cache_dir=cache_dir,
+            single_snapshot=True,
+            config=config,
+        )
+        collect_points = []
+        for name in ("repo1", "repo2"):
+            collect_point = FileRepository(
+                name,
+                local_path=os.path.join(self.collect_point_path, name),
+                config=config,
+            )
+            collect_point.variables.update(BackupPoint.constant_format_values)
+            os.makedirs(collect_point.export_data_path)
+            self.assertEqual(
+                PENDING_BACKUP, backup_point.backup(collect_point, force=True)
+            )
+            self.assertIsNone(backup_point.get_info(collect_point).last_success)
+            collect_points.append(collect_point)
+        self.assertFalse(os.path.exists(args_path))
+        self.assertEqual({"repo1": True, "repo2": True}, backup_point.flush_backups())
+        with open(args_path) as fd:
+            commands = [line.split() for line in fd]
+        self.assertEqual(1, len(commands))
+        self.assertEqual(["--tag", "repo1", "--tag", "repo2"], commands[0][5:9])
+        self.assertEqual([x.export_data_path for x in collect_points], commands[0][9:])
+        for collect_point in collect_points:
+            info = backup_point.get_info(collect_point)
+            self.assertEqual("0123abcd", info.data["snapshot_id"])
+            self.assertEqual(1, info.success_count)
+            self.assertIsNotNone(info.last_success)
+        self.assertTrue(os.path.isfile(os.path.join(cache_dir, "polyarchiv.lock")))
+        # only the folder of this collect point is restored
+        path = collect_points[1].export_data_path
+        backup_point.do_restore(collect_points[1], path)
+        with open(args_path) as fd:
+            restore_args = fd.readlines()[-1].split()
+        self.assertEqual(
+            ["restore", "latest:%s" % path, "--path", path, "--target", path],
+            restore_args[2:8],
+        )
+        self.assertEqual(["--tag", "repo2"], restore_args[8:])
+        # a failed snapshot is not registered as a successful backup
+        with open(restic_path, "w") as fd:
+            fd.write("#!/bin/sh\nexit 1\n")
+        collect_point = collect_points[0]
+        last_success = backup_point.get_info(collect_point).last_success
+        self.assertEqual(PENDING_BACKUP, backup_point.backup(collect_point, force=True))
+        self.assertEqual({"repo1": False}, backup_point.flush_backups())
+        info = backup_point.get_info(collect_point)
+        self.assertEqual((1, 1), (info.success_count, info.fail_count))
+        self.assertEqual(last_success, info.last_success)
+        self.assertFalse(info.last_state_valid)
@@ -0,0 +1,122 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import datetime
+import random
+import shutil
+import tempfile
+from collections import OrderedDict
+from unittest import TestCase
+
+from polyarchiv.backup_points import RollingTarArchive
+from polyarchiv.collect_points import FileRepository
+from polyarchiv.retention import (
+    ArchiveHistory,
+    datetime_to_timestamp,
+    time_variables,
+    timestamp_to_datetime,
+)
+
+
+class TestRetention(TestCase):
+    def test_plan(self):
+        backup_point = RollingTarArchive(
+            "archive", hourly_count=12, daily_count=10, weekly_count=4, yearly_count=2
+        )
+        now = datetime.datetime(2020, 6, 1, 12, 0, 0)
+        random.seed(42)
+        history = ArchiveHistory()
+        for __ in range(2000):
+            timestamp = datetime_to_timestamp(now) - random.randint(0, 1000 * 86400)
+            variables = time_variables(timestamp)
+            variables["hostname"] = "localhost"
+            history.add(variables)
+        to_keep, to_remove = backup_point.plan_retention(history, now=now)
+        self.assertEqual(sorted(history.timestamps), sorted(to_keep + to_remove))
+
+        # same result as the previous implementation
+        times = OrderedDict(
+            (timestamp_to_datetime(x), False) for x in reversed(history.timestamps)
+        )
+        for interval, count in (
+            (datetime.timedelta(hours=1), 12),
+            (datetime.timedelta(days=1), 10),
+            (datetime.timedelta(days=7), 4),
+            (datetime.timedelta(days=365), 2),
+        ):
+            times = RollingTarArchive.set_accepted_times(
+                interval, times, not_before_time=now - interval * count
+            )
+        expected = sorted(datetime_to_timestamp(d) for (d, v) in times.items() if v)
+        self.assertEqual(expected, to_keep)
+
+    def test_history_format(self):
+        old_data = [
+            {"Y": "2016", "m": "01", "d": "02", "H": "03", "M": "04", "S": "05"},
+            {"Y": "2016", "m": "01", "d": "01", "H": "03", "M": "04", "S": "05"},
+        ]
+        for variables in old_data:
+            variables["hostname"] = "localhost"
+        history = ArchiveHistory.from_data(old_data)
+        data = history.to_data()
+        self.assertEqual(2, data["version"])
+        self.assertEqual([{"hostname": "localhost"}], data["variables"])
+        history = ArchiveHistory.from_data(data)
+        variables = history.get_variables(history.timestamps[-1])
+        for key, value in old_data[0].items():
+            self.assertEqual(value, variables[key])
+
+    def test_sub_second_variables(self):
+        variables = time_variables(datetime_to_timestamp(datetime.datetime(2016, 1, 1)))
+        variables.update({"f": "123456", "hostname": "localhost"})
+        history = ArchiveHistory()
+        timestamp = history.add(variables)
+        self.assertEqual(
+            [{"f": "123456", "hostname": "localhost"}], history.to_data()["variables"]
+        )
+        history = ArchiveHistory.from_data(history.to_data())
+        self.assertEqual(variables, history.get_variables(timestamp))
+
+    def test_prune(self):
+        removed = []
+
+        class FakeBackend(object):
+            def __init__(self, remote_url):
+                self.remote_url = remote_url
+
+            def delete_on_distant(self):
+                if self.remote_url.endswith("02.tar.gz"):
+                    raise ValueError("unable to remove %s" % self.remote_url)
+                removed.append(self.remote_url)
+
+        class FakeRollingTarArchive(RollingTarArchive):
+            def _get_backend(self, collect_point, variables=None):
+                remote_url = self.format_value(
+                    self.remote_url, collect_point, extra_variables=variables
+                )
+                return FakeBackend(remote_url)
+
+        local_path = tempfile.mkdtemp(prefix="collect-point")
+        self.addCleanup(shutil.rmtree, local_path)
+        collect_point = FileRepository("test_repo", local_path=local_path)
+        collect_point.variables = {"name": "test_repo"}
+        backup_point = FakeRollingTarArchive(
+            "archive", remote_url="file:///backups/{name}-{d}.tar.gz", prune_threads=2
+        )
+        history = ArchiveHistory()
+        timestamps = [
+            history.add(time_variables(datetime_to_timestamp(x)))
+            for x in (datetime.datetime(2016, 1, d) for d in (1, 2, 3))
+        ]
+        backup_point.prune(collect_point, history, timestamps)
+        self.assertEqual(
+            [
+                "file:///backups/test_repo-01.tar.gz",
+                "file:///backups/test_repo-03.tar.gz",
+            ],
+            sorted(removed),
+        )
+        self.assertEqual({"name": "test_repo"}, collect_point.variables)
+        # the failed deletion is kept in the history, to be retried
+        self.assertEqual([timestamps[1]], history.timestamps)
+        self.assertEqual([timestamps[1]], list(history.errors))
@@ -0,0 +1,53 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import codecs
+import os
+
+from polyarchiv.collect_points import FileRepository
+from polyarchiv.snapshots import FakeSnapshot
+from polyarchiv.tests.test_base import FileTestCase
+
+
+class TestFakeSnapshot(FileTestCase):
+    def test_fake_snapshot(self):
+        collect_point = FileRepository(
+            "test_repo", local_path=self.collect_point_path, verbosity=0
+        )
+        snapshot = FakeSnapshot(self.original_dir_path, collect_point, name="test")
+        with snapshot as snapshot_path:
+            self.assertEqualPaths(self.original_dir_path, snapshot_path)
+            with codecs.open(
+                os.path.join(self.original_dir_path, "test.py"), "w", encoding="utf-8"
+            ) as fd:
+                fd.write("modified after the snapshot")
+            os.remove(os.path.join(self.original_dir_path, "folder", "sub_test.py"))
+            self.assertTrue(os.path.isfile(os.path.join(snapshot_path, "test.py")))
+            self.assertTrue(
+                os.path.isfile(os.path.join(snapshot_path, "folder", "sub_test.py"))
+            )
+        self.assertFalse(os.path.exists(snapshot_path))
+
+    def test_dry_mode(self):
+        collect_point = FileRepository(
+            "test_repo",
+            local_path=self.collect_point_path,
+            verbosity=0,
+            command_execute=False,
+        )
+        snapshot = FakeSnapshot(self.original_dir_path, collect_point, name="test")
+        with snapshot as snapshot_path:
+            self.assertEqual(self.original_dir_path, snapshot_path)
+
+    def test_failed_create(self):
+        collect_point = FileRepository(
+            "test_repo", local_path=self.collect_point_path, verbosity=0
+        )
+        missing_path = os.path.join(self.original_dir_path, "missing")
+        snapshot = FakeSnapshot(missing_path, collect_point, name="test")
+        self.assertRaises(OSError, snapshot.create)
+        tmp_path = os.path.dirname(snapshot.snapshot_path)
+        self.assertTrue(os.path.isdir(tmp_path))
+        snapshot.release()
+        snapshot.release()
+        self.assertFalse(os.path.exists(tmp_path))
@@ -2,13 +2,29 @@
 from __future__ import unicode_literals
 
 import codecs
+import gzip
+import hashlib
 import io
 import logging.config
 import os
 import shutil
+import threading
 
 from polyarchiv.collect_points import FileRepository
-from polyarchiv.sources import LocalFiles, PostgresSQL, MySQL, Ldap, RemoteFiles
+from polyarchiv.journal import InotifyWatcher
+from polyarchiv.points import Config
+from polyarchiv.sources import (
+    Dovecot,
+    LocalFiles,
+    PostgresSQL,
+    PostgresWAL,
+    MySQL,
+    MySQLBinlog,
+    Ldap,
+    RemoteFiles,
+    split_mysql_dump,
+    read_mysql_binlog_position,
+)
 from polyarchiv.tests.test_base import FileTestCase
 
 __author__ = "Matthieu Gallet"
@@ -223,3 +239,496 @@ class TestSources(FileTestCase):
         with codecs.open(dst_path, "r", encoding="latin1") as fd:
             lines = [line.strip() for line in fd if valid(line.strip())]
         return "\n".join(lines)
+
+
+class TestLocalFilesJournal(FileTestCase):
+    def test_removed_folder(self):
+        collect_point = FileRepository(
+            "test_repo", local_path=self.collect_point_path, config=Config()
+        )
+        source = LocalFiles(
+            "local_files",
+            collect_point,
+            destination_path="local_files",
+            source_path=self.original_dir_path,
+            config=Config(),
+            use_journal=True,
+        )
+        destination = os.path.join(collect_point.export_data_path, "local_files")
+        watcher = InotifyWatcher(self.original_dir_path, source.journal)
+        watcher.start()
+        try:
+            source.backup()  # full scan: the watcher has just been started
+            self.assertTrue(os.path.isdir(os.path.join(destination, "folder")))
+            shutil.rmtree(os.path.join(self.original_dir_path, "folder"))
+            watcher.read_events()
+            source.backup()
+        finally:
+            watcher.stop()
+        self.assertFalse(os.path.exists(os.path.join(destination, "folder")))
+        self.assertEqualPaths(self.original_dir_path, destination)
+
+
+class TestRemoteFilesUrls(FileTestCase):
+    def test_source_urls(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        source = RemoteFiles(
+            "remote_files",
+            collect_point,
+            destination_path="remote_files",
+            source_url="ssh://backup@server/etc/",
+        )
+        self.assertEqual({"": "ssh://backup@server/etc/"}, source.get_source_urls())
+        inventory = os.path.join(self.collect_point_path, "hosts.txt")
+        with io.open(inventory, "w", encoding="utf-8") as fd:
+            fd.write("# comment\nserver1\n\nserver2\n")
+        source = RemoteFiles(
+            "remote_files",
+            collect_point,
+            destination_path="remote_files",
+            source_url="ssh://backup@{host}/etc/ ssh://backup@{host}/var/www/ "
+            "%s/*" % self.original_dir_path,
+            inventory=inventory,
+            concurrency=["ssh:8", "2"],
+        )
+        self.assertEqual({"": 2, "ssh": 8}, source.concurrency)
+        self.assertEqual(
+            {
+                "server1-etc": "ssh://backup@server1/etc/",
+                "server1-var_www": "ssh://backup@server1/var/www/",
+                "server2-etc": "ssh://backup@server2/etc/",
+                "server2-var_www": "ssh://backup@server2/var/www/",
+                "folder": os.path.join(self.original_dir_path, "folder"),
+                "test.py": os.path.join(self.original_dir_path, "test.py"),
+            },
+            source.get_source_urls(),
+        )
+
+
+class TestSplitMySQLDump(FileTestCase):
+    def test_split(self):
+        dump = (
+            b"-- MySQL dump\n/*!40101 SET NAMES utf8 */;\n--\n"
+            b"-- Table structure for table `table1`\n--\nCREATE TABLE `table1`;\n"
+            b"INSERT INTO `table1` VALUES (1);\n--\n"
+            b"-- Table structure for table `table2`\n--\nCREATE TABLE `table2`;\n"
+            b"-- Dump completed\n"
+        )
+        started = threading.Event()
+        split_mysql_dump(io.BytesIO(dump), self.copy_dir_path, started)
+        self.assertTrue(started.is_set())
+        self.assertEqual(
+            ["table1.sql", "table2.sql"], sorted(os.listdir(self.copy_dir_path))
+        )
+        with open(os.path.join(self.copy_dir_path, "table1.sql"), "rb") as fd:
+            self.assertEqual(
+                b"-- MySQL dump\n/*!40101 SET NAMES utf8 */;\n--\n"
+                b"-- Table structure for table `table1`\n--\nCREATE TABLE `table1`;\n"
+                b"INSERT INTO `table1` VALUES (1);\n--\n",
+                fd.read(),
+            )
+
+
+class TestSkipUnchanged(FileTestCase):
+    def test_skip_unchanged(self):
+        dumps = []
+
+        class FakeMySQL(MySQL):
+            marker = "1"
+
+            def get_change_marker(self):
+                return self.marker
+
+            def backup_file(self):
+                dumps.append(self.marker)
+                path = os.path.join(
+                    self.collect_point.import_data_path, self.destination_path
+                )
+                self.ensure_dir(path, parent=True)
+                open(path, "w").close()
+
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        source = FakeMySQL(
+            "mysql", collect_point, database="testdb", skip_unchanged="binlog"
+        )
+        source.backup()
+        source.backup()
+        self.assertEqual(["1"], dumps)
+        source.marker = "2"
+        source.backup()
+        self.assertEqual(["1", "2"], dumps)
+        os.remove(os.path.join(collect_point.import_data_path, "mysql_dump.sql"))
+        source.backup()
+        self.assertEqual(["1", "2", "2"], dumps)
+        # modifications cannot be detected: always dump
+        source.marker = None
+        source.backup()
+        source.backup()
+        self.assertEqual(["1", "2", "2", None, None], dumps)
+
+    def test_unknown_change_marker(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        source = MySQL("mysql", collect_point, database="testdb")
+        outputs = {}
+        source.run_query = lambda query: outputs[query.split()[0]]
+        source.get_tables = lambda: [("table1", "BASE TABLE", "InnoDB", 0)]
+        outputs["SHOW"] = ""
+        source.skip_unchanged = "binlog"
+        self.assertIsNone(source.get_change_marker())
+        outputs["SHOW"] = "mysql-bin.000012\t154\t\t\n"
+        self.assertIsNotNone(source.get_change_marker())
+        source.skip_unchanged = "update_time"
+        outputs["SELECT"] = "table1\t2016-06-15 12:00:00\tNULL\n"
+        self.assertIsNone(source.get_change_marker())
+        source.skip_unchanged = "checksum"
+        outputs["CHECKSUM"] = "testdb.table1\tNULL\n"
+        self.assertIsNone(source.get_change_marker())
+        outputs["CHECKSUM"] = "testdb.table1\t1234\n"
+        self.assertIsNotNone(source.get_change_marker())
+
+
+class TestMySQLBinlog(FileTestCase):
+    def test_replays(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        mysql = MySQL("mysql", collect_point, database="testdb")
+        other_db = MySQL("other_db", collect_point, database="otherdb")
+        other_mysql = MySQL("other", collect_point, database="testdb", port="3307")
+        binlog = MySQLBinlog("binlog", collect_point)
+        for source in (mysql, other_db, other_mysql, binlog):
+            collect_point.add_source(source)
+        self.assertTrue(mysql.has_binlog_source())
+        self.assertFalse(other_mysql.has_binlog_source())
+        # start of the replays unknown
+        self.assertRaises(ValueError, binlog.get_replays)
+        mysql.info_data["binlog_position"] = ["mysql-bin.000012", 154]
+        other_db.info_data["dump_time"] = "2016-06-15T12:30:30"
+        other_mysql.info_data["binlog_position"] = ["mysql-bin.000001", 4]
+        self.assertEqual(
+            [
+                ("mysql-bin.000012", ["--start-position=154"], "testdb"),
+                (None, ["--start-datetime=2016-06-15 12:30:30"], "otherdb"),
+            ],
+            binlog.get_replays(),
+        )
+        binlog.restore_start_datetime = "2016-06-14 00:00:00"
+        self.assertEqual(
+            [(None, ["--start-datetime=2016-06-14 00:00:00"], None)],
+            binlog.get_replays(),
+        )
+
+    def test_restore(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        mysql = MySQL("mysql", collect_point, database="testdb")
+        binlog = MySQLBinlog("binlog", collect_point)
+        for source in (mysql, binlog):
+            collect_point.add_source(source)
+        dirname = os.path.join(collect_point.import_data_path, "mysql_binlog")
+        os.makedirs(dirname)
+        for name in ("mysql-bin.000011", "mysql-bin.000012", "mysql-bin.000013"):
+            open(os.path.join(dirname, name), "w").close()
+        mysql.info_data["binlog_position"] = ["mysql-bin.000012", 154]
+        commands = []
+        binlog.replay = commands.append
+        binlog.restore()
+        self.assertEqual(
+            [
+                [
+                    "mysqlbinlog",
+                    "--start-position=154",
+                    "--database=testdb",
+                    os.path.join(dirname, "mysql-bin.000012"),
+                    os.path.join(dirname, "mysql-bin.000013"),
+                ]
+            ],
+            commands,
+        )
+
+    def test_restore_errors(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        binlog = MySQLBinlog("binlog", collect_point)
+        collect_point.add_source(binlog)
+        dirname = os.path.join(collect_point.import_data_path, "mysql_binlog")
+        os.makedirs(dirname)
+        for name in ("mysql-bin.000013", "mysql-bin.000014"):
+            open(os.path.join(dirname, name), "w").close()
+        commands = []
+        binlog.replay = commands.append
+        # no dump of the server
+        self.assertRaises(ValueError, binlog.restore)
+        mysql = MySQL("mysql", collect_point, database="testdb")
+        collect_point.sources.insert(0, mysql)
+        # no recorded position
+        self.assertRaises(ValueError, binlog.restore)
+        # the first binary log of the dump has been purged
+        mysql.info_data["binlog_position"] = ["mysql-bin.000012", 154]
+        self.assertRaises(ValueError, binlog.restore)
+        self.assertEqual([], commands)
+        binlog.restore_start_datetime = "2016-06-14 00:00:00"
+        binlog.restore()
+        self.assertEqual(
+            [
+                [
+                    "mysqlbinlog",
+                    "--start-datetime=2016-06-14 00:00:00",
+                    os.path.join(dirname, "mysql-bin.000013"),
+                    os.path.join(dirname, "mysql-bin.000014"),
+                ]
+            ],
+            commands,
+        )
+
+    def test_dump_options(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        mysql = MySQL("mysql", collect_point, database="testdb")
+        mysql.get_tables = lambda: [("table1", "BASE TABLE", "MyISAM", 0)]
+        collect_point.add_source(mysql)
+        self.assertEqual([], mysql.get_dump_options())
+        collect_point.add_source(MySQLBinlog("binlog", collect_point))
+        # no global read lock held during the whole dump
+        self.assertEqual(
+            ["--master-data=2", "--single-transaction", "--quick"],
+            mysql.get_dump_options(),
+        )
+        mysql.lock_strategy = "auto"
+        self.assertEqual(
+            ["--master-data=2", "--lock-all-tables", "--quick"],
+            mysql.get_dump_options(),
+        )
+
+    def test_dump_position(self):
+        dump = (
+            b"-- MySQL dump\n--\n"
+            b"-- CHANGE MASTER TO MASTER_LOG_FILE='mysql-bin.000012', "
+            b"MASTER_LOG_POS=154;\n"
+        )
+        self.assertEqual(
+            ["mysql-bin.000012", 154], read_mysql_binlog_position(io.BytesIO(dump))
+        )
+        self.assertIsNone(read_mysql_binlog_position(io.BytesIO(b"-- MySQL dump\n")))
+
+
+class TestPostgresWAL(FileTestCase):
+    def test_backup(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        source = PostgresWAL("wal", collect_point)
+        dirname = os.path.join(collect_point.import_data_path, "postgresql_wal")
+        wal_dirname = os.path.join(dirname, "wal")
+        commands = []
+
+        def execute_command(cmd, **kwargs):
+            commands.append(cmd)
+            for arg in cmd:
+                if arg.startswith("--pgdata="):
+                    os.makedirs(arg.partition("=")[2])
+
+        source.execute_command = execute_command
+        queries = {
+            "SELECT pg_current_wal_lsn()": "0/3000060\n",
+            "SELECT pg_walfile_name(pg_current_wal_lsn())": (
+                "000000010000000000000003\n"
+            ),
+        }
+        source.run_query = queries.get
+        os.makedirs(wal_dirname)
+        for name in (
+            "000000010000000000000002",
+            "000000010000000000000003",
+            "000000010000000000000004.partial",
+        ):
+            open(os.path.join(wal_dirname, name), "w").close()
+        source.backup()
+        self.assertEqual(
+            [
+                ["pg_receivewal", "--host=localhost", "--port=5432"]
+                + ["--slot=polyarchiv", "--create-slot", "--if-not-exists"],
+                [
+                    "pg_basebackup",
+                    "--host=localhost",
+                    "--port=5432",
+                    "--pgdata=%s" % os.path.join(dirname, "base.new"),
+                    "--format=tar",
+                    "--gzip",
+                    "--wal-method=none",
+                    "--checkpoint=fast",
+                ],
+                [
+                    "pg_receivewal",
+                    "--host=localhost",
+                    "--port=5432",
+                    "--slot=polyarchiv",
+                    "--directory=%s" % wal_dirname,
+                    "--endpos=0/3000060",
+                    "--no-loop",
+                ],
+            ],
+            commands,
+        )
+        self.assertTrue(os.path.isdir(os.path.join(dirname, "base")))
+        # older WAL files are useless with the new base backup
+        self.assertEqual(
+            ["000000010000000000000003", "000000010000000000000004.partial"],
+            sorted(os.listdir(wal_dirname)),
+        )
+        self.assertEqual("0/3000060", source.info_data["last_lsn"])
+        # the base backup is still valid
+        del commands[:]
+        source.backup()
+        self.assertEqual(2, len(commands))
+        self.assertNotIn("pg_basebackup", [x[0] for x in commands])
+
+    def test_restore(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        data_directory = os.path.join(self.empty_dir_path, "data")
+        source = PostgresWAL(
+            "wal",
+            collect_point,
+            recovery_target_time="2016-06-15 12:00:00",
+        )
+        dirname = os.path.join(collect_point.import_data_path, "postgresql_wal")
+        wal_dirname = os.path.join(dirname, "wal")
+        base_filename = os.path.join(dirname, "base", "base.tar.gz")
+        commands = []
+        contents = []
+
+        def execute_command(cmd, stdin=None, **kwargs):
+            commands.append(cmd)
+            if stdin is not None:
+                contents.append(stdin.read().decode("utf-8"))
+
+        source.execute_command = execute_command
+        # nothing to restore
+        source.restore()
+        self.assertEqual([], commands)
+        os.makedirs(os.path.dirname(base_filename))
+        open(base_filename, "w").close()
+        self.assertRaises(ValueError, source.restore)
+        source.data_directory = data_directory
+        source.restore()
+        self.assertEqual(
+            [
+                ["mkdir", "-p", data_directory],
+                ["tar", "-xzf", base_filename, "-C", data_directory],
+                ["tee", "-a", os.path.join(data_directory, "postgresql.auto.conf")],
+                ["touch", os.path.join(data_directory, "recovery.signal")],
+            ],
+            commands,
+        )
+        wal_path = os.path.join(wal_dirname, "%f")
+        self.assertEqual(
+            [
+                "restore_command = 'cp %s %%p || cp %s.partial %%p'\n"
+                "recovery_target_time = '2016-06-15 12:00:00'\n"
+                "recovery_target_action = 'promote'\n" % (wal_path, wal_path)
+            ],
+            contents,
+        )
+
+
+class TestLdap(FileTestCase):
+    def test_compressed_dump(self):
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        # "echo -n 1" replaces "slapcat -n 1"
+        source = Ldap("ldap", collect_point, dump_executable="echo", compression="gzip")
+        source.backup()
+        filename = os.path.join(collect_point.import_data_path, "ldap.ldif.gz")
+        with gzip.open(filename, "rb") as fd:
+            self.assertEqual(b"1", fd.read())
+        self.assertEqual(hashlib.sha256(b"1").hexdigest(), source.info_data["sha256"])
+        self.assertEqual(source.info_data["sha256"], source.get_checksum(filename))
+
+    def test_tool_threads(self):
+        database_folder = os.path.join(self.empty_dir_path, "ldap")
+        os.makedirs(database_folder)
+        config = (
+            "dn: cn=config\nobjectClass: olcGlobal\ncn: config\nolcToolThreads: 1\n\n"
+            "dn: olcDatabase={1}mdb,cn=config\nobjectClass: olcDatabaseConfig\n"
+            "olcDatabase: {1}mdb\nolcDbDirectory: %s\n" % database_folder
+        )
+        # replaces "slapcat -n 0"
+        slapcat = os.path.join(self.empty_dir_path, "slapcat")
+        with open(slapcat, "w") as fd:
+            fd.write("#!/bin/sh\ncat <<'EOF'\n%sEOF\n" % config)
+        os.chmod(slapcat, 0o755)
+        commands = []
+
+        class FakeLdap(Ldap):
+            def execute_command(self, cmd, stdin=None, **kwargs):
+                if stdin is not None:
+                    cmd = cmd + [stdin.read().decode("utf-8")]
+                commands.append(cmd)
+
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        source = FakeLdap("ldap", collect_point, dump_executable=slapcat)
+        self.assertEqual("1", source.get_tool_threads(io.BytesIO(config.encode())))
+        filename = os.path.join(collect_point.import_data_path, "ldap.ldif")
+        os.makedirs(os.path.dirname(filename))
+        open(filename, "w").close()
+        source.tool_threads = 4
+        source.restore()
+        modifications = [x[-1] for x in commands if x[0] == "slapmodify"]
+        self.assertEqual(
+            [
+                "dn: cn=config\nchangetype: modify\nreplace: olcToolThreads\n"
+                "olcToolThreads: 4\n",
+                "dn: cn=config\nchangetype: modify\nreplace: olcToolThreads\n"
+                "olcToolThreads: 1\n",
+            ],
+            modifications,
+        )
+        # the import is made with the new value
+        self.assertEqual(
+            ["service", "rm", "mkdir", "slapmodify", "slapadd", "slapmodify"]
+            + ["chown", "service"],
+            [x[0] for x in commands],
+        )
+        self.assertEqual(["slapadd", "-n", "1", "-l", filename], commands[4])
+        # the option was not set before the restore
+        del commands[:]
+        source.set_tool_threads([], None)
+        self.assertEqual(
+            "dn: cn=config\nchangetype: modify\ndelete: olcToolThreads\n",
+            commands[0][-1],
+        )
+
+
+class TestDovecot(FileTestCase):
+    def test_parallel_users(self):
+        commands = []
+
+        class FakeDovecot(Dovecot):
+            markers = {"alice": "1", "bob": "1"}
+
+            def get_users(self):
+                return sorted(self.markers)
+
+            def get_user_marker(self, user):
+                return self.markers[user]
+
+            def execute_command(self, cmd, *args, **kwargs):
+                commands.append(cmd[-2])
+                if cmd[-2] == "carol":
+                    raise ValueError("unable to backup carol")
+                self.ensure_dir(cmd[-1])
+
+        collect_point = FileRepository("test_repo", local_path=self.collect_point_path)
+        source = FakeDovecot(
+            "dovecot", collect_point, parallel_users=2, skip_unchanged=True
+        )
+        source.backup()
+        self.assertEqual(["alice", "bob"], sorted(commands))
+        del commands[:]
+        source.markers["bob"] = "2"
+        source.backup()
+        self.assertEqual(["bob"], commands)
+        del commands[:]
+        source.markers["carol"] = "1"
+        self.assertRaises(ValueError, source.backup)
+        self.assertEqual(["carol"], commands)
+        self.assertEqual({"alice": "1", "bob": "2"}, source.info_data["users"])
+        # removed users
+        del source.markers["alice"]
+        del source.markers["carol"]
+        source.backup()
+        dirname = os.path.join(collect_point.import_data_path, "dovecot")
+        self.assertEqual(["bob"], os.listdir(dirname))
+        self.assertEqual({"bob": "2"}, source.info_data["users"])
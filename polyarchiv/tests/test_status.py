@@ -0,0 +1,90 @@
+# coding=utf-8
+from __future__ import unicode_literals
+
+import datetime
+import os
+import shutil
+import tempfile
+from unittest import TestCase
+
+from polyarchiv.backup_points import TarArchive
+from polyarchiv.collect_points import FileRepository
+from polyarchiv.points import Config, PointInfo
+from polyarchiv.runner import Runner
+from polyarchiv.status import StatusIndex
+from polyarchiv.utils import get_is_time_elapsed
+
+
+class TestStatusIndex(TestCase):
+    def setUp(self):
+        self.dirname = tempfile.mkdtemp(prefix="status")
+        self.index = StatusIndex(os.path.join(self.dirname, "lib", "status.json"))
+
+    def tearDown(self):
+        shutil.rmtree(self.dirname)
+
+    def test_check(self):
+        self.assertEqual(3, self.index.check()[0])
+        daily = get_is_time_elapsed("daily")
+        last_success = datetime.datetime(2016, 6, 15, 12, 0, 0)
+        self.index.update(
+            [
+                ("repo1", PointInfo(last_success=last_success), daily),
+                ("repo1:remote", PointInfo(last_success=last_success), daily),
+            ]
+        )
+        now = datetime.datetime(2016, 6, 16, 11, 0, 0)
+        self.assertEqual((0, []), self.index.check(now))
+        return_code, errors = self.index.check(datetime.datetime(2016, 6, 16, 13, 0))
+        self.assertEqual(1, return_code)
+        self.assertEqual(
+            "the last backup of repo1 is out of date: 2016-06-15 12:00:00", errors[0]
+        )
+        # other points are kept
+        failed = PointInfo(last_success=last_success, last_state_valid=False)
+        failed.last_message = "disk full"
+        self.index.update([("repo1:remote", failed, daily)])
+        self.assertEqual(
+            (2, ["the last backup of repo1:remote has failed. disk full"]),
+            self.index.check(now),
+        )
+        self.index.update([("repo2", PointInfo(), daily)])
+        self.assertEqual(["repo1", "repo1:remote", "repo2"], sorted(self.index.load()))
+        self.assertIn("no successful backup of repo2", self.index.check(now)[1])
+        # removed points
+        self.index.update([], names={"repo1", "repo2"})
+        self.assertEqual(["repo1", "repo2"], sorted(self.index.load()))
+
+    def test_runner(self):
+        config = Config()
+        runner = Runner([], status_file=self.index.path, config=config, verbosity=0)
+        for name in ("repo1", "repo2"):
+            runner.collect_points[name] = FileRepository(
+                name, local_path=os.path.join(self.dirname, name), config=config
+            )
+        runner.backup_points["remote"] = TarArchive(
+            "remote", remote_url="file:///backups/{name}.tar.gz", config=config
+        )
+        self.index.update([("old", PointInfo(), get_is_time_elapsed("daily"))])
+        runner.update_status_index({"repo1": True}, {})
+        # configured points that have never run are added, removed points are dropped
+        self.assertEqual(
+            ["repo1", "repo1:remote", "repo2", "repo2:remote"],
+            sorted(self.index.load()),
+        )
+        del runner.collect_points["repo2"]
+        runner.associations = None
+        runner.update_status_index({"repo1": True}, {})
+        self.assertEqual(["repo1", "repo1:remote"], sorted(self.index.load()))
+
+    def test_long_frequency(self):
+        # 100 days: longer than the first delays of the search
+        last_success = datetime.datetime(2016, 6, 15, 12, 0, 0)
+        info = PointInfo(last_success=last_success)
+        self.index.update([("repo1", info, get_is_time_elapsed("8640000"))])
+        self.assertEqual((0, []), self.index.check(datetime.datetime(2016, 9, 1)))
+        self.assertEqual(1, self.index.check(datetime.datetime(2016, 9, 24))[0])
+        # never out of date
+        self.index.update([("repo1", info, lambda current_time, previous_time: False)])
+        self.assertIsNone(self.index.load()["repo1"]["due"])
+        self.assertEqual((0, []), self.index.check(datetime.datetime(2030, 1, 1)))
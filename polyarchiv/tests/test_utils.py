@@ -2,12 +2,13 @@
 from __future__ import unicode_literals
 
 import codecs
+import filecmp
 import os
 import shutil
 import tempfile
 from unittest import TestCase
 
-from polyarchiv.utils import copytree
+from polyarchiv.utils import copytree, clone_file
 
 
 class TestCopyTree(TestCase):
@@ -27,3 +28,57 @@ class TestCopyTree(TestCase):
         copytree(src_dir, dst_dir)
         shutil.rmtree(src_dir)
         shutil.rmtree(dst_dir)
+
+    def test_copytree_content(self):
+        src_dir = tempfile.mkdtemp(prefix="copytree-src")
+        dst_dir = tempfile.mkdtemp(prefix="copytree-dst")
+        os.makedirs(os.path.join(src_dir, "dir1", "dir2"))
+        file3 = os.path.join("dir1", "dir2", "file3")
+        for name in ("file1", os.path.join("dir1", "file2"), file3):
+            with codecs.open(os.path.join(src_dir, name), "w", encoding="utf-8") as fd:
+                fd.write(name * 1000)
+        os.symlink("file1", os.path.join(src_dir, "link1"))
+        for threads in (1, 4):
+            copytree(src_dir, dst_dir, symlinks=True, threads=threads)
+            self.assertEqual([], filecmp.dircmp(src_dir, dst_dir).diff_files)
+            self.assertEqual("file1", os.readlink(os.path.join(dst_dir, "link1")))
+            with codecs.open(os.path.join(dst_dir, file3), "r", encoding="utf-8") as fd:
+                self.assertEqual(file3 * 1000, fd.read())
+        shutil.rmtree(src_dir)
+        shutil.rmtree(dst_dir)
+
+    def test_clone_file(self):
+        src_dir = tempfile.mkdtemp(prefix="clone-file")
+        src_path = os.path.join(src_dir, "src")
+        dst_path = os.path.join(src_dir, "dst")
+        with open(src_path, "wb") as fd:
+            fd.write(os.urandom(100000))
+        os.chmod(src_path, 0o640)
+        clone_file(src_path, dst_path)
+        self.assertTrue(filecmp.cmp(src_path, dst_path, shallow=False))
+        self.assertEqual(os.stat(src_path).st_mode, os.stat(dst_path).st_mode)
+        self.assertNotEqual(os.stat(src_path).st_ino, os.stat(dst_path).st_ino)
+        shutil.rmtree(src_dir)
+
+    def test_copytree_incremental(self):
+        src_dir = tempfile.mkdtemp(prefix="copytree-src")
+        dst_dir = tempfile.mkdtemp(prefix="copytree-dst")
+        os.makedirs(os.path.join(src_dir, "dir1"))
+        for name in ("file1", "file2", os.path.join("dir1", "file3")):
+            with codecs.open(os.path.join(src_dir, name), "w", encoding="utf-8") as fd:
+                fd.write(name)
+        copytree(src_dir, dst_dir)
+        kept_inode = os.stat(os.path.join(dst_dir, "file1")).st_ino
+        os.remove(os.path.join(src_dir, "file2"))
+        shutil.rmtree(os.path.join(src_dir, "dir1"))
+        with codecs.open(os.path.join(src_dir, "dir1"), "w", encoding="utf-8") as fd:
+            fd.write("dir1 is now a file")
+        os.makedirs(os.path.join(src_dir, "dir2"))
+        with codecs.open(os.path.join(dst_dir, "extra"), "w", encoding="utf-8") as fd:
+            fd.write("only in the destination")
+        copytree(src_dir, dst_dir, incremental=True)
+        self.assertEqual(sorted(os.listdir(src_dir)), sorted(os.listdir(dst_dir)))
+        self.assertTrue(os.path.isfile(os.path.join(dst_dir, "dir1")))
+        self.assertEqual(kept_inode, os.stat(os.path.join(dst_dir, "file1")).st_ino)
+        shutil.rmtree(src_dir)
+        shutil.rmtree(dst_dir)
@@ -3,12 +3,25 @@ from __future__ import unicode_literals
 
 import datetime
 import getpass
+import hashlib
+import io
 import os
 import pipes
 import re
 import shutil
 import socket
 import sys
+from multiprocessing.pool import ThreadPool
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+try:
+    # noinspection PyCompatibility
+    from os import scandir
+except ImportError:
+    scandir = None
 
 try:
     # noinspection PyCompatibility
@@ -32,6 +45,10 @@ else:
 
 DEFAULT_EMAIL = "%s@%s" % (getpass.getuser(), socket.getfqdn())
 DEFAULT_USERNAME = getpass.getuser()
+FICLONE = 0x40049409  # _IOW(0x94, 9, int), see ioctl_ficlone(2)
+COPY_CHUNK_SIZE = 8 * 1024 * 1024
+COPYTREE_THREADS = 4
+COPYTREE_BATCH_SIZE = 1024
 
 
 def smart_quote(y):
@@ -284,37 +301,223 @@ class cached_property(object):
         return res
 
 
-def copytree(src, dst, symlinks=False):
-    """copy all files from the source to the destination using hard links if possible"""
+def _try_reflink(src_fd, dst_fd):
+    """try to share the extents of `src_fd` with `dst_fd` (copy-on-write clone, supported by btrfs, XFS, …).
+    Return False if the underlying filesystem cannot do it."""
+    if fcntl is None or not sys.platform.startswith("linux"):
+        return False
+    try:
+        fcntl.ioctl(dst_fd.fileno(), FICLONE, src_fd.fileno())
+    except (IOError, OSError):
+        return False
+    return True
+
+
+def _copy_file_data(src_fd, dst_fd):
+    """copy the content of `src_fd` to `dst_fd` in the kernel if possible (copy_file_range, then sendfile)"""
+    src_no, dst_no = src_fd.fileno(), dst_fd.fileno()
+    copy_file_range = getattr(os, "copy_file_range", None)
+    sendfile = getattr(os, "sendfile", None)
+    copied = 0
+    if copy_file_range is not None:
+        try:
+            while True:
+                count = copy_file_range(src_no, dst_no, COPY_CHUNK_SIZE)
+                if count == 0:
+                    return
+                copied += count
+        except OSError:
+            if copied:
+                raise
+    if sendfile is not None:
+        try:
+            while True:
+                count = sendfile(dst_no, src_no, copied, COPY_CHUNK_SIZE)
+                if count == 0:
+                    return
+                copied += count
+        except OSError:
+            if copied:
+                raise
+    shutil.copyfileobj(src_fd, dst_fd, COPY_CHUNK_SIZE)
+
+
+def clone_file(src, dst):
+    """copy a regular file with its metadata, using a reflink when the filesystem allows it,
+    and in-kernel copies otherwise"""
+    with open(src, "rb") as src_fd:
+        with open(dst, "wb") as dst_fd:
+            if not _try_reflink(src_fd, dst_fd):
+                _copy_file_data(src_fd, dst_fd)
+    shutil.copystat(src, dst)
+
+
+def link_or_clone_file(src, dst):
+    """hard link `src` to `dst`, or copy it if hard links are not allowed (other device, EMLINK, …)"""
+    try:
+        os.link(src, dst)
+    except OSError:
+        clone_file(src, dst)
+        return
+    shutil.copystat(src, dst)
+
+
+def copytree(src, dst, symlinks=False, threads=COPYTREE_THREADS, incremental=False):
+    """copy all files from the source to the destination using hard links if possible.
+
+    Files on another device are cloned with reflinks (btrfs subvolumes, XFS) or copied in the kernel.
+    Directories are walked in the calling thread, that sends the files to the `threads` workers by batches of
+    `COPYTREE_BATCH_SIZE` (the next batch is built while the previous one is copied).
+    If `incremental` is True and `dst` is already a directory, only new, modified or removed entries are updated.
+    """
     if src == dst:
         return
     if not os.path.exists(dst):  # required to check the underlying device
         os.makedirs(dst)
     dst_st_dev = os.stat(dst).st_dev
-    if os.path.isdir(dst):
-        shutil.rmtree(dst)
-    elif os.path.exists(dst):
-        os.unlink(dst)
-    if os.stat(src).st_dev != dst_st_dev:
-        shutil.copytree(src, dst, symlinks=symlinks)
-        return
-    os.makedirs(dst)
-    shutil.copystat(src, dst)
+    copy_file = link_or_clone_file if os.stat(src).st_dev == dst_st_dev else clone_file
+    dirnames_to_update = [(src, dst)]
+    if incremental and scandir is not None and os.path.isdir(dst):
+        jobs = _iter_updated_files(dirnames_to_update, symlinks)
+    else:
+        if os.path.isdir(dst):
+            shutil.rmtree(dst)
+        elif os.path.exists(dst):
+            os.unlink(dst)
+        os.makedirs(dst)
+        jobs = _iter_copied_files(dirnames_to_update, symlinks)
+    if threads > 1:
+        pool = ThreadPool(threads)
+        try:
+            pending_batch = None
+            for batch in _iter_batches(jobs, COPYTREE_BATCH_SIZE):
+                next_batch = pool.map_async(_copy_file_job(copy_file), batch, 64)
+                if pending_batch is not None:
+                    pending_batch.get()
+                pending_batch = next_batch
+            if pending_batch is not None:
+                pending_batch.get()
+        finally:
+            pool.close()
+            pool.join()
+    else:
+        for src_path, dst_path in jobs:
+            copy_file(src_path, dst_path)
+    # directory times must be set after their content has been written
+    for src_path, dst_path in reversed(dirnames_to_update):
+        shutil.copystat(src_path, dst_path)
+
+
+def _iter_copied_files(dirnames_to_update, symlinks):
+    """create the directories and the symlinks of `src` in `dst` and yield the files to copy.
+    Created directories are appended to `dirnames_to_update`, initialized with `[(src, dst)]`."""
+    src, dst = dirnames_to_update[0]
     for root, dirnames, filenames in os.walk(src):
         for src_dirname in dirnames:
             src_path = os.path.join(root, src_dirname)
             dst_path = os.path.join(dst, os.path.relpath(src_path, src))
+            if symlinks and os.path.islink(src_path):
+                os.symlink(os.readlink(src_path), dst_path)
+                continue
             os.makedirs(dst_path)
-            shutil.copystat(src_path, dst_path)
+            dirnames_to_update.append((src_path, dst_path))
         for src_filename in filenames:
             src_path = os.path.join(root, src_filename)
             dst_path = os.path.join(dst, os.path.relpath(src_path, src))
             if symlinks and os.path.islink(src_path):
-                linkto = os.readlink(src_path)
-                os.symlink(linkto, dst_path)
+                os.symlink(os.readlink(src_path), dst_path)
             else:
-                os.link(src_path, dst_path)
-                shutil.copystat(src_path, dst_path)
+                yield src_path, dst_path
+
+
+def _remove_path(path, is_dir):
+    if is_dir:
+        shutil.rmtree(path)
+    else:
+        os.unlink(path)
+
+
+def _iter_updated_files(dirnames_to_update, symlinks):
+    """compare `src` and `dst` with the stat data given by `os.scandir`, remove obsolete entries of `dst`
+    and yield the files that must be copied again.
+    Visited directories are appended to `dirnames_to_update`, initialized with `[(src, dst)]`."""
+    index = 0
+    while index < len(dirnames_to_update):
+        src_dir, dst_dir = dirnames_to_update[index]
+        index += 1
+        src_entries = {entry.name: entry for entry in scandir(src_dir)}
+        dst_entries = {entry.name: entry for entry in scandir(dst_dir)}
+        for name, dst_entry in dst_entries.items():
+            if name not in src_entries:
+                _remove_path(dst_entry.path, dst_entry.is_dir(follow_symlinks=False))
+        for name, src_entry in src_entries.items():
+            dst_entry = dst_entries.get(name)
+            dst_path = os.path.join(dst_dir, name)
+            dst_is_dir = dst_entry is not None and dst_entry.is_dir(
+                follow_symlinks=False
+            )
+            if src_entry.is_symlink() and (symlinks or src_entry.is_dir()):
+                # symlinks to directories are never followed
+                if symlinks:
+                    link_to = os.readlink(src_entry.path)
+                    if dst_entry is not None and dst_entry.is_symlink():
+                        if os.readlink(dst_path) == link_to:
+                            continue
+                    if dst_entry is not None:
+                        _remove_path(dst_path, dst_is_dir)
+                    os.symlink(link_to, dst_path)
+                elif not dst_is_dir:
+                    if dst_entry is not None:
+                        _remove_path(dst_path, False)
+                    os.makedirs(dst_path)
+                continue
+            if src_entry.is_dir():
+                if not dst_is_dir:
+                    if dst_entry is not None:
+                        _remove_path(dst_path, False)
+                    os.makedirs(dst_path)
+                dirnames_to_update.append((src_entry.path, dst_path))
+                continue
+            if dst_entry is not None and not dst_is_dir and not dst_entry.is_symlink():
+                src_stat = src_entry.stat()
+                dst_stat = dst_entry.stat()
+                if (src_stat.st_ino, src_stat.st_dev) == (
+                    dst_stat.st_ino,
+                    dst_stat.st_dev,
+                ):
+                    continue  # hard link
+                if (
+                    src_stat.st_size == dst_stat.st_size
+                    and int(src_stat.st_mtime) == int(dst_stat.st_mtime)
+                    and src_stat.st_mode == dst_stat.st_mode
+                ):
+                    continue
+            if dst_entry is not None:
+                _remove_path(dst_path, dst_is_dir)
+            yield src_entry.path, dst_path
+
+
+def _iter_batches(values, size):
+    """yield lists of at most `size` consecutive values
+
+    >>> list(_iter_batches(range(5), 2))
+    [[0, 1], [2, 3], [4]]
+    """
+    batch = []
+    for value in values:
+        batch.append(value)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def _copy_file_job(copy_file):
+    def job(paths):
+        copy_file(*paths)
+
+    return job
 
 
 def normalize_ssh_url(url):
@@ -421,6 +624,31 @@ class FileContentMonitor(object):
             self.fd.close()
 
 
+def write_file_atomic(path, content, mode=0o666):
+    """Write a text file: `content` is written to a temporary file in the same folder,
+    flushed to the disk and then renamed to `path`.
+    The file is created with the permissions `mode` (modified by the umask)."""
+    tmp_path = "%s.%d.tmp" % (path, os.getpid())
+    tmp_fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, mode)
+    with io.open(tmp_fd, "w", encoding="utf-8") as fd:
+        fd.write(content)
+        fd.flush()
+        os.fsync(fd.fileno())
+    os.rename(tmp_path, path)
+
+
+def get_sha256(path):
+    """Return the SHA-256 hash of a file"""
+    checksum = hashlib.sha256()
+    with open(path, "rb") as fd:
+        for block in iter(lambda: fd.read(COPY_CHUNK_SIZE), b""):
+            checksum.update(block)
+    return checksum.hexdigest()
+
+
+TIME_VARIABLES = "aAwdbBmyYHIpMSfzZjUWcxX"
+
+
 def base_variables(use_constants=False):
     common_values = {}
     if use_constants:
@@ -438,6 +666,6 @@ def base_variables(use_constants=False):
     common_values.update(
         {"fqdn": fqdn, "hostname": fqdn.partition(".")[0], "username": username}
     )
-    common_values.update({x: now.strftime("%" + x) for x in "aAwdbBmyYHIpMSfzZjUWcxX"})
+    common_values.update({x: now.strftime("%" + x) for x in TIME_VARIABLES})
     # ^ all available values for datetime
     return common_values
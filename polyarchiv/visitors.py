@@ -248,6 +248,9 @@ class CheckVisitor(Visitor):
         self.warnings = []
         self.infos = []
 
+    def visit_backup_point_collect_points(self, runner, backup_point, collect_points):
+        backup_point.prefetch_metadata(collect_points)
+
     def visit_collect_point(self, runner, collect_point_):
         assert isinstance(collect_point_, CollectPoint)
         name = collect_point_.name